@@ -36,53 +36,32 @@ bool compare_point_lists(vector<vector<Point> > &a, vector<vector<Point> > &b)
 
 int aut_group_size(vector<vector<Point> > &triangles)
 {
-    const unsigned int n = triangles.size();
-    
-    vector<vector<Point> > &identity_image = triangles;
-    vector<vector<Point> > rot_image(n), rot_inverse_image(n), reflect1_image(n), reflect2_image(n), reflect3_image(n);
-
-    // Calculate the images under the group S_3.
-    transform(triangles.begin(), triangles.end(), rot_image.begin(),            rotate_equilateral_on_triangle_points);
-    transform(triangles.begin(), triangles.end(), rot_inverse_image.begin(),    rotate_equilateral_on_triangle_points_inverse);
-    transform(triangles.begin(), triangles.end(), reflect1_image.begin(),       reflect1_on_triangle);
-    transform(triangles.begin(), triangles.end(), reflect2_image.begin(),       reflect2_on_triangle);
-    transform(triangles.begin(), triangles.end(), reflect3_image.begin(),       reflect3_on_triangle);
-
-    vector<vector<Rational> > identity_image_12lists(n), rot_image_12lists(n), rot_inverse_image_12lists(n),
-                              reflect1_image_12lists(n), reflect2_image_12lists(n), reflect3_image_12lists(n);
-
-    transform(identity_image.begin(),       identity_image.end(),       identity_image_12lists.begin(),         triangle_to_12list);
-    transform(rot_image.begin(),            rot_image.end(),            rot_image_12lists.begin(),              triangle_to_12list);
-    transform(rot_inverse_image.begin(),    rot_inverse_image.end(),    rot_inverse_image_12lists.begin(),      triangle_to_12list);
-    transform(reflect1_image.begin(),       reflect1_image.end(),       reflect1_image_12lists.begin(),         triangle_to_12list);
-    transform(reflect2_image.begin(),       reflect2_image.end(),       reflect2_image_12lists.begin(),         triangle_to_12list);
-    transform(reflect3_image.begin(),       reflect3_image.end(),       reflect3_image_12lists.begin(),         triangle_to_12list);
-
-    sort(identity_image_12lists.begin(),        identity_image_12lists.end());
-    sort(rot_image_12lists.begin(),             rot_image_12lists.end());
-    sort(rot_inverse_image_12lists.begin(),     rot_inverse_image_12lists.end());
-    sort(reflect1_image_12lists.begin(),        reflect1_image_12lists.end());
-    sort(reflect2_image_12lists.begin(),        reflect2_image_12lists.end());
-    sort(reflect3_image_12lists.begin(),        reflect3_image_12lists.end());
+    // The number of images under S_3 that are equal to the least image
+    // is the order of the automorphism group.
+    vector<point_map> symmetries = symmetries_of_point();
+    vector<vector<Rational> > least;
 
+    int aut_size = least_image(triangles, symmetries, least);
 
+    assert(aut_size == 1 || aut_size == 2 || aut_size == 3 || aut_size == 6); // yay group theory
 
+    return aut_size;
+}
 
-    int aut_size = 1; // there is always the identity
+// Signatures written by 'td --aut-groups' are prefixed with the order of the
+// automorphism group, in which case we just read it off. Otherwise, return 0.
+int aut_group_size_prefix(std::string &line)
+{
+    std::vector<std::string> strs;
+    boost::split(strs, line, boost::is_any_of(" "));
 
-    // if (compare_point_lists(reflect1_image,     identity_image))    aut_size += 1;
-    // if (compare_point_lists(reflect2_image,     identity_image))    aut_size += 1;
-    // if (compare_point_lists(reflect3_image,     identity_image))    aut_size += 1;
-    // if (compare_point_lists(rot_image,          identity_image))    aut_size += 1;
-    // if (compare_point_lists(rot_inverse_image,  identity_image))    aut_size += 1;
+    // 12 entries per triangle and the trailing newline.
+    if (strs.size() % 12 != 2) return 0;
 
-    if (rot_image_12lists               == identity_image_12lists)  aut_size += 1;
-    if (rot_inverse_image_12lists       == identity_image_12lists)  aut_size += 1;
-    if (reflect1_image_12lists          == identity_image_12lists)  aut_size += 1;
-    if (reflect2_image_12lists          == identity_image_12lists)  aut_size += 1;
-    if (reflect3_image_12lists          == identity_image_12lists)  aut_size += 1;
+    int aut_size = atoi(strs.at(0).c_str());
+    assert(aut_size == 1 || aut_size == 2 || aut_size == 3 || aut_size == 6);
 
-    assert(aut_size == 1 || aut_size == 2 || aut_size == 3 || aut_size == 6); // yay group theory
+    line = line.substr(strs.at(0).size() + 1);
 
     return aut_size;
 }
@@ -109,8 +88,14 @@ int main()
 #endif
 
     while (getline(cin, line)) {
-        vector<vector<Point> > triangles = parse_csig_line(line);
-        aut_group_size_counts[aut_group_size(triangles)] += 1;
+        int aut_size = aut_group_size_prefix(line);
+
+        if (aut_size == 0) {
+            vector<vector<Point> > triangles = parse_csig_line(line);
+            aut_size = aut_group_size(triangles);
+        }
+
+        aut_group_size_counts[aut_size] += 1;
 
 #ifdef SIZE_24_STATUS_OUTPUT
         counter++;
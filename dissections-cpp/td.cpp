@@ -15,6 +15,11 @@ using namespace std;
 
 // <globals>
 bool only_separated;
+bool print_aut_group_size;
+bool all_identities;
+bool check_orbits;
+bool solve_swapped;
+bool check_swap;
 // </globals>
 
 
@@ -445,82 +450,300 @@ void print_list_of_12lists(FILE *f, vector<vector<Rational> > lists)
     fprintf(f, "\n");
 }
 
-void print_canonical_signature(vector<vector<Point> > &triangles, const unsigned int T1_size)
+// Find the canonical signature of the dissection, as the least image of its
+// triangles and the order of its automorphism group. Returns false (and
+// leaves least alone) for a dissection with fewer than T1_size triangles.
+bool canonical_signature(vector<vector<Point> > &triangles, const unsigned int T1_size,
+                         vector<vector<Rational> > &least, unsigned int &aut_group_size)
 {
     const unsigned int n = triangles.size();
 
     // If this is a smaller dissection, don't print it. We know that this dissection
     // will be produced by a smaller bitrade.
-    if (T1_size != n) return;
+    if (T1_size != n) return false;
 
     // Transform the input points to the equilateral space.
     transform_triangles_to_equilateral(triangles);
 
     assert(triangles.size() == n);
 
-    vector<vector<Point> > &identity_image = triangles;
-    vector<vector<Point> > rot_image(n), rot_inverse_image(n), reflect1_image(n), reflect2_image(n), reflect3_image(n);
-
-    // Calculate the images under the group S_3.
-    transform(triangles.begin(), triangles.end(), rot_image.begin(),            rotate_equilateral_on_triangle_points);
-    transform(triangles.begin(), triangles.end(), rot_inverse_image.begin(),    rotate_equilateral_on_triangle_points_inverse);
-    transform(triangles.begin(), triangles.end(), reflect1_image.begin(),       reflect1_on_triangle);
-    transform(triangles.begin(), triangles.end(), reflect2_image.begin(),       reflect2_on_triangle);
-    transform(triangles.begin(), triangles.end(), reflect3_image.begin(),       reflect3_on_triangle);
-
-    // A point (x, y) is equivalent to a 4-tuple (xa, xb, ya, yb).
-    // I want to store the whole triangle in the canonical signature, so that's going to be 3 4-tuples:
-    // (x1a, x1b, y1a, y1b) (x2a, x2b, y2a, y2b) (x3a, x3b, y3a, y3b)
-    //
-    // A triangle is a list of 3-tuples:
-    //
-    // t = [(x1a, x1b, y1a, y1b) (x2a, x2b, y2a, y2b) (x3a, x3b, y3a, y3b)]
-    //
-    // An image is a list of these triangles:
-    //
-    // im = [t1, t2, t3, t4]
-    //
-    // So we need to convert a triangle into a 12-list
-
-    vector<vector<Rational> > identity_image_12lists(n), rot_image_12lists(n), rot_inverse_image_12lists(n),
-                              reflect1_image_12lists(n), reflect2_image_12lists(n), reflect3_image_12lists(n);
-
-    transform(identity_image.begin(),       identity_image.end(),       identity_image_12lists.begin(),         triangle_to_12list);
-    transform(rot_image.begin(),            rot_image.end(),            rot_image_12lists.begin(),              triangle_to_12list);
-    transform(rot_inverse_image.begin(),    rot_inverse_image.end(),    rot_inverse_image_12lists.begin(),      triangle_to_12list);
-    transform(reflect1_image.begin(),       reflect1_image.end(),       reflect1_image_12lists.begin(),         triangle_to_12list);
-    transform(reflect2_image.begin(),       reflect2_image.end(),       reflect2_image_12lists.begin(),         triangle_to_12list);
-    transform(reflect3_image.begin(),       reflect3_image.end(),       reflect3_image_12lists.begin(),         triangle_to_12list);
-
-
-    sort(identity_image_12lists.begin(),        identity_image_12lists.end());
-    sort(rot_image_12lists.begin(),             rot_image_12lists.end());
-    sort(rot_inverse_image_12lists.begin(),     rot_inverse_image_12lists.end());
-    sort(reflect1_image_12lists.begin(),        reflect1_image_12lists.end());
-    sort(reflect2_image_12lists.begin(),        reflect2_image_12lists.end());
-    sort(reflect3_image_12lists.begin(),        reflect3_image_12lists.end());
-
-    // Choose the lexicographically minimal signature.
-    vector<vector<vector<Rational> > > all_images;
-    all_images.push_back(identity_image_12lists);
-    all_images.push_back(rot_image_12lists);
-    all_images.push_back(rot_inverse_image_12lists);
-    all_images.push_back(reflect1_image_12lists);
-    all_images.push_back(reflect2_image_12lists);
-    all_images.push_back(reflect3_image_12lists);
-
-    sort(all_images.begin(), all_images.end());
-
-    print_list_of_12lists(stdout, all_images[0]);
+    // Choose the lexicographically minimal image under the group S_3. Each
+    // triangle is converted to a 12-list of the 4-lists (xa, xb, ya, yb) of
+    // its vertices, where a point (x, y) is (xa + xb*sqrt(3), ya + yb*sqrt(3)).
+    vector<point_map> symmetries = symmetries_of_point();
+
+    // The number of images equal to the least one is the order of the
+    // automorphism group of the dissection.
+    aut_group_size = least_image(triangles, symmetries, least);
+
+    return true;
+}
+
+void print_canonical_signature(vector<vector<Rational> > &least, unsigned int aut_group_size)
+{
+    if (print_aut_group_size) printf("%u ", aut_group_size);
+
+    print_list_of_12lists(stdout, least);
+}
+
+// A canonical signature and the order of the automorphism group of its dissection.
+typedef pair<vector<vector<Rational> >, unsigned int> Signature;
+
+/*
+Solve the system for the identity triple using the equations from Ta, take the
+triangles from Tb (so (Ta, Tb) is (T1, T2) or (T2, T1)) and find the canonical
+signature. Returns false if there is no (separated) solution or the dissection
+comes from a smaller bitrade.
+ */
+bool dissection_signature(int nr_rows, int nr_cols, int nr_syms, Triple identity_triple,
+                          vector<Triple> &Ta, vector<Triple> &Tb,
+                          vector<vector<Rational> > &least, unsigned int &aut_group_size)
+{
+    vector<Rational> solution(3 + Ta.size() - 1);
+    calculate_bitrade_solution(nr_rows, nr_cols, nr_syms, identity_triple, Ta, Tb, solution);
+    if (only_separated && !is_separated_solution(solution, nr_rows, nr_cols, nr_syms)) return false;
+
+    #if 0
+    printf("solution: ");
+    for(vector<Rational>::iterator ratIter = solution.begin(); ratIter != solution.end(); ratIter++) {
+        print_rational(stdout, *ratIter); printf(" ");
+    }
+    printf("\n");
+    #endif
+
+    vector<vector<Point> > triangles = triples_to_triangles(nr_rows, nr_cols, Tb, solution);
+
+    return canonical_signature(triangles, Ta.size(), least, aut_group_size);
+}
+
+// Number the cells of the bitrade in the order that a breadth first search
+// from the cell start along tau_1, tau_2, tau_3 finds them, and return the
+// taus in this numbering (empty if the search does not reach every cell).
+vector<int> relabelled_taus(vector<int> &taus, int n, int start)
+{
+    vector<int> label(n, -1);
+    vector<int> order;
+
+    label[start] = 0;
+    order.push_back(start);
+
+    for(unsigned int i = 0; i < order.size(); i++) {
+        for(int t = 0; t < 3; t++) {
+            int y = taus[t*n + order[i]];
+            if (label[y] < 0) {
+                label[y] = order.size();
+                order.push_back(y);
+            }
+        }
+    }
+
+    vector<int> form;
+    if ((int) order.size() < n) return form;
+
+    for(int t = 0; t < 3; t++)
+        for(int i = 0; i < n; i++)
+            form.push_back(label[taus[t*n + order[i]]]);
+
+    return form;
+}
+
+// The permutations tau_1, tau_2, tau_3 of the cells of the bitrade (T1, T2)
+// (see bbitrade.py in dissections-sage), with the cells numbered as in T1:
+// taus[t*n + k] is the image of cell k under tau_{t+1}.
+vector<int> bitrade_taus(int nr_rows, int nr_cols, int nr_syms, vector<Triple> &T1, vector<Triple> &T2)
+{
+    const int n = T1.size();
+
+    vector<int> cell(nr_rows*nr_cols, -1);
+    vector<int> row_sym1(nr_rows*nr_syms, -1), col_sym1(nr_cols*nr_syms, -1);
+    vector<int> row_sym2(nr_rows*nr_syms, -1), col_sym2(nr_cols*nr_syms, -1);
+    vector<int> syms2(n, -1);
+
+    for(int k = 0; k < n; k++) {
+        cell[T1[k].r*nr_cols + T1[k].c]     = k;
+        row_sym1[T1[k].r*nr_syms + T1[k].s] = k;
+        col_sym1[T1[k].c*nr_syms + T1[k].s] = k;
+    }
+
+    for(int i = 0; i < n; i++) {
+        int k = cell[T2[i].r*nr_cols + T2[i].c];
+        assert(k >= 0);
+
+        syms2[k] = T2[i].s;
+        row_sym2[T2[i].r*nr_syms + T2[i].s] = k;
+        col_sym2[T2[i].c*nr_syms + T2[i].s] = k;
+    }
+
+    vector<int> taus(3*n);
+
+    for(int k = 0; k < n; k++) {
+        const Triple &t = T1[k];
+
+        taus[k]       = row_sym1[t.r*nr_syms + syms2[k]];
+        taus[n + k]   = col_sym2[t.c*nr_syms + t.s];
+        taus[2*n + k] = col_sym1[T1[row_sym2[t.r*nr_syms + t.s]].c*nr_syms + t.s];
+    }
+
+    return taus;
+}
+
+/*
+The orbits of the autotopism group of the bitrade (T1, T2) on its cells,
+which are numbered as in T1. Identity triples in the same orbit give
+congruent dissections, in both (T1, T2) and (T2, T1). Returns orbit_rep where
+orbit_rep[k] is the least cell in the orbit of cell k.
+
+The taus generate a transitive group and the autotopisms are the
+permutations of the cells that commute with the taus, so an autotopism is
+fixed by the image of one cell: cells x and y are in the same orbit exactly
+when the taus relabelled from x and from y are the same. If the taus are not
+transitive every cell is its own orbit.
+ */
+vector<int> cell_orbits(int nr_rows, int nr_cols, int nr_syms, vector<Triple> &T1, vector<Triple> &T2)
+{
+    const int n = T1.size();
+
+    vector<int> taus = bitrade_taus(nr_rows, nr_cols, nr_syms, T1, T2);
+
+    vector<vector<int> > forms(n);
+    vector<int> orbit_rep(n);
+
+    for(int x = 0; x < n; x++) {
+        forms[x] = relabelled_taus(taus, n, x);
+        orbit_rep[x] = x;
+
+        if (forms[x].empty()) continue;
+
+        for(int y = 0; y < x; y++) {
+            if (forms[y] == forms[x]) {
+                orbit_rep[x] = orbit_rep[y];
+                break;
+            }
+        }
+    }
+
+    return orbit_rep;
+}
+
+/*
+Is the swapped bitrade (T2, T1) isomorphic to a conjugate of (T1, T2), that
+is, to the bitrade we get by permuting the roles of rows, columns and symbols?
+If it is, there is a bijection phi of the cells such that the dissection of
+(T2, T1) with identity triple phi(k) is the image of the dissection of
+(T1, T2) with identity triple k under a symmetry of the triangle (see
+swap_isomorphism() in bbitrade.py and conjugate_point() in
+triangle_dissections.py), so the two give the same signatures and only
+(T1, T2) has to be solved. Otherwise the signatures of the two can differ.
+ */
+bool swap_is_conjugate(int nr_rows, int nr_cols, int nr_syms, vector<Triple> &T1, vector<Triple> &T2)
+{
+    const int n = T1.size();
+    const int conjugates[6][3] = {{0, 1, 2}, {1, 0, 2}, {0, 2, 1}, {2, 1, 0}, {1, 2, 0}, {2, 0, 1}};
+    const int dims[3] = {nr_rows, nr_cols, nr_syms};
+
+    vector<int> swapped_taus = bitrade_taus(nr_rows, nr_cols, nr_syms, T2, T1);
+    vector<int> swapped_form = relabelled_taus(swapped_taus, n, 0);
+    if (swapped_form.empty()) return false;
+
+    for(int j = 0; j < 6; j++) {
+        const int *p = conjugates[j];
+        vector<Triple> C1(n), C2(n);
+
+        for(int k = 0; k < n; k++) {
+            const int x1[3] = {T1[k].r, T1[k].c, T1[k].s};
+            const int x2[3] = {T2[k].r, T2[k].c, T2[k].s};
+
+            C1[k].r = x1[p[0]]; C1[k].c = x1[p[1]]; C1[k].s = x1[p[2]];
+            C2[k].r = x2[p[0]]; C2[k].c = x2[p[1]]; C2[k].s = x2[p[2]];
+        }
+
+        vector<int> taus = bitrade_taus(dims[p[0]], dims[p[1]], dims[p[2]], C1, C2);
+
+        for(int x = 0; x < n; x++)
+            if (relabelled_taus(taus, n, x) == swapped_form) return true;
+    }
+
+    return false;
+}
+
+/*
+Find the signatures of the dissections with identity triples Ta[i], where
+cell_of[i] is the cell of Ta[i] (numbered as in T1), and append them to
+signatures in the order of Ta. Only one identity triple in each orbit of cells
+is solved, unless all_identities is set. With check_orbits we solve the others
+as well and check that they give the same signature as their orbit's
+representative.
+ */
+void find_signatures(int nr_rows, int nr_cols, int nr_syms, vector<Triple> &Ta, vector<Triple> &Tb,
+                     vector<int> &cell_of, vector<int> &orbit_rep, vector<Signature> &signatures)
+{
+    const int n = Ta.size();
+
+    vector<bool> found(n, false);
+    vector<vector<vector<Rational> > > least(n);
+    vector<unsigned int> aut_group_size(n, 0);
+
+    for(int i = 0; i < n; i++) {
+        const int k = cell_of[i];
+        if (!all_identities && orbit_rep[k] != k) continue;
+
+        found[k] = dissection_signature(nr_rows, nr_cols, nr_syms, Ta[i], Ta, Tb, least[k], aut_group_size[k]);
+        if (found[k]) signatures.push_back(Signature(least[k], aut_group_size[k]));
+    }
+
+    if (!check_orbits || all_identities) return;
+
+    for(int i = 0; i < n; i++) {
+        const int k = cell_of[i];
+        if (orbit_rep[k] == k) continue;
+
+        vector<vector<Rational> > this_least;
+        unsigned int this_aut_group_size = 0;
+
+        const bool this_found = dissection_signature(nr_rows, nr_cols, nr_syms, Ta[i], Ta, Tb, this_least, this_aut_group_size);
+
+        const int rep = orbit_rep[k];
+        assert(this_found == found[rep]);
+        if (this_found) {
+            assert(this_least == least[rep]);
+            assert(this_aut_group_size == aut_group_size[rep]);
+        }
+    }
 }
 
 int main(int argc, const char* argv[])
 {
-    if (argc != 2) {
+    if (argc < 2) {
         fprintf(stderr, "Usage: just the separated dissections: td --separated\nseparated and nonseparated dissections: td --separated-and-nonseparated\n\n");
+        fprintf(stderr, "With --aut-groups each signature is prefixed with the order of its\nautomorphism group (see aut_groups.cpp).\n\n");
+        fprintf(stderr, "Identity triples in the same orbit of the autotopism group of the bitrade\ngive the same signature, so only one in each orbit is solved. With\n--all-identities every identity triple is solved; with --check-orbits\nthe others are solved too and checked against their orbit's signature.\n\n");
+        fprintf(stderr, "td solves every bitrade it reads, including both (T1, T2) and (T2, T1).\nIf (T2, T1) is isomorphic to a conjugate of (T1, T2) its signatures are\nthose of (T1, T2), so it is not solved. With --solve-swapped it is solved\nanyway; with --check-swap it is solved and checked against (T1, T2).\n\n");
         exit(1);
     }
 
+    print_aut_group_size = false;
+    all_identities = false;
+    check_orbits = false;
+    solve_swapped = false;
+    check_swap = false;
+
+    for(int i = 2; i < argc; i++) {
+        if (strcmp(argv[i], "--aut-groups") == 0) {
+            print_aut_group_size = true;
+        } else if (strcmp(argv[i], "--all-identities") == 0) {
+            all_identities = true;
+        } else if (strcmp(argv[i], "--check-orbits") == 0) {
+            check_orbits = true;
+        } else if (strcmp(argv[i], "--solve-swapped") == 0) {
+            solve_swapped = true;
+        } else if (strcmp(argv[i], "--check-swap") == 0) {
+            check_swap = true;
+        } else {
+            fprintf(stderr, "Unknown option: %s\n", argv[i]);
+            exit(1);
+        }
+    }
+
     const char *sep_or_nonsep = argv[1];
 
     if (strcmp(sep_or_nonsep, "--separated") == 0) {
@@ -536,62 +759,44 @@ int main(int argc, const char* argv[])
     vector<Triple> T1, T2;
 
     while(read_bitrade(nr_rows, nr_cols, nr_syms, nr_elements, T1, T2)) {
-        for(vector<Triple>::iterator tIter = T1.begin(); tIter != T1.end(); tIter++) {
-            vector<Rational> solution(3 + T1.size() - 1);
-            calculate_bitrade_solution(nr_rows, nr_cols, nr_syms, *tIter, T1, T2, solution);
-            if (only_separated && !is_separated_solution(solution, nr_rows, nr_cols, nr_syms)) continue;
-
-            #if 0
-            printf("solution: ");
-            for(vector<Rational>::iterator ratIter = solution.begin(); ratIter != solution.end(); ratIter++) {
-                print_rational(stdout, *ratIter); printf(" ");
-            }
-            printf("\n");
-            #endif
+        vector<int> orbit_rep = cell_orbits(nr_rows, nr_cols, nr_syms, T1, T2);
 
-            vector<vector<Point> > triangles = triples_to_triangles(nr_rows, nr_cols, T2, solution);
+        // The cell (numbered as in T1) of each triple of T1 and T2.
+        vector<int> T1_cells(T1.size()), T2_cells(T2.size());
+        vector<int> cell(nr_rows*nr_cols, -1);
 
-            #if 0
-            transform_to_equilateral(points);
-            printf("points from solution: ");
-            for(vector<Point>::iterator pIter = points.begin(); pIter != points.end(); pIter++) {
-                print_point(*pIter); printf(" ");
-            }
-            printf("\n");
-            #endif
-
-            print_canonical_signature(triangles, T1.size());
+        for(unsigned int k = 0; k < T1.size(); k++) {
+            T1_cells[k] = k;
+            cell[T1[k].r*nr_cols + T1[k].c] = k;
         }
 
-        for(vector<Triple>::iterator tIter = T2.begin(); tIter != T2.end(); tIter++) {
-            vector<Rational> solution(3 + T2.size() - 1);
-            calculate_bitrade_solution(nr_rows, nr_cols, nr_syms, *tIter, T2, T1, solution);
-            if (only_separated && !is_separated_solution(solution, nr_rows, nr_cols, nr_syms)) continue;
+        for(unsigned int i = 0; i < T2.size(); i++)
+            T2_cells[i] = cell[T2[i].r*nr_cols + T2[i].c];
 
-            #if 0
-            printf("solution: ");
-            for(vector<Rational>::iterator ratIter = solution.begin(); ratIter != solution.end(); ratIter++) {
-                print_rational(stdout, *ratIter); printf(" ");
-            }
-            printf("\n");
-            #endif
+        vector<Signature> T1_signatures, T2_signatures;
+        find_signatures(nr_rows, nr_cols, nr_syms, T1, T2, T1_cells, orbit_rep, T1_signatures);
 
-            vector<vector<Point> > triangles = triples_to_triangles(nr_rows, nr_cols, T1, solution);
+        if (!solve_swapped && swap_is_conjugate(nr_rows, nr_cols, nr_syms, T1, T2)) {
+            T2_signatures = T1_signatures;
 
-            #if 0
-            transform_to_equilateral(points);
-            printf("points from solution: ");
-            for(vector<Point>::iterator pIter = points.begin(); pIter != points.end(); pIter++) {
-                print_point(*pIter); printf(" ");
+            if (check_swap) {
+                vector<Signature> solved;
+                find_signatures(nr_rows, nr_cols, nr_syms, T2, T1, T2_cells, orbit_rep, solved);
+
+                sort(solved.begin(), solved.end());
+                sort(T2_signatures.begin(), T2_signatures.end());
+                assert(solved == T2_signatures);
             }
-            printf("\n");
-            #endif
-           
-            print_canonical_signature(triangles, T1.size());
+        } else {
+            find_signatures(nr_rows, nr_cols, nr_syms, T2, T1, T2_cells, orbit_rep, T2_signatures);
         }
+
+        for(unsigned int i = 0; i < T1_signatures.size(); i++)
+            print_canonical_signature(T1_signatures[i].first, T1_signatures[i].second);
+
+        for(unsigned int i = 0; i < T2_signatures.size(); i++)
+            print_canonical_signature(T2_signatures[i].first, T2_signatures[i].second);
     }
 
     return 0;
 }
-
-
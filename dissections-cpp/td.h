@@ -1,6 +1,8 @@
 #ifndef __CSIG__
 #define __CSIG__
 
+#include <algorithm>
+#include <map>
 #include <vector>
 #include "ratlib.h"
 
@@ -255,4 +257,193 @@ vector<Rational> triangle_to_12list(vector<Point> triangle)
 }
 
 
+
+typedef Point (*point_map)(Point);
+
+Point identity_on_point(Point p)
+{
+    return p;
+}
+
+// The six symmetries of the equilateral triangle, as maps on points.
+vector<point_map> symmetries_of_point()
+{
+    vector<point_map> symmetries;
+
+    symmetries.push_back(identity_on_point);
+    symmetries.push_back(rotate_equilateral);
+    symmetries.push_back(rotate_equilateral_inverse);
+    symmetries.push_back(reflect1);
+    symmetries.push_back(reflect2);
+    symmetries.push_back(reflect3);
+
+    return symmetries;
+}
+
+// Heap order on vertex indices: the vertex with the least image at the front.
+class VertexImageGreater
+{
+    public:
+
+    const vector<Point> *images;
+
+    VertexImageGreater(const vector<Point> *images) {
+        this->images = images;
+    }
+
+    bool operator()(unsigned int u, unsigned int v) const {
+        return images->at(v) < images->at(u);
+    }
+};
+
+// The image of a dissection under one symmetry, as 12-lists in increasing
+// order, produced one triangle at a time.
+//
+// The 12-lists are ordered by their least vertex first, so we map each vertex
+// once and then pop the vertices off a heap in the order of their images. When
+// a vertex comes off the heap we make the 12-lists of the triangles whose
+// least vertex it is. Nothing is built for the triangles after the ones that
+// are asked for.
+class ImageSweep
+{
+    public:
+
+    vector<Point> images;
+    vector<unsigned int> heap;
+    vector<vector<Rational> > group;
+    unsigned int next;
+
+    void init(const vector<Point> &vertices, point_map symmetry) {
+        images.resize(vertices.size());
+        heap.resize(vertices.size());
+
+        for(unsigned int v = 0; v < vertices.size(); v++) {
+            images[v] = symmetry(vertices[v]);
+            heap[v] = v;
+        }
+
+        make_heap(heap.begin(), heap.end(), VertexImageGreater(&images));
+
+        group.clear();
+        next = 0;
+    }
+
+    // The next 12-list. The triangle t has the vertices
+    // triangle_vertices[3*t], ..., triangle_vertices[3*t + 2] and incident[v]
+    // lists the triangles with the vertex v.
+    const vector<Rational> &next_triangle(const vector<vector<unsigned int> > &incident,
+                                          const vector<unsigned int> &triangle_vertices) {
+        while (next == group.size()) {
+            assert(!heap.empty());
+
+            pop_heap(heap.begin(), heap.end(), VertexImageGreater(&images));
+            unsigned int v = heap.back();
+            heap.pop_back();
+
+            group.clear();
+            next = 0;
+
+            for(unsigned int i = 0; i < incident[v].size(); i++) {
+                unsigned int t = incident[v][i];
+
+                Point p[3];
+                for(unsigned int k = 0; k < 3; k++) p[k] = images[triangle_vertices[3*t + k]];
+                sort(p, p + 3);
+
+                if (p[0] != images[v]) continue; // v is not the least vertex of t
+
+                vector<Rational> list;
+                for(unsigned int k = 0; k < 3; k++) {
+                    list.push_back(p[k].x.a);
+                    list.push_back(p[k].x.b);
+                    list.push_back(p[k].y.a);
+                    list.push_back(p[k].y.b);
+                }
+
+                group.push_back(list);
+            }
+
+            sort(group.begin(), group.end());
+        }
+
+        return group[next++];
+    }
+};
+
+// Find the lexicographically least image of the (equilateral) triangles under
+// the given symmetries, as a sorted list of 12-lists.
+//
+// Each image is produced lazily, in increasing order, by an ImageSweep. We
+// take the triangles of the images in step and drop an image as soon as its
+// triangle is larger than the best one at that position, so an image that is
+// dropped early only pays for mapping the vertices and for the triangles
+// before it was dropped. If several images survive to the end then they are
+// identical.
+//
+// Returns the number of images equal to the least one.
+unsigned int least_image(vector<vector<Point> > &triangles, vector<point_map> &symmetries, vector<vector<Rational> > &least)
+{
+    // The distinct vertices, the triangles at each vertex, and the vertices
+    // of each triangle.
+    map<Point, unsigned int> vertex_index;
+    vector<Point> vertices;
+    vector<vector<unsigned int> > incident;
+    vector<unsigned int> triangle_vertices;
+
+    for(unsigned int t = 0; t < triangles.size(); t++) {
+        assert(triangles[t].size() == 3);
+
+        for(unsigned int k = 0; k < 3; k++) {
+            const Point &p = triangles[t][k];
+            map<Point, unsigned int>::iterator iter = vertex_index.find(p);
+
+            unsigned int v;
+            if (iter == vertex_index.end()) {
+                v = vertices.size();
+                vertex_index[p] = v;
+                vertices.push_back(p);
+                incident.push_back(vector<unsigned int>());
+            } else {
+                v = iter->second;
+            }
+
+            incident[v].push_back(t);
+            triangle_vertices.push_back(v);
+        }
+    }
+
+    vector<ImageSweep> images(symmetries.size());
+    vector<unsigned int> alive;
+
+    for(unsigned int i = 0; i < symmetries.size(); i++) {
+        images[i].init(vertices, symmetries[i]);
+        alive.push_back(i);
+    }
+
+    least.clear();
+
+    vector<const vector<Rational> *> heads(symmetries.size());
+
+    for(unsigned int t = 0; t < triangles.size(); t++) {
+        const vector<Rational> *best = NULL;
+
+        for(unsigned int i = 0; i < alive.size(); i++) {
+            heads[i] = &images[alive[i]].next_triangle(incident, triangle_vertices);
+            if (best == NULL || *heads[i] < *best) best = heads[i];
+        }
+
+        least.push_back(*best);
+
+        // Keep the images that agree with 'best' at this position.
+        unsigned int nr_kept = 0;
+
+        for(unsigned int i = 0; i < alive.size(); i++)
+            if (*heads[i] == *best) alive[nr_kept++] = alive[i];
+
+        alive.resize(nr_kept);
+    }
+
+    return alive.size();
+}
+
 #endif
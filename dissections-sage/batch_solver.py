@@ -0,0 +1,164 @@
+'''
+Copyright 2010 Carlo Hamalainen <carlo.hamalainen@gmail.com>. All 
+rights reserved.
+
+Redistribution and use in source and binary forms, with or without 
+modification, are permitted provided that the following conditions
+are met:
+
+   1. Redistributions of source code must retain the above copyright 
+      notice, this list of conditions and the following disclaimer.
+
+   2. Redistributions in binary form must reproduce the above copyright 
+      notice, this list of conditions and the following disclaimer
+      in the documentation and/or other materials provided with the
+      distribution.
+
+THIS SOFTWARE IS PROVIDED BY Carlo Hamalainen ``AS IS'' AND ANY EXPRESS
+OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE
+ARE DISCLAIMED. IN NO EVENT SHALL Carlo Hamalainen OR CONTRIBUTORS
+BE LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY,
+OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT
+OF SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR
+BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY,
+WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE
+OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE,
+EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+The views and conclusions contained in the software and documentation 
+are those of the authors and should not be interpreted as representing
+official policies, either expressed or implied, of Carlo Hamalainen.
+'''
+
+from fractions import Fraction
+
+import numpy
+
+from sparse_solver import sparse_solve_dissection
+
+class BatchSolver:
+    """
+    Solve Eq(T, a) for all identity triples a of one bitrade at once in
+    float64, with exact certification of every solution.
+
+    All of these systems have the same shape so we stack them into a
+    single array and use numpy.linalg.solve and numpy.linalg.det on the
+    whole stack. By Cramer's rule the solution of each system is an
+    integer vector divided by the determinant, and by Hadamard's bound
+    (each row has at most three entries equal to +-1) the determinant is
+    at most 3^(m/2) in absolute value, where m is the number of
+    variables. So we round the determinant d and d*x to integers N and
+    certify each candidate exactly by checking that A N = d b, i.e. that
+    N/d satisfies every three-term equation and the normalisation
+    a1 = a2 = 0, a3 = 1. Only if this check fails do we solve the system
+    again with the exact sparse solver.
+
+    EXAMPLES:
+        sage: from batch_solver import *
+        sage: T = [(0, 0, 0), (0, 1, 1), (1, 1, 0), (1, 0, 2), (2, 0, 1), (2, 1, 2)]
+        sage: b = BatchSolver(T, 3, 2, 3)
+        sage: b.solve((0, 0, 0))
+        [Fraction(0, 1), Fraction(2, 3), Fraction(1, 3), Fraction(0, 1), Fraction(1, 3), Fraction(1, 1), Fraction(1, 3), Fraction(2, 3)]
+        sage: for a in T: assert b.solve(a) == sparse_solve_dissection(T, 3, 2, 3, a)
+        sage: b.nr_certified, b.nr_fallbacks
+        (6, 0)
+    """
+
+    def __init__(self, triples, row_max, col_max, sym_max):
+        self.triples = list(triples)
+        self.row_max = row_max
+        self.col_max = col_max
+        self.sym_max = sym_max
+
+        self.index_of = dict((t, i) for (i, t) in enumerate(self.triples))
+
+        m = row_max + col_max + sym_max
+        k = len(self.triples)
+
+        # Any row of the stack that failed certification is solved
+        # exactly and stored here.
+        self.exact_solutions = {}
+
+        self.nr_certified = 0
+        self.nr_fallbacks = 0
+
+        if k == 0: return
+
+        assert k + 2 == m
+
+        # Matrix of all the equations r + c - s = 0, with two spare rows
+        # at the bottom.
+        base = numpy.zeros((m, m), dtype = numpy.int64)
+        for (i, (r, c, s)) in enumerate(self.triples):
+            base[i, r] = 1
+            base[i, c + row_max] = 1
+            base[i, s + row_max + col_max] = -1
+
+        id_rows = numpy.array([r for (r, c, s) in self.triples])
+        id_cols = numpy.array([c + row_max for (r, c, s) in self.triples])
+        id_syms = numpy.array([s + row_max + col_max for (r, c, s) in self.triples])
+
+        # In the system for the i-th triple, equation i is replaced by
+        # a1 = 0 and the spare rows are a2 = 0 and a3 = 1.
+        ks = numpy.arange(k)
+
+        A = numpy.repeat(base[numpy.newaxis], k, axis = 0)
+        A[ks, ks, :] = 0
+        A[ks, ks, id_rows] = 1
+        A[ks, k, id_cols] = 1
+        A[ks, k + 1, id_syms] = 1
+
+        b = numpy.zeros((k, m), dtype = numpy.int64)
+        b[:, k + 1] = 1
+
+        self.numerators = None
+        self.denominators = None
+        certified = numpy.zeros(k, dtype = bool)
+
+        bound = 3**((m + 1)//2)
+
+        # The certification below is done in int64 so make sure that
+        # nothing can overflow.
+        if 3*bound < 2**62:
+            try:
+                Af = A.astype(numpy.float64)
+                X = numpy.linalg.solve(Af, b.astype(numpy.float64)[:, :, numpy.newaxis])[:, :, 0]
+                dets = numpy.linalg.det(Af)
+
+                d = numpy.rint(dets)
+                N = numpy.rint(X*d[:, numpy.newaxis])
+
+                certified = (d != 0) & (numpy.abs(d) <= bound) & (numpy.abs(N) <= bound).all(axis = 1)
+
+                d = numpy.where(certified, d, 1).astype(numpy.int64)
+                N = numpy.where(certified[:, numpy.newaxis], N, 0).astype(numpy.int64)
+
+                # Exact check: A N = d b for each system.
+                lhs = numpy.einsum('kij,kj->ki', A, N)
+                certified &= (lhs == d[:, numpy.newaxis]*b).all(axis = 1)
+
+                self.numerators = N
+                self.denominators = d
+            except numpy.linalg.LinAlgError:
+                certified[:] = False
+
+        for i in range(k):
+            if certified[i]:
+                self.nr_certified += 1
+            else:
+                self.exact_solutions[i] = sparse_solve_dissection(self.triples, row_max, col_max, sym_max, self.triples[i])
+                self.nr_fallbacks += 1
+
+    def solve(self, id_triple):
+        """
+        The solution to Eq(T, a) for a = id_triple, as a list of
+        Fractions ordered by rows, columns and then symbols.
+        """
+
+        i = self.index_of[tuple(id_triple)]
+
+        if i in self.exact_solutions: return self.exact_solutions[i]
+
+        d = int(self.denominators[i])
+        return [Fraction(int(z), d) for z in self.numerators[i]]
@@ -31,78 +31,69 @@ are those of the authors and should not be interpreted as representing
 official policies, either expressed or implied, of Carlo Hamalainen.
 '''
 
-import sage.all
-from sage.combinat.matrices.latin import *
 import os
 import sys
-from sage.misc.misc import tmp_filename
+import tempfile
 
-def _tau1(T1, T2, cells_map):
-    # The cells_map has both directions, i.e. integer to
-    # cell and cell to integer, so the size of T1 is
-    # just half of len(cells_map).
-    x = (int(len(cells_map)/2) + 1) * [-1]
+from array import array
 
-    for r in range(T1.nrows()):
-        for c in range(T1.ncols()):
-            e = T1[r, c]
+# Everything here is plain Python; Sage's latin squares are used if we
+# have them.
+try:
+    import sage.all
+    from sage.combinat.matrices.latin import *
+except ImportError:
+    from latin import *
 
-            if e < 0: continue
+def _tau(i, T1, T2 = None, cells_map = None):
+    # The permutation tau_i as an array x of length |T1| + 1 with
+    # x[0] = 0 and x[cells_map[cell]] = cells_map[tau_i(cell)], so the
+    # cells are numbered 1, 2, ... as in filled_cells_map.
+    if isinstance(T1, Bitrade): B = T1
+    else: B = latin_squares_to_bitrade(T1, T2)
 
-            (r2, c2, e2) = beta3( (r,c,e), T1, T2)
-            (r3, c3, e3) = beta2( (r2,c2,e2), T2, T1)
+    tau = B.taus()[i - 1]
+    x = array('i', [0])*(len(B) + 1)
 
-            x[ cells_map[(r,c)] ] = cells_map[ (r3,c3) ]
+    if cells_map is None:
+        for k in range(len(B)): x[k + 1] = tau[k] + 1
+    else:
+        cells = zip(B.rows, B.cols)
+        for k in range(len(B)): x[cells_map[cells[k]]] = cells_map[cells[tau[k]]]
 
-    x.pop(0) # remove the head of the list since we
-             # have permutations on 1..(something).
+    return x
 
-    return Permutation(x)
+def _tau1(T1, T2 = None, cells_map = None):
+    return _tau(1, T1, T2, cells_map)
 
-def _tau2(T1, T2, cells_map):
-    # The cells_map has both directions, i.e. integer to
-    # cell and cell to integer, so the size of T1 is
-    # just half of len(cells_map).
-    x = (int(len(cells_map)/2) + 1) * [-1]
+def _tau2(T1, T2 = None, cells_map = None):
+    return _tau(2, T1, T2, cells_map)
 
-    for r in range(T1.nrows()):
-        for c in range(T1.ncols()):
-            e = T1[r, c]
+def _tau3(T1, T2 = None, cells_map = None):
+    return _tau(3, T1, T2, cells_map)
 
-            if e < 0: continue
-
-            (r2, c2, e2) = beta1( (r,c,e), T1, T2)
-            (r3, c3, e3) = beta3( (r2,c2,e2), T2, T1)
-
-            x[ cells_map[(r,c)] ] = cells_map[ (r3,c3) ]
-
-    x.pop(0) # remove the head of the list since we
-             # have permutations on 1..(something).
-
-    return Permutation(x)
-
-def _tau3(T1, T2, cells_map):
-    # The cells_map has both directions, i.e. integer to
-    # cell and cell to integer, so the size of T1 is
-    # just half of len(cells_map).
-    x = (int(len(cells_map)/2) + 1) * [-1]
-
-    for r in range(T1.nrows()):
-        for c in range(T1.ncols()):
-            e = T1[r, c]
-
-            if e < 0: continue
+def nr_cycles(tau):
+    """
+    The number of cycles of the permutation tau of 0, 1, ..., len(tau) - 1.
 
-            (r2, c2, e2) = beta2( (r,c,e), T1, T2)
-            (r3, c3, e3) = beta1( (r2,c2,e2), T2, T1)
+    EXAMPLE:
+        sage: from bbitrade import *
+        sage: nr_cycles(array('i', [1, 0, 2, 4, 5, 3]))
+        3
+    """
 
-            x[ cells_map[(r,c)] ] = cells_map[ (r3,c3) ]
+    seen = bytearray(len(tau))
+    nr = 0
 
-    x.pop(0) # remove the head of the list since we
-             # have permutations on 1..(something).
+    for i in xrange(len(tau)):
+        if seen[i]: continue
 
-    return Permutation(x)
+        nr += 1
+        while not seen[i]:
+            seen[i] = 1
+            i = tau[i]
 
+    return nr
 
 class Tau:
     def __init__(self, T1, cells_map, tau, i):
@@ -110,25 +101,24 @@ class Tau:
         self.T1 = T1
         self.cells_map = cells_map
         self.tau = tau
-        self.tau_inverse = tau.inverse()
 
-    def _image_of_permutation(self, x, use_tau):
-        if isinstance(x, Integer):
-            return self._image_of_permutation(self.cells_map[x], use_tau)
+        self.tau_inverse = array('i', [0])*len(tau)
+        for k in range(len(tau)): self.tau_inverse[tau[k]] = k
 
+    def _image_of_permutation(self, x, use_tau):
         if isinstance(x, tuple):
             r = x[0]
             c = x[1]
             pt = self.cells_map[(r, c)]
 
-            pt_im = use_tau[pt - 1]
+            pt_im = use_tau[pt]
 
             r_im, c_im = self.cells_map[pt_im]
 
             if len(x) == 2: return (r_im, c_im)
             return (r_im, c_im, self.T1[r_im, c_im])
 
-        raise NotImplemented
+        return self._image_of_permutation(self.cells_map[x], use_tau)
 
     def image(self, x):
         return self._image_of_permutation(x, self.tau)
@@ -160,16 +150,507 @@ b_for_testing = r"""4 2 4
 1 1 2
 """
 
-class Bitrade:
+class Bitrade(object):
     """
-    pair of partial latin squarres T1, T2
+    A bitrade (T1, T2) stored by its filled cells. The k-th cell is
+    (rows[k], cols[k]) with symbol syms1[k] in T1 and syms2[k] in T2;
+    the cells are in row-major order, so k + 1 is the number that
+    filled_cells_map gives the cell. The dictionaries cell_index,
+    row_sym1, col_sym1, row_sym2 and col_sym2 map (r, c), (r, s) and
+    (c, s) to k, so for example the column of symbol s in row r of T2
+    is cols[row_sym2[(r, s)]].
+
+    Here T1 and T2 are the flat triples r0, c0, s0, r1, c1, s1, ... (as
+    in binary_bitrades). Everything is O(|T1|), there is no n by n
+    square. The attributes T1 and T2 are BitradeSquare views that can
+    be used in place of a LatinSquare.
+
+    The labels are stored in byte arrays, as in the binary bitrade
+    files, so they must be in the range 0, ..., 255. The sizes nr_rows,
+    nr_cols and nr_syms are one more than the largest row, column and
+    symbol label, so they can be used to size arrays indexed by the
+    labels.
+
+    EXAMPLES:
+        sage: from bbitrade import *
+        sage: B = Bitrade([0, 0, 0, 0, 1, 1, 1, 1, 0, 1, 0, 1], [0, 0, 1, 0, 1, 0, 1, 0, 0, 1, 1, 1])
+        sage: len(B), B.nr_rows, B.nr_cols, B.nr_syms
+        (4, 2, 2, 2)
+        sage: B.rows, B.cols, B.syms1, B.syms2
+        (array('B', [0, 0, 1, 1]), array('B', [0, 1, 0, 1]), array('B', [0, 1, 1, 0]), array('B', [1, 0, 0, 1]))
+        sage: B.cols[B.row_sym2[(1, 0)]]
+        0
+        sage: B.T1
+        [0 1]
+        [1 0]
+        sage: B.T2[0, 0], B.T2[0, 5]
+        (1, -1)
+        sage: B.swap().T1
+        [1 0]
+        [0 1]
+
+    The symbol labels need not be contiguous:
+        sage: Bitrade([0, 0, 0, 0, 1, 3, 1, 0, 3, 1, 1, 0], [0, 0, 3, 0, 1, 0, 1, 0, 0, 1, 1, 3]).nr_syms
+        4
+        sage: Bitrade([0, 0, 0, 0, 1, 256, 1, 0, 256, 1, 1, 0], [0, 0, 256, 0, 1, 0, 1, 0, 0, 1, 1, 256])
+        Traceback (most recent call last):
+        ...
+        ValueError: bitrade labels must be in the range 0, ..., 255
+    """
+
+    __slots__ = ('nr_rows', 'nr_cols', 'nr_syms', 'rows', 'cols', 'syms1', 'syms2',
+                 'cell_index', 'row_sym1', 'col_sym1', 'row_sym2', 'col_sym2', 'T1', 'T2')
+
+    def __init__(self, T1, T2):
+        assert len(T1) == len(T2) and len(T1) % 3 == 0
+
+        if len(T1) > 0 and (min(min(T1), min(T2)) < 0 or max(max(T1), max(T2)) > 255):
+            raise ValueError, "bitrade labels must be in the range 0, ..., 255"
+
+        T2_syms = dict(((T2[i], T2[i+1]), T2[i+2]) for i in range(0, len(T2), 3))
+        entries = sorted((T1[i], T1[i+1], T1[i+2]) for i in range(0, len(T1), 3))
+
+        self.rows  = array('B', [r for (r, c, s) in entries])
+        self.cols  = array('B', [c for (r, c, s) in entries])
+        self.syms1 = array('B', [s for (r, c, s) in entries])
+        self.syms2 = array('B', [T2_syms[(r, c)] for (r, c, s) in entries])
+
+        self.cell_index = dict(((r, c), k) for (k, (r, c, s)) in enumerate(entries))
+        assert len(self.cell_index) == len(entries) == len(T2_syms)
+
+        self.row_sym1 = dict(((self.rows[k], self.syms1[k]), k) for k in range(len(entries)))
+        self.col_sym1 = dict(((self.cols[k], self.syms1[k]), k) for k in range(len(entries)))
+        self.row_sym2 = dict(((self.rows[k], self.syms2[k]), k) for k in range(len(entries)))
+        self.col_sym2 = dict(((self.cols[k], self.syms2[k]), k) for k in range(len(entries)))
+
+        if len(entries) == 0:
+            self.nr_rows = self.nr_cols = self.nr_syms = 0
+        else:
+            self.nr_rows = max(self.rows) + 1
+            self.nr_cols = max(self.cols) + 1
+            self.nr_syms = max(max(self.syms1), max(self.syms2)) + 1
+
+        self.T1 = BitradeSquare(self, self.syms1, self.row_sym1, self.col_sym1)
+        self.T2 = BitradeSquare(self, self.syms2, self.row_sym2, self.col_sym2)
+
+    def __len__(self):
+        return len(self.rows)
+
+    def __repr__(self):
+        return "Bitrade of size %d on %d rows, %d columns and %d symbols" % (len(self), self.nr_rows, self.nr_cols, self.nr_syms)
+
+    def triples(self):
+        """
+        The flat triples (T1, T2) of the bitrade, in row-major order.
+        """
+
+        return (self.T1.flat_triples(), self.T2.flat_triples())
+
+    def swap(self):
+        """
+        The bitrade (T2, T1).
+        """
+
+        T1, T2 = self.triples()
+        return Bitrade(T2, T1)
+
+    def conjugate(self, p):
+        """
+        The conjugate of the bitrade where the entry (x[0], x[1], x[2])
+        of T1 and T2 becomes (x[p[0]], x[p[1]], x[p[2]]), so p = (1, 0, 2)
+        transposes the bitrade.
+
+        EXAMPLES:
+            sage: from bbitrade import *
+            sage: B = Bitrade([0, 0, 0, 0, 1, 1, 1, 0, 2, 1, 1, 0, 2, 0, 1, 2, 1, 2], [0, 0, 1, 0, 1, 0, 1, 0, 0, 1, 1, 2, 2, 0, 2, 2, 1, 1])
+            sage: B.T1
+            [ 0  1 -1]
+            [ 2  0 -1]
+            [ 1  2 -1]
+            sage: B.conjugate((1, 0, 2)).T1
+            [ 0  2  1]
+            [ 1  0  2]
+            [-1 -1 -1]
+        """
+
+        def conjugate(T):
+            return [T[i + p[j]] for i in range(0, len(T), 3) for j in range(3)]
+
+        T1, T2 = self.triples()
+        return Bitrade(conjugate(T1), conjugate(T2))
+
+    def taus(self):
+        """
+        The permutations tau_1, tau_2, tau_3 of the cells 0, 1, ...,
+        |T1| - 1, as arrays, in one pass over the cells. For the cell k
+        with symbol s in T1 and s' in T2, tau_1(k) is the cell of T1 in
+        the same row with symbol s'; tau_2(k) is the cell of T2 in the
+        same column with symbol s; and tau_3(k) is the cell of T1 in the
+        same column as the cell of T2 in the same row with symbol s,
+        and with symbol s.
+
+        EXAMPLES:
+            sage: from bbitrade import *
+            sage: B = Bitrade([0, 0, 0, 0, 1, 1, 1, 1, 0, 1, 0, 1], [0, 0, 1, 0, 1, 0, 1, 0, 0, 1, 1, 1])
+            sage: B.taus()
+            (array('i', [1, 0, 3, 2]), array('i', [2, 3, 0, 1]), array('i', [3, 2, 1, 0]))
+        """
+
+        rows, cols, syms1, syms2 = self.rows, self.cols, self.syms1, self.syms2
+        row_sym1, col_sym1, row_sym2, col_sym2 = self.row_sym1, self.col_sym1, self.row_sym2, self.col_sym2
+
+        n = len(rows)
+        tau1 = array('i', [0])*n
+        tau2 = array('i', [0])*n
+        tau3 = array('i', [0])*n
+
+        for k in xrange(n):
+            r = rows[k]
+            s = syms1[k]
+
+            tau1[k] = row_sym1[(r, syms2[k])]
+            tau2[k] = col_sym2[(cols[k], s)]
+            tau3[k] = col_sym1[(cols[row_sym2[(r, s)]], s)]
+
+        return (tau1, tau2, tau3)
+
+    def genus(self):
+        """
+        The genus of the bitrade, from the numbers of cycles of tau_1,
+        tau_2 and tau_3: the bitrade is spherical if this is 0.
+
+        EXAMPLES:
+            sage: from bbitrade import *
+            sage: B = Bitrade([0, 0, 0, 0, 1, 1, 1, 1, 0, 1, 0, 1], [0, 0, 1, 0, 1, 0, 1, 0, 0, 1, 1, 1])
+            sage: B.genus()
+            0
+        """
+
+        tau1, tau2, tau3 = self.taus()
+
+        return (len(self) + 2 - nr_cycles(tau1) - nr_cycles(tau2) - nr_cycles(tau3)) // 2
+
+    def canonical_form(self):
+        """
+        A canonical form for the bitrade up to relabelling the rows,
+        columns and symbols and conjugation (see conjugate). The cells
+        of a bitrade are the points of the permutations tau_1, tau_2,
+        tau_3; rows, columns and symbols are their cycles, and two
+        bitrades are isotopic exactly when their taus are simultaneously
+        conjugate. So for each conjugate and each starting cell we number
+        the cells in the order that a breadth first search along tau_1,
+        tau_2, tau_3 finds them, and take the least of the relabelled
+        taus. This needs the taus to be transitive (as they are for the
+        spherical bitrades); otherwise we return None.
+
+        Note that (T1, T2) and (T2, T1) usually have different forms.
+
+        EXAMPLES:
+            sage: from bbitrade import *
+            sage: B = Bitrade([0, 0, 0, 0, 1, 1, 0, 2, 2, 0, 3, 3, 1, 0, 1, 1, 3, 0, 2, 1, 2, 2, 2, 3, 2, 3, 1], [0, 0, 1, 0, 1, 2, 0, 2, 3, 0, 3, 0, 1, 0, 0, 1, 3, 1, 2, 1, 1, 2, 2, 2, 2, 3, 3])
+            sage: B.canonical_form() == B.conjugate((1, 2, 0)).canonical_form()
+            True
+            sage: B.canonical_form() == B.swap().canonical_form()
+            False
+        """
+
+        n = len(self)
+        best = None
+
+        for p in CONJUGATES:
+            taus = self.conjugate(p).taus()
+
+            for start in range(n):
+                form = _relabelled_taus(taus, start)
+                if form is None: return None
+                if best is None or form < best: best = form
+
+        return best
+
+    def swap_isomorphism(self):
+        """
+        Look for an isomorphism from a conjugate of the bitrade (T1, T2)
+        to the swapped bitrade (T2, T1). If there is one we return
+        (p, phi) where p is the conjugation (see conjugate) and phi[k] is
+        the cell of (T2, T1) that the cell k of (T1, T2) goes to, and
+        otherwise None.
+
+        The dissection of (T2, T1) with identity cell phi[k] is then the
+        image of the dissection of (T1, T2) with identity cell k under
+        the symmetry of the triangle for p (see conjugate_point in
+        triangle_dissections.py), so only one of the two has to be
+        solved. The cells of (T2, T1) are numbered as in (T1, T2).
+
+        EXAMPLES:
+            sage: from bbitrade import *
+            sage: B = Bitrade([0, 0, 0, 0, 1, 1, 1, 0, 2, 1, 1, 0, 2, 0, 1, 2, 1, 2], [0, 0, 1, 0, 1, 0, 1, 0, 0, 1, 1, 2, 2, 0, 2, 2, 1, 1])
+            sage: B.swap_isomorphism()
+            ((0, 1, 2), array('i', [0, 1, 4, 5, 2, 3]))
+            sage: B = Bitrade([0, 0, 0, 0, 1, 1, 0, 2, 2, 0, 3, 3, 1, 0, 1, 1, 3, 0, 2, 1, 2, 2, 2, 3, 2, 3, 1], [0, 0, 1, 0, 1, 2, 0, 2, 3, 0, 3, 0, 1, 0, 0, 1, 3, 1, 2, 1, 1, 2, 2, 2, 2, 3, 3])
+            sage: B.swap_isomorphism() is None
+            True
+        """
+
+        n = len(self)
+        S = self.swap()
+
+        S_order, S_label = _bfs_order(S.taus(), 0)
+        S_form = _relabelled_taus(S.taus(), 0)
+        if S_form is None: return None
+
+        for p in CONJUGATES:
+            C = self.conjugate(p)
+            C_taus = C.taus()
+
+            # The cell of C with entry e is the cell of self with entry
+            # x where x[p[j]] = e[j].
+            C_cells = array('i', [0])*n
+            for k in range(n):
+                x = [0, 0, 0]
+                for (j, e) in enumerate((C.rows[k], C.cols[k], C.syms1[k])): x[p[j]] = e
+                C_cells[k] = self.cell_index[(x[0], x[1])]
+
+            for start in range(n):
+                if _relabelled_taus(C_taus, start) != S_form: continue
+
+                C_order, C_label = _bfs_order(C_taus, start)
+
+                phi = array('i', [0])*n
+                for i in range(n): phi[C_cells[C_order[i]]] = S_order[i]
+
+                return (p, phi)
+
+        return None
+
+    def cell_orbits(self):
+        """
+        The orbits of the autotopism group of the bitrade on its cells,
+        as an array whose k-th entry is the least cell in the orbit of
+        cell k. An autotopism is a permutation of the cells that commutes
+        with the taus, and since these are transitive it is fixed by the
+        image of one cell; so cells x and y are in the same orbit exactly
+        when the taus relabelled from x and from y (see canonical_form)
+        are the same. If the taus are not transitive every cell is its
+        own orbit.
+
+        Identity cells in the same orbit give congruent dissections, for
+        (T1, T2) and for (T2, T1).
+
+        EXAMPLES:
+            sage: from bbitrade import *
+            sage: B = Bitrade([0, 0, 0, 0, 1, 1, 1, 0, 2, 1, 1, 0, 2, 0, 1, 2, 1, 2], [0, 0, 1, 0, 1, 0, 1, 0, 0, 1, 1, 2, 2, 0, 2, 2, 1, 1])
+            sage: B.cell_orbits()
+            array('i', [0, 0, 0, 0, 0, 0])
+            sage: B = Bitrade([0, 0, 0, 0, 1, 1, 0, 2, 2, 0, 3, 3, 1, 0, 1, 1, 3, 0, 2, 1, 2, 2, 2, 3, 2, 3, 1], [0, 0, 1, 0, 1, 2, 0, 2, 3, 0, 3, 0, 1, 0, 0, 1, 3, 1, 2, 1, 1, 2, 2, 2, 2, 3, 3])
+            sage: B.cell_orbits()
+            array('i', [0, 1, 2, 3, 4, 5, 6, 7, 8])
+        """
+
+        n = len(self)
+        taus = self.taus()
+
+        orbits = array('i', range(n))
+        first = {}
+
+        for x in range(n):
+            form = _relabelled_taus(taus, x)
+            if form is None: return array('i', range(n))
+
+            orbits[x] = first.setdefault(form, x)
+
+        return orbits
+
+# The six permutations of (row, column, symbol), see Bitrade.conjugate.
+CONJUGATES = [(0, 1, 2), (1, 0, 2), (0, 2, 1), (2, 1, 0), (1, 2, 0), (2, 0, 1)]
+
+def _bfs_order(taus, start):
+    # The cells in the order that a breadth first search from start
+    # along the taus reaches them, and the position of each cell in
+    # this order (-1 for cells that are not reached).
+    n = len(taus[0])
+
+    label = array('i', [-1])*n
+    order = array('i', [start])
+    label[start] = 0
+
+    i = 0
+    while i < len(order):
+        x = order[i]
+        for tau in taus:
+            y = tau[x]
+            if label[y] < 0:
+                label[y] = len(order)
+                order.append(y)
+        i += 1
+
+    return (order, label)
+
+def _relabelled_taus(taus, start):
+    # The taus with the cells numbered by _bfs_order, as a tuple (or
+    # None if the search misses some cells).
+    order, label = _bfs_order(taus, start)
+
+    if len(order) < len(taus[0]): return None
+
+    return tuple([label[tau[x]] for tau in taus for x in order])
+
+def unique_bitrades(bitrades, seen = None):
+    """
+    Iterate over the bitrades, dropping each one that has the same
+    canonical form (see Bitrade.canonical_form) as one before it, or as
+    one in the set seen. The forms are added to seen.
+
+    EXAMPLES:
+        sage: from bbitrade import *
+        sage: B = Bitrade([0, 0, 0, 0, 1, 1, 0, 2, 2, 0, 3, 3, 1, 0, 1, 1, 3, 0, 2, 1, 2, 2, 2, 3, 2, 3, 1], [0, 0, 1, 0, 1, 2, 0, 2, 3, 0, 3, 0, 1, 0, 0, 1, 3, 1, 2, 1, 1, 2, 2, 2, 2, 3, 3])
+        sage: list(unique_bitrades([B, B.conjugate((1, 0, 2)), B.swap()]))
+        [Bitrade of size 9 on 3 rows, 4 columns and 4 symbols, Bitrade of size 9 on 3 rows, 4 columns and 4 symbols]
+    """
+
+    if seen is None: seen = set()
+
+    for B in bitrades:
+        form = B.canonical_form()
+
+        if form is not None:
+            if form in seen: continue
+            seen.add(form)
+
+        yield B
 
-    permutations t1, t2, t3
+class BitradeSquare(object):
+    """
+    One of the partial latin squares of a Bitrade, with the methods of
+    LatinSquare that the dissection code uses. It is n by n where n is
+    the largest of the number of rows, columns and symbols, and empty
+    cells are -1.
+
+    EXAMPLES:
+        sage: from bbitrade import *
+        sage: B = Bitrade([0, 0, 2, 1, 2, 0, 0, 1, 0], [0, 0, 0, 1, 2, 2, 0, 1, 2])
+        sage: T = B.T1
+        sage: T
+        [ 2  0 -1]
+        [-1 -1  0]
+        [-1 -1 -1]
+        sage: T.nrows(), T.nr_filled_cells(), T.actual_row_col_sym_sizes()
+        (3, 3, (2, 3, 3))
+
+    The number of symbols is one more than the largest symbol (see
+    Bitrade), not the number of distinct symbols as for a LatinSquare,
+    since the solvers index their variables by the labels.
+        sage: T.triples()
+        [(0, 0, 2), (0, 1, 0), (1, 2, 0)]
+        sage: T.vals_in_row(0)
+        {0: True, 2: True}
+        sage: from spherical import triples_to_latin_square
+        sage: T.to_latin_square() == triples_to_latin_square(3, T.flat_triples())
+        True
+    """
+
+    __slots__ = ('bitrade', 'syms', 'row_sym', 'col_sym')
+
+    def __init__(self, bitrade, syms, row_sym, col_sym):
+        self.bitrade = bitrade
+        self.syms = syms
+        self.row_sym = row_sym
+        self.col_sym = col_sym
+
+    def __getitem__(self, (r, c)):
+        k = self.bitrade.cell_index.get((r, c))
+        if k is None: return -1
+        return self.syms[k]
+
+    def __repr__(self):
+        return repr(self.to_latin_square())
+
+    def nrows(self):
+        B = self.bitrade
+        return max(B.nr_rows, B.nr_cols, B.nr_syms)
+
+    def ncols(self):
+        return self.nrows()
+
+    def nr_filled_cells(self):
+        return len(self.syms)
+
+    def actual_row_col_sym_sizes(self):
+        B = self.bitrade
+        return B.nr_rows, B.nr_cols, B.nr_syms
+
+    def triples(self):
+        """
+        The entries (r, c, s) in row-major order (see trade_triples).
+        """
+
+        B = self.bitrade
+        return zip(B.rows, B.cols, self.syms)
+
+    def flat_triples(self):
+        B = self.bitrade
+        T = array('B', [0])*(3*len(self.syms))
+
+        T[0::3] = B.rows
+        T[1::3] = B.cols
+        T[2::3] = self.syms
+
+        return T
+
+    def vals_in_row(self, r):
+        return dict((s, True) for (r2, s) in self.row_sym.iterkeys() if r2 == r)
+
+    def vals_in_col(self, c):
+        return dict((s, True) for (c2, s) in self.col_sym.iterkeys() if c2 == c)
+
+    def filled_cells_map(self):
+        cells_map = {}
+
+        for (k, cell) in enumerate(zip(self.bitrade.rows, self.bitrade.cols)):
+            cells_map[k + 1] = cell
+            cells_map[cell] = k + 1
+
+        return cells_map
+
+    def is_partial_latin_square(self):
+        n = len(self.syms)
+        if len(self.row_sym) != n or len(self.col_sym) != n: return False
+        return n == 0 or max(self.syms) < self.nrows()
+
+    def to_latin_square(self):
+        """
+        This square as a LatinSquare.
+        """
+
+        n = self.nrows()
+        L = LatinSquare(n, n)
+
+        for r in range(n):
+            for c in range(n):
+                L[r, c] = -1
+
+        for (r, c, s) in self.triples():
+            L[r, c] = s
+
+        return L
+
+def latin_squares_to_bitrade(T1, T2):
+    """
+    The Bitrade of the partial latin squares T1 and T2.
+
+    EXAMPLES:
+        sage: from bbitrade import *
+        sage: from spherical import triples_to_latin_square
+        sage: T1 = triples_to_latin_square(2, [0, 0, 0, 0, 1, 1, 1, 0, 1, 1, 1, 0])
+        sage: T2 = triples_to_latin_square(2, [0, 0, 1, 0, 1, 0, 1, 0, 0, 1, 1, 1])
+        sage: latin_squares_to_bitrade(T1, T2).T2
+        [1 0]
+        [0 1]
     """
 
-    def __init__(self):
-        pass
+    def flat(T):
+        return [x for r in range(T.nrows()) for c in range(T.ncols()) if T[r, c] >= 0 for x in (r, c, T[r, c])]
 
+    return Bitrade(flat(T1), flat(T2))
 
 def dump_to_tmpfile(s):
     """
@@ -181,7 +662,8 @@ def dump_to_tmpfile(s):
         sage: os.remove(file_loc)
     """
 
-    file_loc = tmp_filename()
+    (fd, file_loc) = tempfile.mkstemp()
+    os.close(fd)
     f = open(file_loc,"w")
     f.write(s)
     f.close()
@@ -273,8 +755,7 @@ def process_spherical_file(file_name):
 
         assert is_bitrade(T1, T2)
 
-        #g = genus(T1, T2)
-        #assert g == _sage_const_0
+        assert latin_squares_to_bitrade(T1, T2).genus() == 0
 
         bitrades.append((T1, T2))
 
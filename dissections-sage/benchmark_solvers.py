@@ -0,0 +1,169 @@
+#!/usr/bin/env sage-python
+
+'''
+Copyright 2010 Carlo Hamalainen <carlo.hamalainen@gmail.com>. All 
+rights reserved.
+
+Redistribution and use in source and binary forms, with or without 
+modification, are permitted provided that the following conditions
+are met:
+
+   1. Redistributions of source code must retain the above copyright 
+      notice, this list of conditions and the following disclaimer.
+
+   2. Redistributions in binary form must reproduce the above copyright 
+      notice, this list of conditions and the following disclaimer
+      in the documentation and/or other materials provided with the
+      distribution.
+
+THIS SOFTWARE IS PROVIDED BY Carlo Hamalainen ``AS IS'' AND ANY EXPRESS
+OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE
+ARE DISCLAIMED. IN NO EVENT SHALL Carlo Hamalainen OR CONTRIBUTORS
+BE LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY,
+OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT
+OF SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR
+BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY,
+WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE
+OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE,
+EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+The views and conclusions contained in the software and documentation 
+are those of the authors and should not be interpreted as representing
+official policies, either expressed or implied, of Carlo Hamalainen.
+'''
+
+import sys
+import time
+
+from itertools import islice
+
+from triangle_dissections import *
+
+SOLVERS = ['sparse', 'incremental', 'crt', 'batch']
+
+# The echelon solver uses Sage's dense matrices, so only time it if we have them.
+if QQ is not None: SOLVERS = ['echelon'] + SOLVERS
+
+def benchmark_solvers(min_size = 10, max_size = 18, nr_bitrades = 5, solvers = SOLVERS):
+    """
+    Time find_solution() with each of the solvers on the first
+    nr_bitrades bitrades of each size, solving Eq(T, a) for every
+    triple a of T1. Returns a dictionary mapping (size, solver) to the
+    mean time in seconds per identity triple. For 'incremental' the time
+    includes factoring the system of each bitrade, and for 'batch' the
+    float64 solve and certification of all of its systems.
+
+    EXAMPLES:
+        sage: from benchmark_solvers import *
+        sage: times = benchmark_solvers(6, 6, nr_bitrades = 1)
+        sage: sorted(times.keys()) == sorted([(6, s) for s in SOLVERS])
+        True
+    """
+
+    times = {}
+
+    for size in range(min_size, max_size + 1):
+        if size == 5: continue # no bitrades of size 5
+
+        bitrades = list(islice(spherical_iterator(size, size), nr_bitrades))
+        if len(bitrades) == 0: continue
+
+        nr_triples = sum(T1.nr_filled_cells() for (T1, T2) in bitrades)
+
+        for solver in solvers:
+            start = time.time()
+
+            for (T1, T2) in bitrades:
+                T1_solver = bitrade_solver(T1, solver)
+
+                for (r, c, s) in trade_triples(T1):
+                    find_solution(T1, r, c, False, T1_solver)
+
+            times[(size, solver)] = (time.time() - start)/nr_triples
+
+    return times
+
+def check_solvers(min_size = 4, max_size = 10, nr_bitrades = None, solvers = SOLVERS):
+    """
+    Check that the solvers agree: for each bitrade of each size (or the
+    first nr_bitrades of them) and every triple a of T1, compare the
+    solutions of Eq(T, a) from find_solution() with each of the solvers
+    against the first one. Returns the list of (size, index of the
+    bitrade, triple, solver) where a solver disagreed.
+
+    EXAMPLES:
+        sage: from benchmark_solvers import *
+        sage: check_solvers(4, 9)
+        []
+    """
+
+    mismatches = []
+
+    for size in range(min_size, max_size + 1):
+        if size == 5: continue # no bitrades of size 5
+
+        for (k, (T1, T2)) in enumerate(islice(spherical_iterator(size, size), nr_bitrades)):
+            T1_solvers = [bitrade_solver(T1, solver) for solver in solvers]
+
+            for (r, c, s) in trade_triples(T1):
+                solutions = [find_solution(T1, r, c, False, T1_solver) for T1_solver in T1_solvers]
+
+                for i in range(1, len(solvers)):
+                    if solutions[i] != solutions[0]:
+                        mismatches.append((size, k, (r, c, s), solvers[i]))
+
+    return mismatches
+
+if __name__ == "__main__":
+    if len(sys.argv) > 1 and sys.argv[1] == '--check':
+        if len(sys.argv) not in [4, 5]:
+            print 'Check that the solvers agree on the bitrades of sizes min_size to max_size:'
+            print '$ ./benchmark_solvers.py --check min_size max_size [nr_bitrades]'
+            sys.exit(1)
+
+        nr_bitrades = None
+        if len(sys.argv) == 5: nr_bitrades = int(sys.argv[4])
+
+        mismatches = check_solvers(int(sys.argv[2]), int(sys.argv[3]), nr_bitrades)
+
+        for m in mismatches: print 'mismatch', m
+        if len(mismatches) > 0: sys.exit(1)
+
+        print 'the solvers ' + ', '.join(SOLVERS) + ' agree'
+        sys.exit(0)
+
+    if len(sys.argv) not in [1, 3, 4]:
+        print 'Compare the solvers for Eq(T, a) on bitrades of each size.'
+        print
+        print 'Examples:'
+        print
+        print 'Sizes 10 to 18, first 5 bitrades of each size:'
+        print '$ ./benchmark_solvers.py'
+        print
+        print 'Sizes 12 to 14, first 20 bitrades of each size:'
+        print '$ ./benchmark_solvers.py 12 14 20'
+        print
+        print 'Check that the solvers agree on all bitrades of sizes 4 to 12:'
+        print '$ ./benchmark_solvers.py --check 4 12'
+        print
+        print 'Check the first 20 bitrades of sizes 10 to 18:'
+        print '$ ./benchmark_solvers.py --check 10 18 20'
+        print
+        sys.exit(1)
+
+    min_size, max_size, nr_bitrades = 10, 18, 5
+
+    if len(sys.argv) >= 3:
+        min_size = int(sys.argv[1])
+        max_size = int(sys.argv[2])
+    if len(sys.argv) == 4:
+        nr_bitrades = int(sys.argv[3])
+
+    times = benchmark_solvers(min_size, max_size, nr_bitrades)
+
+    print 'ms per identity triple'
+    print 'size ' + ' '.join([s.rjust(12) for s in SOLVERS])
+
+    for size in sorted(set([k[0] for k in times.keys()])):
+        print str(size).rjust(4), ' '.join([('%.3f' % (1000*times[(size, s)])).rjust(12) for s in SOLVERS])
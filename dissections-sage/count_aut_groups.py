@@ -31,56 +31,44 @@ are those of the authors and should not be interpreted as representing
 official policies, either expressed or implied, of Carlo Hamalainen.
 '''
 
-import sage.all
-
 import sys
 
-import pyx
-from sage.combinat.matrices.latin import *
-from sage.misc.search import search
-from sage.rings.rational_field import QQ
-from sage.rings.arith import lcm
-import math
+from fractions import Fraction
 
 from spherical import *
 from triangle_dissections import *
 
-import sympy
-
-def aut_group_size(dissection_vertices):
+def signature_aut_group_size(line):
     """
     Calculate the order of the automorphism group of a triangle
-    dissection described by its vertices (this is the output from
-    disk_count_dissections in unique_dissections.py). We try each of
-    the five non-identity automorphisms directly.
+    dissection given by a line of a signatures_* file (this is the
+    output from disk_count_dissections in unique_dissections.py, which
+    prefixes each line with this order when aut_groups = True). We
+    convert the signature back to integer lattice coordinates and count
+    the images that are equal to the least one, as in
+    canonical_signature.
 
     EXAMPLES::
 
-        sage: aut_group_size(((0, 0), (1/6, 3**(1/2)/6), (1/3, 0), (1/3, 3**(1/2)/3), (1/2, 3**(1/2)/6), (1/2, 3**(1/2)/2), (2/3, 3**(1/2)/3), (1, 0)))
-        2
-
-        sage: aut_group_size(((0, 0), (1/12, 3**(1/2)/12), (1/6, 0), (1/6, 3**(1/2)/6), (1/4, 3**(1/2)/12), (1/3, 0), (1/3, 3**(1/2)/3), (1/2, 3**(1/2)/6), (1/2, 3**(1/2)/2), (2/3, 3**(1/2)/3), (1, 0)))
-        1
+        sage: signature_aut_group_size('0 0 0 0 1/4 0 0 1/4 1/2 0 0 0 1/4 0 0 1/4 1/2 0 0 0 3/4 0 0 1/4 1/4 0 0 1/4 1/2 0 0 1/2 3/4 0 0 1/4 1/2 0 0 0 3/4 0 0 1/4 1 0 0 0')
+        6
 
-        sage: aut_group_size(((0, 0), (1/6, 3**(1/2)/6), (1/4, 3**(1/2)/4), (1/3, 0), (1/3, 3**(1/2)/6), (1/3, 3**(1/2)/3), (5/12, 3**(1/2)/4), (1/2, 3**(1/2)/6), (1/2, 3**(1/2)/2), (2/3, 3**(1/2)/3), (1, 0)))
+        sage: signature_aut_group_size('0 0 0 0 1/6 0 0 1/6 1/3 0 0 0 1/6 0 0 1/6 1/3 0 0 0 1/2 0 0 1/6 1/6 0 0 1/6 1/3 0 0 1/3 1/2 0 0 1/6 1/3 0 0 0 2/3 0 0 1/3 1 0 0 0 1/3 0 0 1/3 1/2 0 0 1/6 2/3 0 0 1/3 1/3 0 0 1/3 1/2 0 0 1/2 2/3 0 0 1/3')
         2
-
-        sage: aut_group_size(((0, 0), (1/12, 3**(1/2)/12), (1/6, 0), (1/6, 3**(1/2)/6), (1/4, 3**(1/2)/12), (1/3, 0), (1/3, 3**(1/2)/3), (1/2, 3**(1/2)/6), (1/2, 3**(1/2)/2), (2/3, 3**(1/2)/3), (1, 0)))
-        1
     """
 
-    aut_size = 1 # Aut(dissection_vertices) always has the identity element
+    sig = [Fraction(x) for x in line.split()]
+    assert len(sig) % 12 == 0
 
-    dissection_vertices = sorted(dissection_vertices)
+    # Each vertex is (x + y/2, 0, 0, y/2) for (x, y) in the right triangle.
+    vertices = [(sig[i] - sig[i+3], 2*sig[i+3]) for i in range(0, len(sig), 4)]
 
-    if sorted([reflect1(x, y) for (x, y) in dissection_vertices]) == dissection_vertices:                   aut_size += 1
-    if sorted([reflect2(x, y) for (x, y) in dissection_vertices]) == dissection_vertices:                   aut_size += 1
-    if sorted([reflect3(x, y) for (x, y) in dissection_vertices]) == dissection_vertices:                   aut_size += 1
-    if sorted([rotate_equilateral(x, y) for (x, y) in dissection_vertices]) == dissection_vertices:         aut_size += 1
-    if sorted([rotate_equilateral_inverse(x, y) for (x, y) in dissection_vertices]) == dissection_vertices: aut_size += 1
+    N = int(lcm([z.denominator for v in vertices for z in v]))
+    vertices = [(int(x*N), int(y*N)) for (x, y) in vertices]
 
-    return aut_size
+    triangles = [vertices[i:i+3] for i in range(0, len(vertices), 3)]
 
+    return lattice_least_image(triangles, N)[1]
 
 # For usage see the script count_aut_groups.sh
 
@@ -90,16 +78,17 @@ if __name__ == "__main__":
     total = 0
 
     for line in sys.stdin.readlines():
-        d = sympy.sympify(line)
-
-        s = aut_group_size(d)
+        # Lines written with aut_groups = True (or by 'td --aut-groups')
+        # are prefixed with the order of the automorphism group.
+        if len(line.split()) % 12 == 1: s = int(line.split()[0])
+        else: s = signature_aut_group_size(line)
 
         assert s in [1, 2, 3, 6]
 
         total += 1
         counts[s] = counts[s] + 1
 
-    T_size = len(d) - 2
+    T_size = len(line.split())/12
 
     print r"\hline " + str(T_size) + r" & " + str(counts[1]) + r" & " + str(counts[2]) + r" & " + str(counts[3]) + r" & " + str(counts[6]) + r" \\"
 
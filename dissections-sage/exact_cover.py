@@ -0,0 +1,183 @@
+'''
+Copyright 2010 Carlo Hamalainen <carlo.hamalainen@gmail.com>. All 
+rights reserved.
+
+Redistribution and use in source and binary forms, with or without 
+modification, are permitted provided that the following conditions
+are met:
+
+   1. Redistributions of source code must retain the above copyright 
+      notice, this list of conditions and the following disclaimer.
+
+   2. Redistributions in binary form must reproduce the above copyright 
+      notice, this list of conditions and the following disclaimer
+      in the documentation and/or other materials provided with the
+      distribution.
+
+THIS SOFTWARE IS PROVIDED BY Carlo Hamalainen ``AS IS'' AND ANY EXPRESS
+OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE
+ARE DISCLAIMED. IN NO EVENT SHALL Carlo Hamalainen OR CONTRIBUTORS
+BE LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY,
+OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT
+OF SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR
+BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY,
+WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE
+OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE,
+EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+The views and conclusions contained in the software and documentation 
+are those of the authors and should not be interpreted as representing
+official policies, either expressed or implied, of Carlo Hamalainen.
+'''
+
+# Algorithm X for exact cover, with sets of rows and columns stored as
+# the bits of Python integers. Bit i of self.column_rows[j] is set if row
+# i has a 1 in column j. During the search the rows that are still
+# available and the columns that are still uncovered are each a single
+# integer, so covering a column or removing the rows that clash with a
+# chosen row is one bitwise operation.
+
+def popcount(x):
+    """
+    The number of bits set in the nonnegative integer x.
+
+    EXAMPLE:
+        sage: from exact_cover import *
+        sage: popcount(0), popcount(1), popcount(2**70 + 5)
+        (0, 1, 3)
+    """
+
+    return bin(x).count('1')
+
+class ExactCover:
+    """
+    Exact cover problem for the 0-1 matrix whose rows are given as lists
+    of the columns with a 1 in them. Columns may be any hashable
+    values; every column that appears in some row must be covered
+    exactly once.
+
+    EXAMPLES:
+        sage: from exact_cover import *
+        sage: E = ExactCover([[2, 4, 5], [0, 3, 6], [1, 2, 5], [0, 3], [1, 6], [3, 4, 6]])
+        sage: list(E.solutions())
+        [[0, 4, 3]]
+        sage: E.count()
+        1
+        sage: E = ExactCover([[0], [1], [0, 1], [2], [2]])
+        sage: sorted(sorted(x) for x in E.solutions())
+        [[0, 1, 3], [0, 1, 4], [2, 3], [2, 4]]
+        sage: E.count(), E.count(nr_to_find = 3), len(list(E.solutions(nr_to_find = 3)))
+        (4, 3, 3)
+    """
+
+    def __init__(self, rows):
+        self.rows = rows
+
+        self.columns = {}
+        for row in rows:
+            for x in row:
+                if not self.columns.has_key(x): self.columns[x] = len(self.columns)
+
+        self.column_rows = [0]*len(self.columns)
+        for (i, row) in enumerate(rows):
+            for x in row:
+                self.column_rows[self.columns[x]] |= 1 << i
+
+        # The rows that share a column with row i (including row i).
+        self.clashes = []
+        for row in rows:
+            clash = 0
+            for x in row: clash |= self.column_rows[self.columns[x]]
+            self.clashes.append(clash)
+
+        # The columns of row i.
+        self.row_columns = []
+        for row in rows:
+            bits = 0
+            for x in row: bits |= 1 << self.columns[x]
+            self.row_columns.append(bits)
+
+    def choose_column(self, available, uncovered):
+        """
+        The uncovered column with the fewest available rows, as a pair
+        (rows, nr_rows).
+        """
+
+        best = None
+        best_size = None
+
+        while uncovered:
+            low = uncovered & -uncovered
+            uncovered ^= low
+
+            rows = self.column_rows[low.bit_length() - 1] & available
+            size = popcount(rows)
+
+            if best_size is None or size < best_size:
+                best = rows
+                best_size = size
+                if size <= 1: break
+
+        return best, best_size
+
+    def search(self, available, uncovered, chosen):
+        if uncovered == 0:
+            yield chosen
+            return
+
+        (rows, size) = self.choose_column(available, uncovered)
+        if size == 0: return
+
+        while rows:
+            low = rows & -rows
+            rows ^= low
+            i = low.bit_length() - 1
+
+            chosen.append(i)
+            for x in self.search(available & ~self.clashes[i], uncovered & ~self.row_columns[i], chosen):
+                yield x
+            chosen.pop()
+
+    def count_search(self, available, uncovered, limit):
+        if uncovered == 0: return 1
+
+        (rows, size) = self.choose_column(available, uncovered)
+        if size == 0: return 0
+
+        nr_found = 0
+
+        while rows:
+            low = rows & -rows
+            rows ^= low
+            i = low.bit_length() - 1
+
+            nr_found += self.count_search(available & ~self.clashes[i], uncovered & ~self.row_columns[i], None if limit is None else limit - nr_found)
+            if limit is not None and nr_found >= limit: break
+
+        return nr_found
+
+    def solutions(self, nr_to_find = None):
+        """
+        Generate the solutions, each as a list of row indices, stopping
+        after nr_to_find of them if nr_to_find is not None.
+        """
+
+        nr_found = 0
+        if nr_to_find == 0: return
+
+        for x in self.search((1 << len(self.rows)) - 1, (1 << len(self.columns)) - 1, []):
+            yield list(x)
+
+            nr_found += 1
+            if nr_found == nr_to_find: return
+
+    def count(self, nr_to_find = None):
+        """
+        The number of solutions, or nr_to_find if there are at least that
+        many.
+        """
+
+        if nr_to_find == 0: return 0
+
+        return self.count_search((1 << len(self.rows)) - 1, (1 << len(self.columns)) - 1, nr_to_find)
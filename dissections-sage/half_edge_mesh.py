@@ -0,0 +1,318 @@
+'''
+Copyright 2010 Carlo Hamalainen <carlo.hamalainen@gmail.com>. All 
+rights reserved.
+
+Redistribution and use in source and binary forms, with or without 
+modification, are permitted provided that the following conditions
+are met:
+
+   1. Redistributions of source code must retain the above copyright 
+      notice, this list of conditions and the following disclaimer.
+
+   2. Redistributions in binary form must reproduce the above copyright 
+      notice, this list of conditions and the following disclaimer
+      in the documentation and/or other materials provided with the
+      distribution.
+
+THIS SOFTWARE IS PROVIDED BY Carlo Hamalainen ``AS IS'' AND ANY EXPRESS
+OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE
+ARE DISCLAIMED. IN NO EVENT SHALL Carlo Hamalainen OR CONTRIBUTORS
+BE LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY,
+OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT
+OF SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR
+BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY,
+WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE
+OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE,
+EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+The views and conclusions contained in the software and documentation 
+are those of the authors and should not be interpreted as representing
+official policies, either expressed or implied, of Carlo Hamalainen.
+'''
+
+from array import array
+from bisect import bisect_left, bisect_right
+
+# A triangle dissection is stored as a half-edge mesh (also known as a
+# doubly connected edge list). Each triangle is a face whose boundary is
+# split at every vertex that lies on one of its sides, so a side of a
+# large triangle may consist of several half-edges. For the half-edge h,
+# origin[h] is the index of its first vertex, next[h] and prev[h] are
+# the following and preceding half-edges anticlockwise around face[h],
+# and twin[h] is the half-edge in the opposite direction on the other
+# side of the segment, or -1 on the border of the dissection.
+#
+# The six directions of the half-edges are numbered as in
+# DIRECTIONS, with direction d + 3 (mod 6) opposite to direction d.
+
+DIRECTIONS = [(1, 0), (0, 1), (-1, 1), (-1, 0), (0, -1), (1, -1)]
+
+def direction(pt1, pt2):
+    """
+    The index in DIRECTIONS of the direction from pt1 to pt2, or None
+    if the segment from pt1 to pt2 is not an edge direction.
+
+    EXAMPLES:
+        sage: from half_edge_mesh import *
+        sage: direction((0, 0), (2, 0)), direction((0, 2), (1, 1))
+        (0, 5)
+        sage: direction((0, 0), (1, 1)) is None
+        True
+    """
+
+    dx = pt2[0] - pt1[0]
+    dy = pt2[1] - pt1[1]
+
+    if dy == 0 and dx > 0:  return 0
+    if dx == 0 and dy > 0:  return 1
+    if dx == -dy and dy > 0: return 2
+    if dy == 0 and dx < 0:  return 3
+    if dx == 0 and dy < 0:  return 4
+    if dx == -dy and dy < 0: return 5
+
+    return None
+
+def line_key(pt, d):
+    """
+    The line through pt in direction d, as a pair (d mod 3, c) where c
+    is the y, x, or x + y coordinate that is constant along the line.
+
+    EXAMPLE:
+        sage: from half_edge_mesh import *
+        sage: line_key((1, 2), 0), line_key((1, 2), 4), line_key((1, 2), 2)
+        ((0, 2), (1, 1), (2, 3))
+    """
+
+    d = d % 3
+
+    if d == 0: return (0, pt[1])
+    if d == 1: return (1, pt[0])
+    return (2, pt[0] + pt[1])
+
+def line_parameter(pt, d):
+    """
+    The position of pt along a line in direction d.
+    """
+
+    if d % 3 == 1: return pt[1]
+    return pt[0]
+
+class HalfEdgeMesh:
+    """
+    Half-edge mesh of the triangles of a dissection, given as a list of
+    triples of vertices. The faces are numbered in the order of
+    triangles and the vertices in increasing order.
+
+    EXAMPLES:
+        sage: from half_edge_mesh import *
+        sage: m = HalfEdgeMesh([((0, 0), (0, 1), (1, 0)), ((0, 1), (0, 2), (1, 1)), ((1, 0), (1, 1), (2, 0)), ((0, 1), (1, 0), (1, 1))])
+        sage: m.vertices
+        [(0, 0), (0, 1), (0, 2), (1, 0), (1, 1), (2, 0)]
+        sage: len(m.origin), m.face_corners[3]
+        (12, ((0, 1), (1, 0), (1, 1)))
+        sage: [m.faces[f] for f in m.segment_faces(m.vertex_index[(0, 1)], 5)]
+        [((0, 1), (1, 0), (1, 1)), ((0, 0), (0, 1), (1, 0))]
+        sage: m.adjacent_face(0, (0, 1), (1, 0))
+        3
+
+    A triangle whose side contains a vertex of another triangle has
+    that vertex on its boundary:
+
+        sage: m = HalfEdgeMesh([((0, 0), (0, 2), (2, 0)), ((0, 2), (0, 3), (1, 2)), ((0, 2), (1, 1), (1, 2)), ((1, 1), (1, 2), (2, 1)), ((1, 1), (2, 0), (2, 1)), ((1, 2), (2, 1), (3, 0)), ((2, 0), (2, 1), (3, 0))])
+        sage: [m.vertices[v] for v in m.face_vertices(0)]
+        [(0, 0), (2, 0), (1, 1), (0, 2)]
+        sage: m.adjacent_face(0, (0, 2), (2, 0)) is None
+        True
+    """
+
+    def __init__(self, triangles):
+        self.faces = list(triangles)
+        self.face_index = dict((t, f) for (f, t) in enumerate(self.faces))
+
+        self.vertices = sorted(set(p for t in self.faces for p in t))
+        self.vertex_index = dict((p, i) for (i, p) in enumerate(self.vertices))
+
+        # The vertices on each line, in increasing order along the line.
+        # Since self.vertices is sorted by x and then y, this holds for
+        # every line.
+        lines = {}
+        for p in self.vertices:
+            for d in range(3):
+                key = line_key(p, d)
+                if not lines.has_key(key): lines[key] = ([], [])
+                lines[key][0].append(line_parameter(p, d))
+                lines[key][1].append(p)
+
+        self.origin = array('i')
+        self.next = array('i')
+        self.prev = array('i')
+        self.twin = array('i')
+        self.face = array('i')
+        self.direction = array('b')
+
+        # self.face_corners[f] has the corners of face f in anticlockwise
+        # order, and self.corner_index[3*f:3*f + 3] their indices. The
+        # faces with the vertex v as a corner are self.vertex_faces[v].
+        self.face_corners = []
+        self.corner_index = array('i')
+        self.vertex_faces = [[] for p in self.vertices]
+        self.face_edge = array('i')
+
+        for (f, (pt1, pt2, pt3)) in enumerate(self.faces):
+            # Put the corners in anticlockwise order.
+            if (pt2[0] - pt1[0])*(pt3[1] - pt1[1]) < (pt2[1] - pt1[1])*(pt3[0] - pt1[0]):
+                pt2, pt3 = pt3, pt2
+            self.face_corners.append((pt1, pt2, pt3))
+            for p in (pt1, pt2, pt3):
+                self.corner_index.append(self.vertex_index[p])
+                self.vertex_faces[self.vertex_index[p]].append(f)
+
+            first = len(self.origin)
+            self.face_edge.append(first)
+
+            for (r, s) in [(pt1, pt2), (pt2, pt3), (pt3, pt1)]:
+                d = direction(r, s)
+                assert d is not None
+
+                (parameters, points) = lines[line_key(r, d)]
+                a = line_parameter(r, d)
+                b = line_parameter(s, d)
+
+                if a < b:
+                    side = points[bisect_left(parameters, a):bisect_left(parameters, b)]
+                else:
+                    side = points[bisect_right(parameters, b):bisect_right(parameters, a)]
+                    side.reverse()
+
+                for p in side:
+                    self.origin.append(self.vertex_index[p])
+                    self.direction.append(d)
+                    self.face.append(f)
+
+            last = len(self.origin) - 1
+            for h in range(first, last + 1):
+                self.next.append(h + 1 if h < last else first)
+                self.prev.append(h - 1 if h > first else last)
+
+        nr_vertices = len(self.vertices)
+        nr_half_edges = len(self.origin)
+
+        # self.out[6*v + d] is the half-edge leaving vertex v in
+        # direction d, and self.along[6*v + d] the vertex at its other
+        # end, or -1. A border segment only has a half-edge in one
+        # direction, so self.along is filled in from both ends. Removing
+        # faces does not change self.along.
+        self.out = array('i', [-1]*(6*nr_vertices))
+        self.along = array('i', [-1]*(6*nr_vertices))
+
+        for h in range(nr_half_edges):
+            v = self.origin[h]
+            w = self.origin[self.next[h]]
+            d = self.direction[h]
+
+            self.out[6*v + d] = h
+            self.along[6*v + d] = w
+            self.along[6*w + (d + 3) % 6] = v
+
+        self.twin = array('i', [-1]*nr_half_edges)
+        for h in range(nr_half_edges):
+            w = self.origin[self.next[h]]
+            self.twin[h] = self.out[6*w + (self.direction[h] + 3) % 6]
+
+    def destination(self, h):
+        """
+        The index of the last vertex of the half-edge h.
+        """
+
+        return self.origin[self.next[h]]
+
+    def is_removed(self, f):
+        """
+        Has the face f been removed from the mesh?
+        """
+
+        return self.face[self.face_edge[f]] != f
+
+    def face_vertices(self, f):
+        """
+        The indices of the vertices on the boundary of the face f, in
+        anticlockwise order.
+        """
+
+        h = self.face_edge[f]
+        vertices = []
+
+        while True:
+            vertices.append(self.origin[h])
+            h = self.next[h]
+            if h == self.face_edge[f]: break
+
+        return vertices
+
+    def step(self, v, d):
+        """
+        The index of the vertex next to the vertex v in direction d, or
+        -1 if there is no edge of the mesh leaving v in direction d.
+        """
+
+        return self.along[6*v + d]
+
+    def segment_faces(self, v, d):
+        """
+        The (one or two) faces that have the segment from the vertex v
+        to self.step(v, d) on their boundary. The face on the left of
+        the segment is listed first.
+        """
+
+        faces = []
+
+        h = self.out[6*v + d]
+        if h >= 0:
+            faces.append(self.face[h])
+
+        w = self.along[6*v + d]
+        if w >= 0:
+            h = self.out[6*w + (d + 3) % 6]
+            if h >= 0: faces.append(self.face[h])
+
+        return faces
+
+    def adjacent_face(self, f, r, s):
+        """
+        The face other than f that has both r and s as corners and
+        shares the side from r to s with f, or None.
+        """
+
+        d = direction(r, s)
+        if d is None: return None
+
+        v = self.vertex_index[r]
+
+        # If the segment from r to s is split by a vertex then no other
+        # triangle can have both r and s as corners.
+        if self.along[6*v + d] != self.vertex_index[s]: return None
+
+        for g in self.segment_faces(v, d):
+            if g != f and r in self.faces[g] and s in self.faces[g]: return g
+
+        return None
+
+    def remove_face(self, f):
+        """
+        Remove the face f from the mesh. Its half-edges are detached and
+        the segments that it shared with other faces become part of the
+        border.
+        """
+
+        h = self.face_edge[f]
+        while True:
+            if self.twin[h] >= 0:
+                self.twin[self.twin[h]] = -1
+                self.twin[h] = -1
+
+            self.out[6*self.origin[h] + self.direction[h]] = -1
+            self.face[h] = -1
+
+            h = self.next[h]
+            if h == self.face_edge[f]: break
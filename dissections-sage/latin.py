@@ -0,0 +1,246 @@
+'''
+Copyright 2010 Carlo Hamalainen <carlo.hamalainen@gmail.com>. All 
+rights reserved.
+
+Redistribution and use in source and binary forms, with or without 
+modification, are permitted provided that the following conditions
+are met:
+
+   1. Redistributions of source code must retain the above copyright 
+      notice, this list of conditions and the following disclaimer.
+
+   2. Redistributions in binary form must reproduce the above copyright 
+      notice, this list of conditions and the following disclaimer
+      in the documentation and/or other materials provided with the
+      distribution.
+
+THIS SOFTWARE IS PROVIDED BY Carlo Hamalainen ``AS IS'' AND ANY EXPRESS
+OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE
+ARE DISCLAIMED. IN NO EVENT SHALL Carlo Hamalainen OR CONTRIBUTORS
+BE LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY,
+OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT
+OF SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR
+BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY,
+WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE
+OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE,
+EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+The views and conclusions contained in the software and documentation 
+are those of the authors and should not be interpreted as representing
+official policies, either expressed or implied, of Carlo Hamalainen.
+'''
+
+# Partial latin squares and bitrades in plain Python, for running the
+# dissection code without Sage. LatinSquare follows the interface of
+# sage.combinat.matrices.latin.LatinSquare for the methods that we use,
+# and is_bitrade and genus compute the same things as the Sage
+# functions of the same name. Empty cells are -1.
+
+from fractions import gcd
+
+def uniq(x):
+    """
+    The distinct elements of x in increasing order (as Sage's uniq).
+
+    EXAMPLE:
+        sage: import latin
+        sage: latin.uniq([3, 1, 3, 2])
+        [1, 2, 3]
+    """
+
+    return sorted(set(x))
+
+def flatten(x):
+    """
+    The elements of the nested lists and tuples in x (as Sage's flatten).
+
+    EXAMPLE:
+        sage: import latin
+        sage: latin.flatten([[0, 1], [2, (3, 4)]])
+        [0, 1, 2, 3, 4]
+    """
+
+    result = []
+
+    for y in x:
+        if isinstance(y, (list, tuple)): result.extend(flatten(y))
+        else: result.append(y)
+
+    return result
+
+def lcm(x):
+    """
+    The least common multiple of the integers in the list x.
+
+    EXAMPLE:
+        sage: import latin
+        sage: latin.lcm([4, 6, 1])
+        12
+    """
+
+    result = 1
+    for y in x: result = result*y // gcd(result, y)
+
+    return result
+
+class LatinSquare:
+    """
+    A partial latin square with nrows rows and ncols columns (ncols
+    defaults to nrows), with every cell empty.
+
+    EXAMPLES:
+        sage: import latin
+        sage: L = latin.LatinSquare(3)
+        sage: L[0, 0] = 2; L[1, 2] = 0
+        sage: L
+        [ 2 -1 -1]
+        [-1 -1  0]
+        [-1 -1 -1]
+        sage: L.actual_row_col_sym_sizes()
+        (2, 3, 2)
+        sage: L.is_partial_latin_square()
+        True
+    """
+
+    def __init__(self, nrows, ncols = None):
+        if ncols is None: ncols = nrows
+
+        self.square = [[-1]*ncols for r in range(nrows)]
+
+    def __getitem__(self, (r, c)):
+        return self.square[r][c]
+
+    def __setitem__(self, (r, c), e):
+        self.square[r][c] = e
+
+    def __eq__(self, Q):
+        return isinstance(Q, LatinSquare) and self.square == Q.square
+
+    def __ne__(self, Q):
+        return not self == Q
+
+    def __repr__(self):
+        width = max([len(str(e)) for row in self.square for e in row] + [1])
+
+        return "\n".join(["[" + " ".join([str(e).rjust(width) for e in row]) + "]" for row in self.square])
+
+    def nrows(self):
+        return len(self.square)
+
+    def ncols(self):
+        if len(self.square) == 0: return 0
+        return len(self.square[0])
+
+    def nr_filled_cells(self):
+        return len([e for row in self.square for e in row if e >= 0])
+
+    def nr_distinct_symbols(self):
+        return len(set([e for row in self.square for e in row if e >= 0]))
+
+    def is_empty_row(self, r):
+        return max(self.square[r]) < 0
+
+    def is_empty_column(self, c):
+        return max([row[c] for row in self.square]) < 0
+
+    def actual_row_col_sym_sizes(self):
+        """
+        The number of rows and columns up to the last nonempty one, and
+        the number of distinct symbols.
+        """
+
+        row_max = self.nrows()
+        col_max = self.ncols()
+
+        while row_max > 0 and self.is_empty_row(row_max - 1): row_max -= 1
+        while col_max > 0 and self.is_empty_column(col_max - 1): col_max -= 1
+
+        return row_max, col_max, self.nr_distinct_symbols()
+
+    def vals_in_row(self, r):
+        return dict((e, True) for e in self.square[r] if e >= 0)
+
+    def vals_in_col(self, c):
+        return dict((row[c], True) for row in self.square if row[c] >= 0)
+
+    def filled_cells_map(self):
+        """
+        Number the filled cells 1, 2, ... in row-major order. The
+        dictionary maps each number to its cell and each cell to its
+        number.
+        """
+
+        cells_map = {}
+        k = 1
+
+        for r in range(self.nrows()):
+            for c in range(self.ncols()):
+                if self[r, c] < 0: continue
+
+                cells_map[k] = (r, c)
+                cells_map[(r, c)] = k
+                k += 1
+
+        return cells_map
+
+    def is_partial_latin_square(self):
+        """
+        Is the square n by n with entries in 0, 1, ..., n - 1 and no
+        symbol repeated in a row or column?
+        """
+
+        n = self.nrows()
+        if self.ncols() != n: return False
+
+        for r in range(n):
+            vals = [e for e in self.square[r] if e >= 0]
+            if len(vals) != len(set(vals)): return False
+            if len(vals) > 0 and max(vals) >= n: return False
+
+        for c in range(n):
+            vals = [row[c] for row in self.square if row[c] >= 0]
+            if len(vals) != len(set(vals)): return False
+
+        return True
+
+def is_bitrade(T1, T2):
+    """
+    Are T1 and T2 disjoint partial latin squares with the same filled
+    cells and the same symbols in each row and column?
+
+    EXAMPLE:
+        sage: import latin
+        sage: T1 = latin.LatinSquare(2); T2 = latin.LatinSquare(2)
+        sage: for (r, c) in [(0, 0), (0, 1), (1, 0), (1, 1)]: T1[r, c] = (r + c) % 2; T2[r, c] = (r + c + 1) % 2
+        sage: latin.is_bitrade(T1, T2), latin.genus(T1, T2)
+        (True, 0)
+    """
+
+    if T1.nrows() != T2.nrows() or T1.ncols() != T2.ncols(): return False
+    if not T1.is_partial_latin_square(): return False
+    if not T2.is_partial_latin_square(): return False
+
+    for r in range(T1.nrows()):
+        for c in range(T1.ncols()):
+            if (T1[r, c] < 0) != (T2[r, c] < 0): return False
+            if T1[r, c] >= 0 and T1[r, c] == T2[r, c]: return False
+
+    for r in range(T1.nrows()):
+        if T1.vals_in_row(r) != T2.vals_in_row(r): return False
+
+    for c in range(T1.ncols()):
+        if T1.vals_in_col(c) != T2.vals_in_col(c): return False
+
+    return True
+
+def genus(T1, T2):
+    """
+    The genus of the bitrade (T1, T2), from the cycles of the
+    permutations tau_1, tau_2, tau_3 on the filled cells of T1 (see
+    bbitrade.py).
+    """
+
+    from bbitrade import latin_squares_to_bitrade
+
+    return latin_squares_to_bitrade(T1, T2).genus()
@@ -0,0 +1,222 @@
+'''
+Copyright 2010 Carlo Hamalainen <carlo.hamalainen@gmail.com>. All 
+rights reserved.
+
+Redistribution and use in source and binary forms, with or without 
+modification, are permitted provided that the following conditions
+are met:
+
+   1. Redistributions of source code must retain the above copyright 
+      notice, this list of conditions and the following disclaimer.
+
+   2. Redistributions in binary form must reproduce the above copyright 
+      notice, this list of conditions and the following disclaimer
+      in the documentation and/or other materials provided with the
+      distribution.
+
+THIS SOFTWARE IS PROVIDED BY Carlo Hamalainen ``AS IS'' AND ANY EXPRESS
+OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE
+ARE DISCLAIMED. IN NO EVENT SHALL Carlo Hamalainen OR CONTRIBUTORS
+BE LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY,
+OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT
+OF SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR
+BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY,
+WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE
+OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE,
+EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+The views and conclusions contained in the software and documentation 
+are those of the authors and should not be interpreted as representing
+official policies, either expressed or implied, of Carlo Hamalainen.
+'''
+
+from fractions import Fraction
+
+from sparse_solver import dissection_equations
+
+# Primes just below 2^31. We work modulo several of these and combine
+# the results with the Chinese remainder theorem.
+PRIMES = [2147483647, 2147483629, 2147483587, 2147483579, 2147483563,
+          2147483549, 2147483543, 2147483497, 2147483489, 2147483477,
+          2147483423, 2147483399, 2147483353, 2147483323, 2147483269,
+          2147483249]
+
+def solve_mod_p(equations, rhs, nr_variables, p):
+    """
+    Solve a square system modulo the prime p using Gauss-Jordan
+    elimination. The equations are dictionaries mapping a variable to
+    its coefficient, as in sparse_solver.py. Raises ValueError if the
+    system is singular modulo p.
+
+    EXAMPLES:
+        sage: from modular_solver import *
+        sage: solve_mod_p([{0: 1, 1: 1}, {0: 1, 1: -1}], [1, 0], 2, 7)
+        [4, 4]
+        sage: solve_mod_p([{0: 1, 1: 1}, {0: 2, 1: 2}], [1, 0], 2, 7)
+        Traceback (most recent call last):
+        ...
+        ValueError: singular system modulo 7
+    """
+
+    m = nr_variables
+    assert len(equations) == m
+
+    M = []
+    for (eq, b) in zip(equations, rhs):
+        row = [0]*(m + 1)
+        for (v, a) in eq.iteritems():
+            row[v] = a % p
+        row[m] = b % p
+        M.append(row)
+
+    for col in range(m):
+        pivot = None
+        for i in range(col, m):
+            if M[i][col] != 0:
+                pivot = i
+                break
+
+        if pivot is None:
+            raise ValueError, "singular system modulo " + str(p)
+
+        M[col], M[pivot] = M[pivot], M[col]
+
+        inv = pow(M[col][col], p - 2, p)
+        M[col] = [(x*inv) % p for x in M[col]]
+
+        for i in range(m):
+            if i == col or M[i][col] == 0: continue
+            f = M[i][col]
+            M[i] = [(x - f*y) % p for (x, y) in zip(M[i], M[col])]
+
+    return [M[i][m] for i in range(m)]
+
+def crt(residues, moduli):
+    """
+    Chinese remainder theorem: the unique x modulo prod(moduli) with
+    x = residues[i] modulo moduli[i].
+
+    EXAMPLES:
+        sage: from modular_solver import *
+        sage: crt([2, 3], [3, 5])
+        (8, 15)
+    """
+
+    x = 0
+    m = 1
+
+    for (a, p) in zip(residues, moduli):
+        # Find t with x + m*t = a (mod p).
+        t = ((a - x)*pow(m % p, p - 2, p)) % p
+        x += m*t
+        m *= p
+
+    return x, m
+
+def rational_reconstruction(a, m):
+    """
+    Find the fraction n/d with |n|, d <= sqrt(m/2) and n = a*d
+    (mod m), or return None if there is no such fraction.
+
+    EXAMPLES:
+        sage: from modular_solver import *
+        sage: rational_reconstruction(8, 15)
+        Fraction(1, 2)
+        sage: x, m = crt([pow(39, 2147483647 - 2, 2147483647)*17 % 2147483647], [2147483647])
+        sage: rational_reconstruction(x, m)
+        Fraction(17, 39)
+    """
+
+    a = a % m
+
+    # Binary search for floor(sqrt(m/2)).
+    lo, hi = 0, m + 1
+    while hi - lo > 1:
+        mid = (lo + hi)//2
+        if 2*mid*mid <= m: lo = mid
+        else: hi = mid
+    bound = lo
+
+    r0, r1 = m, a
+    s0, s1 = 0, 1
+
+    while r1 > bound:
+        q = r0//r1
+        r0, r1 = r1, r0 - q*r1
+        s0, s1 = s1, s0 - q*s1
+
+    if s1 == 0 or abs(s1) > bound: return None
+    if (r1 - a*s1) % m != 0: return None
+
+    return Fraction(r1, s1)
+
+def modular_solve_dissection(triples, row_max, col_max, sym_max, id_triple):
+    """
+    Solve Eq(T, a) modulo several word-sized primes, combine the
+    residues with the Chinese remainder theorem and recover the rational
+    solution by rational reconstruction. The result is checked exactly
+    against the equations before it is returned, as a list of Fractions
+    ordered like the last column of the echelon form of
+    trade_dissection_matrix().
+
+    Every row of the system has at most three entries equal to +-1 so by
+    Hadamard's bound the numerators and the common denominator of the
+    solution are at most 3^(m/2), where m is the number of variables. We
+    use enough primes for the product to exceed 2*3^m, and more if the
+    reconstructed vector doesn't check out.
+
+    EXAMPLES:
+        sage: from modular_solver import *
+        sage: T = [(0, 0, 0), (0, 1, 1), (1, 1, 0), (1, 0, 2), (2, 0, 1), (2, 1, 2)]
+        sage: modular_solve_dissection(T, 3, 2, 3, (0, 0, 0))
+        [Fraction(0, 1), Fraction(2, 3), Fraction(1, 3), Fraction(0, 1), Fraction(1, 3), Fraction(1, 1), Fraction(1, 3), Fraction(2, 3)]
+    """
+
+    equations, rhs = dissection_equations(triples, row_max, col_max, sym_max, id_triple)
+    m = row_max + col_max + sym_max
+
+    target = 2*3**m
+
+    residues = []
+    moduli = []
+    modulus = 1
+
+    for p in PRIMES:
+        try:
+            residues.append(solve_mod_p(equations, rhs, m, p))
+        except ValueError:
+            continue # unlucky prime
+
+        moduli.append(p)
+        modulus *= p
+
+        if modulus <= target: continue
+
+        x = []
+        for i in range(m):
+            a, _ = crt([r[i] for r in residues], moduli)
+            x.append(rational_reconstruction(a, modulus))
+
+        if None in x: continue
+
+        if is_solution(equations, rhs, x): return x
+
+    raise ValueError, "modular solver ran out of primes"
+
+def is_solution(equations, rhs, x):
+    """
+    Exact check that x solves the system.
+
+    EXAMPLES:
+        sage: from modular_solver import *
+        sage: is_solution([{0: 1, 1: 1}], [1], [Fraction(1, 2), Fraction(1, 2)])
+        True
+        sage: is_solution([{0: 1, 1: 1}], [1], [Fraction(1, 2), Fraction(1, 3)])
+        False
+    """
+
+    for (eq, b) in zip(equations, rhs):
+        if sum(a*x[v] for (v, a) in eq.iteritems()) != b: return False
+
+    return True
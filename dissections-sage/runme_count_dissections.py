@@ -1,4 +1,4 @@
-#!/usr/bin/env sage-python
+#!/usr/bin/env python
 
 '''
 Copyright 2010 Carlo Hamalainen <carlo.hamalainen@gmail.com>. All 
@@ -33,7 +33,6 @@ are those of the authors and should not be interpreted as representing
 official policies, either expressed or implied, of Carlo Hamalainen.
 '''
 
-import sage.all
 import os
 import sys
 
@@ -41,7 +40,23 @@ from unique_dissections import disk_count_dissections
 
 if __name__ == "__main__":
     # fixme manual handling of arguments
-    if len(sys.argv) != 3:
+    resume = '--resume' in sys.argv
+    dedupe = '--all-bitrades' not in sys.argv
+    orbits = '--all-identities' not in sys.argv
+    check_orbits = '--check-orbits' in sys.argv
+    swap_symmetry = '--solve-swapped' not in sys.argv
+    check_swap = '--check-swap' in sys.argv
+    keep_degenerate = '--keep-degenerate' in sys.argv
+    aut_groups = '--aut-groups' in sys.argv
+    args = [a for a in sys.argv if a not in ['--resume', '--all-bitrades', '--all-identities', '--check-orbits',
+                                             '--solve-swapped', '--check-swap', '--keep-degenerate',
+                                             '--aut-groups']]
+
+    if dedupe and (not swap_symmetry or check_swap):
+        print '--solve-swapped and --check-swap only apply with --all-bitrades.'
+        sys.exit(1)
+
+    if len(args) not in [3, 4]:
         print 'Count separated or nonseparated dissections up to a specified size.'
         print
         print 'Examples:'
@@ -52,17 +67,55 @@ if __name__ == "__main__":
         print 'Count nonseparated dissections up to size 13:'
         print '$ ./runme_count_dissections.py 13 nonseparated'
         print
-        print 'In both cases, process the output files signatures_* using'
-        print 'the script count_aut_groups.sh'
+        print 'Count separated dissections up to size 13 using 32 processes:'
+        print '$ ./runme_count_dissections.py 13 separated 32'
+        print
+        print 'Carry on from the last checkpoint of an earlier run (sizes that'
+        print 'were finished are skipped):'
+        print '$ ./runme_count_dissections.py 14 separated 32 --resume'
+        print
+        print 'Bitrades isomorphic to earlier ones are skipped since they give the'
+        print 'same dissections; to solve every bitrade anyway:'
+        print '$ ./runme_count_dissections.py 13 separated --all-bitrades'
+        print
+        print 'Likewise only one identity cell in each orbit of the autotopism group'
+        print 'of a bitrade is solved. To solve them all use --all-identities, or to'
+        print 'solve them all and check that each orbit gives one signature:'
+        print '$ ./runme_count_dissections.py 13 separated --check-orbits'
+        print
+        print 'With --all-bitrades the swapped bitrade (T2, T1) is not solved when it is'
+        print 'isomorphic to a conjugate of (T1, T2), since its dissections are then'
+        print 'reflections of those of (T1, T2). (Without --all-bitrades such a (T2, T1)'
+        print 'is skipped as a duplicate anyway, so --solve-swapped and --check-swap'
+        print 'need --all-bitrades.) To solve it anyway use --solve-swapped, or to solve'
+        print 'it and check the signatures against (T1, T2):'
+        print '$ ./runme_count_dissections.py 13 separated --all-bitrades --check-swap'
+        print
+        print 'Nonseparated solutions where some triangles degenerate give dissections'
+        print 'that smaller bitrades also give, so they are skipped. To write them to'
+        print 'the signature files of their smaller sizes anyway:'
+        print '$ ./runme_count_dissections.py 13 nonseparated --keep-degenerate'
+        print
+        print 'In all cases the signatures are written to the files signatures_*. With'
+        print '--aut-groups each signature is prefixed with the order of its automorphism'
+        print 'group (as with td --aut-groups) and the counts of the distinct signatures'
+        print 'of each size by group order are written to aut_groups_*:'
+        print '$ ./runme_count_dissections.py 13 separated --aut-groups'
         print
         sys.exit(1)
 
-    max_size = int(sys.argv[1]) 
-    only_sep = sys.argv[2]
+    max_size = int(args[1]) 
+    only_sep = args[2]
     assert only_sep in ['separated', 'nonseparated']
     only_sep = only_sep == 'separated'
 
-    disk_count_dissections(4, max_size, only_sep)
+    if len(args) == 4: nr_workers = int(args[3])
+    else: nr_workers = 1
+    assert nr_workers >= 1
+
+    disk_count_dissections(4, max_size, only_sep, nr_workers = nr_workers, resume = resume, dedupe = dedupe,
+                           orbits = orbits, check_orbits = check_orbits, swap_symmetry = swap_symmetry,
+                           check_swap = check_swap, keep_degenerate = keep_degenerate, aut_groups = aut_groups)
 
 
 
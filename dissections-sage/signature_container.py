@@ -0,0 +1,608 @@
+'''
+Copyright 2010 Carlo Hamalainen <carlo.hamalainen@gmail.com>. All 
+rights reserved.
+
+Redistribution and use in source and binary forms, with or without 
+modification, are permitted provided that the following conditions
+are met:
+
+   1. Redistributions of source code must retain the above copyright 
+      notice, this list of conditions and the following disclaimer.
+
+   2. Redistributions in binary form must reproduce the above copyright 
+      notice, this list of conditions and the following disclaimer
+      in the documentation and/or other materials provided with the
+      distribution.
+
+THIS SOFTWARE IS PROVIDED BY Carlo Hamalainen ``AS IS'' AND ANY EXPRESS
+OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE
+ARE DISCLAIMED. IN NO EVENT SHALL Carlo Hamalainen OR CONTRIBUTORS
+BE LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY,
+OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT
+OF SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR
+BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY,
+WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE
+OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE,
+EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+The views and conclusions contained in the software and documentation 
+are those of the authors and should not be interpreted as representing
+official policies, either expressed or implied, of Carlo Hamalainen.
+'''
+
+import mmap
+import os
+import struct
+import sys
+import zlib
+
+from fractions import Fraction, gcd
+
+# A container is laid out as
+#
+#   MAGIC, header, block 0, block 1, ..., index, trailer
+#
+# The header is the varints (block_size, flags). Each block is a varint
+# length followed by that many bytes of payload (zlib compressed if
+# FLAG_COMPRESSED is set), which is the concatenation of block_size
+# records (fewer in the last block). The index has, for each block, the
+# varints (offset, nr_records, len(first_key)) followed by the first key
+# of the block. The trailer is the little-endian 64-bit offset of the
+# index, the number of blocks, and the total number of records.
+#
+# If FLAG_AUT_GROUPS is set, each record is followed by a varint with the
+# order of the automorphism group of the dissection, which is the prefix
+# of the lines written by disk_count_dissections with aut_groups = True
+# and by td --aut-groups. The encoding of a signature determines its own
+# length, so the sorted order of the records is still the order of the
+# encodings of their signatures.
+#
+# A record keeps the values of a signature but not its text, so a text file
+# does not come back byte for byte: container_to_text writes each
+# signature without the trailing space that td writes, and
+# text_to_container with sort = True (the default) orders the signatures
+# by their encoding, which is not the order of sort(1), and drops
+# duplicates. With sort = False the signatures keep their order and
+# duplicates, so only the trailing spaces differ.
+
+MAGIC = 'TDSIG\x01'
+
+FLAG_COMPRESSED = 1
+FLAG_SORTED     = 2
+FLAG_AUT_GROUPS = 4
+
+TRAILER = struct.Struct('<QQQ')
+
+def write_varint(out, x):
+    """
+    Append the unsigned integer x to the bytearray out as a varint
+    (7 bits per byte, least significant first).
+
+    EXAMPLES:
+        sage: from signature_container import *
+        sage: out = bytearray()
+        sage: write_varint(out, 5); write_varint(out, 300)
+        sage: list(out)
+        [5, 172, 2]
+    """
+
+    assert x >= 0
+
+    while x >= 0x80:
+        out.append((x & 0x7f) | 0x80)
+        x >>= 7
+
+    out.append(x)
+
+def read_varint(buf, pos):
+    """
+    Read a varint from buf (a str, bytearray or mmap) at position pos.
+    Returns the value and the position after it.
+
+    EXAMPLES:
+        sage: from signature_container import *
+        sage: read_varint(bytearray([5, 172, 2]), 1)
+        (300, 3)
+    """
+
+    x = 0
+    shift = 0
+
+    while True:
+        b = buf[pos]
+        if not isinstance(b, int): b = ord(b)
+        pos += 1
+        x |= (b & 0x7f) << shift
+        if b < 0x80: return x, pos
+        shift += 7
+
+def parse_signature_line(line):
+    """
+    Parse a line of a signatures_* file (or the output of td) into a
+    tuple of Fractions, as returned by canonical_signature.
+
+    EXAMPLES:
+        sage: from signature_container import *
+        sage: sig = parse_signature_line('0 0 0 0 1/2 0 0 1/2 1 0 0 0 ')
+        sage: len(sig), sig[4]
+        (12, Fraction(1, 2))
+    """
+
+    return tuple([Fraction(x) for x in line.split()])
+
+def parse_aut_signature_line(line):
+    """
+    Parse a line of a signatures file that may start with the order of
+    the automorphism group of the dissection, as written with
+    aut_groups = True (see disk_count_dissections) or by td
+    --aut-groups. Such a line has 12k + 1 entries (see
+    aut_group_size_prefix in aut_groups.cpp). Returns the order, or
+    None if there is no prefix, and the signature.
+
+    EXAMPLES:
+        sage: from signature_container import *
+        sage: aut, sig = parse_aut_signature_line('6 0 0 0 0 1/2 0 0 1/2 1 0 0 0 ')
+        sage: aut, len(sig)
+        (6, 12)
+        sage: parse_aut_signature_line('0 0 0 0 1/2 0 0 1/2 1 0 0 0')[0] is None
+        True
+    """
+
+    entries = line.split()
+    aut = None
+
+    if len(entries) % 12 == 1:
+        aut = int(entries[0])
+        assert aut in [1, 2, 3, 6]
+        entries = entries[1:]
+
+    return aut, tuple([Fraction(x) for x in entries])
+
+def encode_signature(sig):
+    """
+    Encode a signature (a sequence of 12 rationals per triangle, as
+    returned by canonical_signature) as a record. Each vertex of the
+    signature is (X, 0, 0, Y) in the equilateral triangle, and we
+    store the integers D*X, D*Y where D is the common denominator of
+    the signature. The record is the varints D, the number of
+    triangles, and then D*X, D*Y for each vertex.
+
+    EXAMPLES:
+        sage: from signature_container import *
+        sage: sig = parse_signature_line('0 0 0 0 1/4 0 0 1/4 1/2 0 0 0')
+        sage: list(bytearray(encode_signature(sig)))
+        [4, 1, 0, 0, 1, 1, 2, 0]
+    """
+
+    assert len(sig) % 12 == 0
+
+    D = 1
+    for x in sig:
+        x = Fraction(x)
+        D = D*x.denominator/gcd(D, x.denominator)
+
+    out = bytearray()
+    write_varint(out, D)
+    write_varint(out, len(sig)/12)
+
+    for i in range(0, len(sig), 4):
+        assert sig[i+1] == 0 and sig[i+2] == 0
+        write_varint(out, int(sig[i]*D))
+        write_varint(out, int(sig[i+3]*D))
+
+    return str(out)
+
+def decode_signature(buf, pos = 0):
+    """
+    Decode the record at position pos of buf. Returns the signature as
+    a tuple of Fractions and the position after the record.
+
+    EXAMPLES:
+        sage: from signature_container import *
+        sage: sig = parse_signature_line('0 0 0 0 1/4 0 0 1/4 1/2 0 0 0')
+        sage: decode_signature(encode_signature(sig))[0] == sig
+        True
+    """
+
+    D, pos = read_varint(buf, pos)
+    nr_triangles, pos = read_varint(buf, pos)
+
+    zero = Fraction(0)
+    sig = []
+
+    for _ in range(3*nr_triangles):
+        x, pos = read_varint(buf, pos)
+        y, pos = read_varint(buf, pos)
+        sig += [Fraction(x, D), zero, zero, Fraction(y, D)]
+
+    return tuple(sig), pos
+
+class SignatureWriter:
+    """
+    Write signatures to a binary container, block_size records to
+    a block. If compress is True each block is compressed with zlib. If
+    sorted is True the records must be written in increasing order of
+    their encoding (and without duplicates), which lets
+    SignatureReader look up a signature using the block index. If
+    aut_groups is True each record also stores the order of the
+    automorphism group of the dissection.
+
+    EXAMPLES:
+        sage: from signature_container import *
+        sage: import tempfile
+        sage: filename = tempfile.mktemp()
+        sage: sigs = [parse_signature_line('0 0 0 0 1/4 0 0 1/4 1/2 0 0 0'), parse_signature_line('0 0 0 0 1/2 0 0 1/2 1 0 0 0')]
+        sage: w = SignatureWriter(open(filename, 'wb'), block_size = 1, compress = True)
+        sage: for sig in sigs: w.write(sig)
+        sage: w.close()
+        sage: r = SignatureReader(filename)
+        sage: len(r), r.nr_blocks
+        (2, 2)
+        sage: list(r) == sigs
+        True
+    """
+
+    def __init__(self, f, block_size = 1024, compress = False, sorted = False, aut_groups = False):
+        self.f = f
+        self.block_size = block_size
+        self.compress = compress
+        self.sorted = sorted
+        self.aut_groups = aut_groups
+
+        self.index = []
+        self.block = []
+        self.nr_records = 0
+        self.last_key = None
+
+        flags = 0
+        if compress: flags |= FLAG_COMPRESSED
+        if sorted: flags |= FLAG_SORTED
+        if aut_groups: flags |= FLAG_AUT_GROUPS
+
+        header = bytearray(MAGIC)
+        write_varint(header, block_size)
+        write_varint(header, flags)
+        self.f.write(str(header))
+        self.offset = len(header)
+
+    def write(self, sig, aut = None):
+        """
+        Append the signature sig (a sequence of rationals, or a line of
+        text as written by disk_count_dissections and td, in which case
+        aut is read from the line). The order aut of the automorphism
+        group is needed if and only if the container has aut_groups.
+        """
+
+        if isinstance(sig, str): aut, sig = parse_aut_signature_line(sig)
+
+        if self.aut_groups and aut is None:
+            raise ValueError, "signature without the order of its automorphism group"
+        if not self.aut_groups and aut is not None:
+            raise ValueError, "automorphism group order for a container without aut_groups"
+
+        key = encode_signature(sig)
+
+        if self.aut_groups:
+            record = bytearray(key)
+            write_varint(record, aut)
+            key = str(record)
+
+        if self.sorted:
+            if self.last_key is not None and key <= self.last_key:
+                raise ValueError, "signatures are not sorted"
+            self.last_key = key
+
+        self.block.append(key)
+        self.nr_records += 1
+
+        if len(self.block) == self.block_size: self.flush_block()
+
+    def flush_block(self):
+        if len(self.block) == 0: return
+
+        payload = ''.join(self.block)
+        if self.compress: payload = zlib.compress(payload)
+
+        out = bytearray()
+        write_varint(out, len(payload))
+
+        self.index.append((self.offset, len(self.block), self.block[0]))
+
+        self.f.write(str(out))
+        self.f.write(payload)
+        self.offset += len(out) + len(payload)
+
+        self.block = []
+
+    def close(self):
+        self.flush_block()
+
+        index = bytearray()
+        for (offset, nr_records, first_key) in self.index:
+            write_varint(index, offset)
+            write_varint(index, nr_records)
+            write_varint(index, len(first_key))
+            index += first_key
+
+        self.f.write(str(index))
+        self.f.write(TRAILER.pack(self.offset, len(self.index), self.nr_records))
+        self.f.close()
+
+class SignatureReader:
+    """
+    Read a binary container written by SignatureWriter. Iterating over
+    the reader gives the signatures as tuples of Fractions; read_block(i)
+    decodes just the i-th block. records() gives the pairs (aut, sig)
+    where aut is the order of the automorphism group, or None if the
+    container was written without aut_groups.
+
+    The file is mapped with mmap, and only the header, the trailer and
+    the block index are read when the reader is made; each block is
+    read (and decompressed) when it is needed.
+
+    EXAMPLES:
+        sage: from signature_container import *
+        sage: import tempfile
+        sage: filename = tempfile.mktemp()
+        sage: lines = ['0 0 0 0 1/%d 0 0 1/%d 2/%d 0 0 0' % (i, i, i) for i in range(2, 12)]
+        sage: sigs = sorted([parse_signature_line(line) for line in lines], key = encode_signature)
+        sage: w = SignatureWriter(open(filename, 'wb'), block_size = 4, sorted = True)
+        sage: for sig in sigs: w.write(sig)
+        sage: w.close()
+        sage: r = SignatureReader(filename)
+        sage: r.nr_blocks, [len(r.read_block(i)) for i in range(r.nr_blocks)]
+        (3, [4, 4, 2])
+        sage: sigs[5] in r
+        True
+        sage: parse_signature_line('0 0 0 0 1/12 0 0 1/12 2/12 0 0 0') in r
+        False
+    """
+
+    def __init__(self, filename):
+        f = open(filename, 'rb')
+        size = os.fstat(f.fileno()).st_size
+
+        if size < len(MAGIC) + TRAILER.size:
+            f.close()
+            raise ValueError, "not a signature container: " + filename
+
+        self.data = mmap.mmap(f.fileno(), size, access = mmap.ACCESS_READ)
+        f.close()
+
+        if self.data[:len(MAGIC)] != MAGIC:
+            raise ValueError, "not a signature container: " + filename
+
+        pos = len(MAGIC)
+        self.block_size, pos = read_varint(self.data, pos)
+        flags, pos = read_varint(self.data, pos)
+
+        self.compressed = (flags & FLAG_COMPRESSED) != 0
+        self.sorted = (flags & FLAG_SORTED) != 0
+        self.aut_groups = (flags & FLAG_AUT_GROUPS) != 0
+
+        index_offset, self.nr_blocks, self.nr_records = TRAILER.unpack(self.data[-TRAILER.size:])
+
+        # (offset, nr_records, first_key) for each block
+        self.index = []
+
+        pos = index_offset
+        for _ in range(self.nr_blocks):
+            offset, pos = read_varint(self.data, pos)
+            nr_records, pos = read_varint(self.data, pos)
+            key_length, pos = read_varint(self.data, pos)
+            self.index.append((offset, nr_records, self.data[pos:pos + key_length]))
+            pos += key_length
+
+    def __len__(self):
+        return self.nr_records
+
+    def block_payload(self, i):
+        offset, nr_records, first_key = self.index[i]
+
+        length, pos = read_varint(self.data, offset)
+        payload = self.data[pos:pos + length]
+
+        if self.compressed: payload = zlib.decompress(payload)
+
+        return payload
+
+    def read_block_records(self, i):
+        """
+        The pairs (aut, sig) in the i-th block.
+        """
+
+        payload = self.block_payload(i)
+
+        records = []
+        pos = 0
+        for _ in range(self.index[i][1]):
+            sig, pos = decode_signature(payload, pos)
+
+            aut = None
+            if self.aut_groups: aut, pos = read_varint(payload, pos)
+
+            records.append((aut, sig))
+
+        return records
+
+    def read_block(self, i):
+        """
+        The signatures in the i-th block.
+        """
+
+        return [sig for (aut, sig) in self.read_block_records(i)]
+
+    def records(self):
+        for i in range(self.nr_blocks):
+            for record in self.read_block_records(i):
+                yield record
+
+    def __iter__(self):
+        for (aut, sig) in self.records():
+            yield sig
+
+    def __contains__(self, sig):
+        """
+        Look up sig using the first key of each block. Only possible if
+        the container is sorted.
+        """
+
+        if not self.sorted:
+            raise ValueError, "lookup needs a sorted container"
+
+        key = encode_signature(sig)
+
+        # The last block whose first record is <= key. No encoding is a
+        # prefix of another, so a record starting with key (followed by
+        # the order of its automorphism group) is below key + '\xff'.
+        lo, hi = 0, self.nr_blocks
+        while lo < hi:
+            mid = (lo + hi)/2
+            if self.index[mid][2] <= key + '\xff': lo = mid + 1
+            else: hi = mid
+
+        if lo == 0: return False
+
+        payload = self.block_payload(lo - 1)
+        pos = 0
+        for _ in range(self.index[lo - 1][1]):
+            start = pos
+            _, pos = decode_signature(payload, pos)
+            if payload[start:pos] == key: return True
+            if self.aut_groups: _, pos = read_varint(payload, pos)
+
+        return False
+
+def text_to_container(text_filename, container_filename, block_size = 1024, compress = True, sort = True):
+    r"""
+    Convert a text file of signatures (one per line, as written by
+    disk_count_dissections and td) to a binary container. With
+    sort = True the signatures are sorted by their encoding and
+    duplicates are removed, which needs them all in memory. This gives
+    the same set of signatures as sort | uniq, but not in the same
+    order. container_to_text gives back the signatures but not the
+    exact text (see the notes on the layout above). If the lines start
+    with the order of the automorphism group (see
+    parse_aut_signature_line) then the container keeps it, with
+    aut_groups = True, and container_to_text writes it back.
+
+    EXAMPLES:
+        sage: from signature_container import *
+        sage: import os, tempfile
+        sage: text, binary, text2 = tempfile.mktemp(), tempfile.mktemp(), tempfile.mktemp()
+        sage: f = open(text, 'w')
+        sage: f.write('0 0 0 0 1/2 0 0 1/2 1 0 0 0\n0 0 0 0 1/4 0 0 1/4 1/2 0 0 0\n0 0 0 0 1/2 0 0 1/2 1 0 0 0\n')
+        sage: f.close()
+        sage: text_to_container(text, binary)
+        2
+        sage: container_to_text(binary, text2)
+        2
+        sage: print open(text2).read(),
+        0 0 0 0 1/2 0 0 1/2 1 0 0 0
+        0 0 0 0 1/4 0 0 1/4 1/2 0 0 0
+
+    With sort = False the order and duplicates are kept, and the text
+    comes back without td's trailing spaces:
+        sage: f = open(text, 'w')
+        sage: f.write('0 0 0 0 1/2 0 0 1/2 1 0 0 0 \n0 0 0 0 1/4 0 0 1/4 1/2 0 0 0 \n0 0 0 0 1/2 0 0 1/2 1 0 0 0 \n')
+        sage: f.close()
+        sage: text_to_container(text, binary, sort = False)
+        3
+        sage: container_to_text(binary, text2)
+        3
+        sage: open(text2).read() == open(text).read().replace(' \n', '\n')
+        True
+
+    Lines with the order of the automorphism group in front, as written
+    with aut_groups = True, come back with it:
+        sage: f = open(text, 'w')
+        sage: f.write('6 0 0 0 0 1/2 0 0 1/2 1 0 0 0\n2 0 0 0 0 1/4 0 0 1/4 1/2 0 0 0\n6 0 0 0 0 1/2 0 0 1/2 1 0 0 0\n')
+        sage: f.close()
+        sage: text_to_container(text, binary, sort = False)
+        3
+        sage: container_to_text(binary, text2)
+        3
+        sage: open(text2).read() == open(text).read()
+        True
+        sage: text_to_container(text, binary)
+        2
+        sage: r = SignatureReader(binary)
+        sage: r.aut_groups, [aut for (aut, sig) in r.records()]
+        (True, [6, 2])
+        sage: parse_signature_line('0 0 0 0 1/4 0 0 1/4 1/2 0 0 0') in r
+        True
+        sage: os.remove(text); os.remove(binary); os.remove(text2)
+    """
+
+    # The first line tells us whether the lines have the order of the
+    # automorphism group in front.
+    aut_groups = False
+    for line in open(text_filename):
+        if line.strip() == '': continue
+        aut_groups = parse_aut_signature_line(line)[0] is not None
+        break
+
+    w = SignatureWriter(open(container_filename, 'wb'), block_size = block_size, compress = compress, sorted = sort, aut_groups = aut_groups)
+
+    if sort:
+        auts = {}
+        for line in open(text_filename):
+            if line.strip() == '': continue
+            aut, sig = parse_aut_signature_line(line)
+            auts[encode_signature(sig)] = aut
+        for key in sorted(auts.keys()):
+            w.write(decode_signature(key)[0], auts[key])
+    else:
+        for line in open(text_filename):
+            if line.strip() == '': continue
+            w.write(line)
+
+    w.close()
+
+    return w.nr_records
+
+def container_to_text(container_filename, text_filename):
+    """
+    Write the signatures in a binary container to a text file, one per
+    line in the format of disk_count_dissections (without a trailing
+    space), with the order of the automorphism group in front if the
+    container has it. See text_to_container.
+    """
+
+    f = open(text_filename, 'w')
+
+    nr_records = 0
+    for (aut, sig) in SignatureReader(container_filename).records():
+        if aut is not None: f.write(str(aut) + ' ')
+        f.write(' '.join(map(str, sig)))
+        f.write('\n')
+        nr_records += 1
+
+    f.close()
+
+    return nr_records
+
+def usage():
+    print
+    print "Convert a file of signatures to a binary container (sorted by their"
+    print "encoding and without duplicates, compressed):"
+    print "$ python signature_container.py -fromtext signatures_12 signatures_12.bin"
+    print
+    print "The order of the automorphism group in front of each line (as written"
+    print "by td --aut-groups) is kept in the container."
+    print
+    print "Convert a binary container back to text:"
+    print "$ python signature_container.py -totext signatures_12.bin signatures_12"
+    print
+    sys.exit(0)
+
+if __name__ == "__main__":
+    if len(sys.argv) != 4: usage()
+
+    if sys.argv[1] == '-fromtext':
+        print text_to_container(sys.argv[2], sys.argv[3]), 'signatures'
+    elif sys.argv[1] == '-totext':
+        print container_to_text(sys.argv[2], sys.argv[3]), 'signatures'
+    else:
+        usage()
@@ -0,0 +1,283 @@
+'''
+Copyright 2010 Carlo Hamalainen <carlo.hamalainen@gmail.com>. All 
+rights reserved.
+
+Redistribution and use in source and binary forms, with or without 
+modification, are permitted provided that the following conditions
+are met:
+
+   1. Redistributions of source code must retain the above copyright 
+      notice, this list of conditions and the following disclaimer.
+
+   2. Redistributions in binary form must reproduce the above copyright 
+      notice, this list of conditions and the following disclaimer
+      in the documentation and/or other materials provided with the
+      distribution.
+
+THIS SOFTWARE IS PROVIDED BY Carlo Hamalainen ``AS IS'' AND ANY EXPRESS
+OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE
+ARE DISCLAIMED. IN NO EVENT SHALL Carlo Hamalainen OR CONTRIBUTORS
+BE LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY,
+OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT
+OF SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR
+BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY,
+WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE
+OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE,
+EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+The views and conclusions contained in the software and documentation 
+are those of the authors and should not be interpreted as representing
+official policies, either expressed or implied, of Carlo Hamalainen.
+'''
+
+from fractions import Fraction
+
+class SparseLU:
+    """
+    Exact sparse LU factorisation of a square system of linear equations.
+
+    Each equation is a dictionary mapping a variable (an integer in
+    range(nr_variables)) to its nonzero coefficient. Pivots are chosen
+    with the Markowitz criterion, i.e. we minimise (r - 1)*(c - 1) where r
+    is the number of nonzeros in the pivot row and c is the number of
+    nonzeros in the pivot column. The equations of Eq(T, a) have at most
+    three nonzeros each so this keeps the fill-in very small.
+
+    Once factored, the system can be solved for any number of right hand
+    sides.
+
+    EXAMPLES:
+        sage: from sparse_solver import *
+        sage: lu = SparseLU([{0: 1, 1: 1}, {1: 1, 2: -1}, {2: 1}], 3)
+        sage: lu.solve([2, 0, 1])
+        [Fraction(1, 1), Fraction(1, 1), Fraction(1, 1)]
+
+    A singular system is rejected:
+        sage: SparseLU([{0: 1, 1: 1}, {0: 2, 1: 2}], 2)
+        Traceback (most recent call last):
+        ...
+        ValueError: singular system
+    """
+
+    def __init__(self, equations, nr_variables):
+        if len(equations) != nr_variables:
+            raise ValueError, "expected a square system"
+
+        self.nr_variables = nr_variables
+
+        rows = [dict((v, Fraction(a)) for (v, a) in eq.iteritems() if a != 0) for eq in equations]
+
+        # For each variable, the set of active rows that it appears in.
+        cols = [set() for _ in range(nr_variables)]
+        for i in range(len(rows)):
+            for v in rows[i]:
+                cols[v].add(i)
+
+        active = set(range(len(rows)))
+
+        # Each pivot is (row, variable); each elimination step is
+        # (target row, pivot row, multiplier).
+        self.pivots = []
+        self.operations = []
+
+        while len(active) > 0:
+            best = None
+            best_cost = None
+
+            for i in sorted(active, key = lambda i: (len(rows[i]), i)):
+                if len(rows[i]) == 0: raise ValueError, "singular system"
+
+                # The Markowitz cost can't beat a row with fewer entries.
+                if best_cost is not None and best_cost == 0: break
+
+                for v in sorted(rows[i]):
+                    cost = (len(rows[i]) - 1)*(len(cols[v]) - 1)
+                    if best_cost is None or cost < best_cost:
+                        best = (i, v)
+                        best_cost = cost
+
+            i, v = best
+            pivot_row = rows[i]
+            pivot = pivot_row[v]
+
+            active.remove(i)
+            for w in pivot_row: cols[w].discard(i)
+
+            for k in sorted(cols[v]):
+                m = rows[k][v]/pivot
+                self.operations.append((k, i, m))
+
+                target = rows[k]
+                for (w, a) in pivot_row.iteritems():
+                    x = target.get(w, 0) - m*a
+
+                    if x == 0:
+                        if w in target:
+                            del target[w]
+                            cols[w].discard(k)
+                    else:
+                        if w not in target: cols[w].add(k)
+                        target[w] = x
+
+            self.pivots.append((i, v))
+
+        self.rows = rows
+
+    def solve(self, rhs):
+        """
+        Solve the factored system for the right hand side rhs. The
+        solution is returned as a list of Fractions.
+
+        EXAMPLES:
+            sage: from sparse_solver import *
+            sage: lu = SparseLU([{0: 1, 1: 1}, {0: 1, 1: -1}], 2)
+            sage: lu.solve([1, 0])
+            [Fraction(1, 2), Fraction(1, 2)]
+            sage: lu.solve([0, 2])
+            [Fraction(1, 1), Fraction(-1, 1)]
+        """
+
+        b = [Fraction(x) for x in rhs]
+
+        for (k, i, m) in self.operations:
+            if b[i] != 0: b[k] -= m*b[i]
+
+        x = [None]*self.nr_variables
+
+        for (i, v) in reversed(self.pivots):
+            total = b[i]
+            for (w, a) in self.rows[i].iteritems():
+                if w != v: total -= a*x[w]
+            x[v] = total/self.rows[i][v]
+
+        return x
+
+def dissection_equations(triples, row_max, col_max, sym_max, id_triple):
+    """
+    Set up the equations of Eq(T, a) for the sparse solver. Here
+    triples is the list of (r, c, s) entries of T and id_triple is the
+    identity triple a = (a1, a2, a3). Variables are ordered as rows,
+    columns and then symbols, exactly as in trade_dissection_matrix().
+
+    EXAMPLES:
+        sage: from sparse_solver import *
+        sage: T = [(0, 0, 0), (0, 1, 1), (1, 0, 1), (1, 1, 0)]
+        sage: dissection_equations(T, 2, 2, 2, (0, 0, 0))
+        ([{0: 1}, {2: 1}, {4: 1}, {0: 1, 3: 1, 5: -1}, {1: 1, 2: 1, 5: -1}, {1: 1, 3: 1, 4: -1}], [0, 0, 1, 0, 0, 0])
+    """
+
+    equations = []
+    rhs = []
+
+    id_row, id_col, id_sym = id_triple
+
+    for (r, c, s) in triples:
+        if (r, c, s) == (id_row, id_col, id_sym):
+            # The equations id_row = id_col = 0, id_sym = 1.
+            equations.append({id_row: 1})
+            rhs.append(0)
+
+            equations.append({id_col + row_max: 1})
+            rhs.append(0)
+
+            equations.append({id_sym + row_max + col_max: 1})
+            rhs.append(1)
+
+            continue
+
+        equations.append({r: 1, c + row_max: 1, s + row_max + col_max: -1})
+        rhs.append(0)
+
+    return equations, rhs
+
+def sparse_solve_dissection(triples, row_max, col_max, sym_max, id_triple):
+    """
+    Solve Eq(T, a) with the sparse exact solver. The result is a
+    list of Fractions in the same order as the last column of the echelon
+    form of trade_dissection_matrix().
+
+    EXAMPLES:
+        sage: from sparse_solver import *
+        sage: T = [(0, 0, 0), (0, 1, 1), (1, 1, 0), (1, 0, 2), (2, 0, 1), (2, 1, 2)]
+        sage: sparse_solve_dissection(T, 3, 2, 3, (0, 0, 0))
+        [Fraction(0, 1), Fraction(2, 3), Fraction(1, 3), Fraction(0, 1), Fraction(1, 3), Fraction(1, 1), Fraction(1, 3), Fraction(2, 3)]
+    """
+
+    equations, rhs = dissection_equations(triples, row_max, col_max, sym_max, id_triple)
+
+    return SparseLU(equations, row_max + col_max + sym_max).solve(rhs)
+
+class BitradeSolver:
+    """
+    Solve Eq(T, a) for every identity triple a of one bitrade using a
+    single factorisation.
+
+    Let A be the matrix of all the equations r + c = s for (r, c, s) in
+    T. The solutions of A x = 0 include the trivial family g(t, u) with
+    every row equal to t, every column equal to u and every symbol equal
+    to t + u. For a spherical bitrade A has rank |T| so this family is
+    the whole kernel, and the system K consisting of A together with the
+    gauge equations r_0 = 0, c_0 = 0 is nonsingular. We factor K once.
+
+    Dropping the equation for a from A and adding the three equations
+    a1 = 0, a2 = 0, a3 = 1 is a rank three update of K, and its solution
+    is given directly in terms of y = K^(-1) e_a:
+
+        x = g(y[a1], y[a2]) - y
+
+    so each identity triple costs one pair of triangular solves instead
+    of a full elimination. If K happens to be singular we fall back to
+    solving each Eq(T, a) from scratch.
+
+    EXAMPLES:
+        sage: from sparse_solver import *
+        sage: T = [(0, 0, 0), (0, 1, 1), (1, 1, 0), (1, 0, 2), (2, 0, 1), (2, 1, 2)]
+        sage: b = BitradeSolver(T, 3, 2, 3)
+        sage: b.solve((0, 0, 0))
+        [Fraction(0, 1), Fraction(2, 3), Fraction(1, 3), Fraction(0, 1), Fraction(1, 3), Fraction(1, 1), Fraction(1, 3), Fraction(2, 3)]
+        sage: for a in T: assert b.solve(a) == sparse_solve_dissection(T, 3, 2, 3, a)
+    """
+
+    def __init__(self, triples, row_max, col_max, sym_max):
+        self.triples = list(triples)
+        self.row_max = row_max
+        self.col_max = col_max
+        self.sym_max = sym_max
+
+        # Equation number for each triple of T.
+        self.equation_of = dict((t, i) for (i, t) in enumerate(self.triples))
+
+        equations = [{r: 1, c + row_max: 1, s + row_max + col_max: -1} for (r, c, s) in self.triples]
+        equations.append({0: 1})
+        equations.append({row_max: 1})
+
+        try:
+            self.lu = SparseLU(equations, row_max + col_max + sym_max)
+        except ValueError:
+            self.lu = None
+
+    def solve(self, id_triple):
+        """
+        The solution to Eq(T, a) for a = id_triple, as a list of
+        Fractions ordered by rows, columns and then symbols.
+        """
+
+        if self.lu is None:
+            return sparse_solve_dissection(self.triples, self.row_max, self.col_max, self.sym_max, id_triple)
+
+        id_row, id_col, _ = id_triple
+
+        rhs = [0]*(len(self.triples) + 2)
+        rhs[self.equation_of[tuple(id_triple)]] = 1
+
+        y = self.lu.solve(rhs)
+
+        t = y[id_row]
+        u = y[id_col + self.row_max]
+
+        x = [t - z for z in y[:self.row_max]]
+        x += [u - z for z in y[self.row_max:self.row_max + self.col_max]]
+        x += [t + u - z for z in y[self.row_max + self.col_max:]]
+
+        return x
@@ -31,13 +31,27 @@ are those of the authors and should not be interpreted as representing
 official policies, either expressed or implied, of Carlo Hamalainen.
 '''
 
+import mmap
 import os
+import stat
+import struct
 import sys
-import sage.all
+import tempfile
+import zlib
+
+from array import array
 
 from itertools import *
-from sage.combinat.matrices.latin import *
-from sage.misc.misc import tmp_filename
+
+# Without Sage we use the plain Python latin squares in latin.py (see
+# triangle_dissections.py).
+try:
+    import sage.all
+    from sage.combinat.matrices.latin import *
+except ImportError:
+    from latin import *
+
+from bbitrade import Bitrade, BitradeSquare, latin_squares_to_bitrade, unique_bitrades
 
 b_for_testing = r"""4 2 4
 8
@@ -70,13 +84,14 @@ def dump_to_tmpfile(s):
         sage: os.remove(file_loc)
     """
 
-    file_loc = tmp_filename()
+    (fd, file_loc) = tempfile.mkstemp()
+    os.close(fd)
     f = open(file_loc,"w")
     f.write(s)
     f.close()
     return file_loc
 
-def read_spherical_bitrade(f):
+def read_spherical_bitrade(f, bitrades = False):
     """
     Read a spherical bitrade from the stream f, assuming input is
     given by the spherical_bitrades program (uses plantri).
@@ -101,17 +116,32 @@ def read_spherical_bitrade(f):
     size of trade is 4
     {triples for T2}
 
+    With bitrades = True we return a Bitrade instead of the pair of
+    LatinSquares (T1, T2).
+
     EXAMPLE:
         sage: from spherical import *
         sage: filename = dump_to_tmpfile(b_for_testing)
         sage: f = open(filename, "r")
         sage: T1, T2 = read_spherical_bitrade(f)
+        sage: f.seek(0)
+        sage: B = read_spherical_bitrade(f, bitrades = True)
         sage: f.close()
         sage: os.remove(filename)
+        sage: B.T1.to_latin_square() == T1 and B.T2.to_latin_square() == T2
+        True
     """
 
     n = max(map(int, f.readline().split()))
 
+    if bitrades:
+        T = []
+        for _ in range(2):
+            nr_entries = int(f.readline().split()[0])
+            T.append([int(x) for _ in range(nr_entries) for x in f.readline().split()])
+
+        return Bitrade(T[0], T[1])
+
     T1 = LatinSquare(n, n)
     T2 = LatinSquare(n, n)
 
@@ -162,8 +192,7 @@ def process_spherical_file(file_name):
 
         assert is_bitrade(T1, T2)
 
-        #g = genus(T1, T2)
-        #assert g == _sage_const_0
+        assert latin_squares_to_bitrade(T1, T2).genus() == 0
 
         bitrades.append((T1, T2))
 
@@ -209,10 +238,12 @@ def some_spherical_bitrades():
 
     return b
 
-def spherical_iterator(min_size = 4, max_size = None):
+def spherical_iterator(min_size = 4, max_size = None, bitrades = False):
     """
     An iterator to spherical bitrades. We expect files of the form
-    spherical_bitrades_n where the bitrade has size n.
+    spherical_bitrades_n where the bitrade has size n. Each bitrade
+    (T1, T2) in the files is followed by (T2, T1). With bitrades = True
+    we yield Bitrade objects instead of pairs of LatinSquares.
    
     EXAMPLE:
         sage: from spherical import *
@@ -256,7 +287,9 @@ def spherical_iterator(min_size = 4, max_size = None):
         [ 3  4 -1 -1 -1]
         [ 4  1 -1 -1 -1])
 
-
+        sage: g = spherical_iterator(min_size = 10, bitrades = True)
+        sage: g.next()
+        Bitrade of size 10 on 5 rows, 2 columns and 5 symbols
     """
 
 
@@ -277,7 +310,7 @@ def spherical_iterator(min_size = 4, max_size = None):
                 return
 
         try:
-            (T1, T2) = read_spherical_bitrade(f)
+            x = read_spherical_bitrade(f, bitrades)
         except ValueError:
             # We hit the end of file so move on to the next file.
             # Note that there is no bitrade of size 5.
@@ -289,11 +322,456 @@ def spherical_iterator(min_size = 4, max_size = None):
             f = None
             continue
 
-        yield (T1, T2)
-        yield (T2, T1)
+        if bitrades:
+            yield x
+            yield x.swap()
+        else:
+            (T1, T2) = x
+            yield (T1, T2)
+            yield (T2, T1)
 
     if f is not None: f.close()
 
+def binary_bitrades(f, latin_squares = False, bitrades = False):
+    """
+    Iterate over the bitrades in the packed binary format written by
+    spherical_trades_binary (this is what td reads). Each bitrade is
+    the bytes nr_rows, nr_cols, nr_syms, nr_elements followed by
+    nr_elements triples (r, c, s) for T1 and then nr_elements
+    triples for T2, one byte per entry.
+
+    Here f is a file name or an open file, which is read from its
+    current position. A regular file is mapped with mmap and each
+    bitrade is read from the mapping by offset, copying its triples
+    once into the arrays that we yield; anything else (for example
+    sys.stdin when reading from a pipe) is read sequentially. A file
+    that we open ourselves is closed when we are done, and an open file
+    is left positioned after the last bitrade. We yield (nr_rows,
+    nr_cols, nr_syms, T1, T2) where T1 and T2 are byte arrays of length
+    3*nr_elements holding the triples r0, c0, s0, r1, c1, s1, ...
+
+    With latin_squares = True we yield (T1, T2) as LatinSquare objects
+    instead, as read_spherical_bitrade does, and with bitrades = True
+    we yield Bitrade objects.
+
+    EXAMPLE:
+        sage: from spherical import *
+        sage: filename = dump_to_tmpfile(str(bytearray([2, 2, 2, 4, 0, 0, 0, 0, 1, 1, 1, 1, 0, 1, 0, 1, 0, 0, 1, 0, 1, 0, 1, 0, 0, 1, 1, 1])))
+        sage: list(binary_bitrades(filename))
+        [(2, 2, 2, array('B', [0, 0, 0, 0, 1, 1, 1, 1, 0, 1, 0, 1]), array('B', [0, 0, 1, 0, 1, 0, 1, 0, 0, 1, 1, 1]))]
+        sage: T1, T2 = list(binary_bitrades(open(filename, 'rb'), latin_squares = True))[0]
+        sage: T1
+        [0 1]
+        [1 0]
+        sage: is_bitrade(T1, T2)
+        True
+        sage: list(binary_bitrades(filename, bitrades = True))
+        [Bitrade of size 4 on 2 rows, 2 columns and 2 symbols]
+
+        sage: os.remove(filename)
+
+    An open file is read from where it is:
+        sage: filename = dump_to_tmpfile(2*str(bytearray([2, 2, 2, 4, 0, 0, 0, 0, 1, 1, 1, 1, 0, 1, 0, 1, 0, 0, 1, 0, 1, 0, 1, 0, 0, 1, 1, 1])))
+        sage: f = open(filename, 'rb')
+        sage: f.seek(28)
+        sage: len(list(binary_bitrades(f)))
+        1
+        sage: f.tell()
+        56
+        sage: f.close()
+        sage: os.remove(filename)
+    """
+
+    if isinstance(f, str):
+        f = open(f, 'rb')
+        opened = True
+    else:
+        opened = False
+
+    data = None
+
+    try:
+        st = os.fstat(f.fileno())
+
+        if stat.S_ISREG(st.st_mode):
+            pos = f.tell()
+
+            if st.st_size == 0: data = ''
+            else: data = mmap.mmap(f.fileno(), st.st_size, access = mmap.ACCESS_READ)
+        # Otherwise, e.g. for a pipe, we read sequentially.
+
+        while True:
+            if data is None:
+                header = f.read(4)
+                if len(header) == 0: break
+                assert len(header) == 4
+
+                nr_rows, nr_cols, nr_syms, nr_elements = map(ord, header)
+
+                triples = f.read(6*nr_elements)
+                start = 0
+            else:
+                if pos >= len(data): break
+                assert pos + 4 <= len(data)
+
+                nr_rows, nr_cols, nr_syms, nr_elements = struct.unpack_from('4B', data, pos)
+
+                triples = data
+                start = pos + 4
+                pos = start + 6*nr_elements
+
+            assert len(triples) >= start + 6*nr_elements
+
+            T1 = array('B')
+            T1.fromstring(buffer(triples, start, 3*nr_elements))
+            T2 = array('B')
+            T2.fromstring(buffer(triples, start + 3*nr_elements, 3*nr_elements))
+
+            if bitrades:
+                yield Bitrade(T1, T2)
+            elif latin_squares:
+                n = max(nr_rows, nr_cols, nr_syms)
+                yield (triples_to_latin_square(n, T1), triples_to_latin_square(n, T2))
+            else:
+                yield (nr_rows, nr_cols, nr_syms, T1, T2)
+
+        if data is not None: f.seek(pos)
+    finally:
+        if data is not None and data != '': data.close()
+        if opened: f.close()
+
+def triples_to_latin_square(n, T):
+    """
+    The n by n partial latin square with the triples in the flat array
+    T = [r0, c0, s0, r1, c1, s1, ...] and all other cells empty.
+
+    EXAMPLE:
+        sage: from spherical import *
+        sage: triples_to_latin_square(3, [0, 0, 2, 1, 2, 0])
+        [ 2 -1 -1]
+        [-1 -1  0]
+        [-1 -1 -1]
+    """
+
+    L = LatinSquare(n, n)
+
+    for r in range(n):
+        for c in range(n):
+            L[r, c] = -1
+
+    for i in range(0, len(T), 3):
+        L[T[i], T[i+1]] = T[i+2]
+
+    return L
+
+# The sidecar index of a corpus file F is the file F.idx: INDEX_MAGIC, a
+# flag byte (1 for the binary format), the size and modification time of F,
+# the CRC-32 of its first and last INDEX_CHECK_BLOCK bytes and the number of
+# bitrades as INDEX_HEADER, and then for each bitrade its byte offset in F
+# and (nr_rows, nr_cols, nr_syms, nr_elements) as INDEX_RECORD.
+
+INDEX_MAGIC  = 'TDIDX\x02'
+INDEX_HEADER = struct.Struct('<BQdIQ')
+INDEX_RECORD = struct.Struct('<QHHHH')
+
+INDEX_CHECK_BLOCK = 4096
+
+def _next_line(data, pos):
+    eol = data.find('\n', pos)
+    if eol < 0: return len(data)
+    return eol + 1
+
+def scan_bitrade_offsets(data, binary):
+    """
+    Scan the contents of a corpus file (a str or mmap), in the text
+    format of read_spherical_bitrade or the binary format of
+    binary_bitrades, and yield (offset, nr_rows, nr_cols, nr_syms,
+    nr_elements) for each bitrade.
+
+    EXAMPLE:
+        sage: from spherical import *
+        sage: list(scan_bitrade_offsets(b_for_testing + b_for_testing, binary = False))
+        [(0, 4, 2, 4, 8), (106, 4, 2, 4, 8)]
+    """
+
+    pos = 0
+
+    while pos < len(data):
+        if binary:
+            nr_rows, nr_cols, nr_syms, nr_elements = map(ord, data[pos:pos + 4])
+            yield (pos, nr_rows, nr_cols, nr_syms, nr_elements)
+            pos += 4 + 6*nr_elements
+            continue
+
+        start = pos
+        header = data[pos:_next_line(data, pos)].split()
+        pos = _next_line(data, pos)
+
+        if len(header) == 0: continue # trailing blank line
+
+        nr_rows, nr_cols, nr_syms = map(int, header)
+
+        for _ in range(2):
+            nr_elements = int(data[pos:_next_line(data, pos)])
+            pos = _next_line(data, pos)
+            for _ in range(nr_elements): pos = _next_line(data, pos)
+
+        yield (start, nr_rows, nr_cols, nr_syms, nr_elements)
+
+class BitradeCorpus:
+    """
+    Random access to the bitrades in a corpus file, either in the text
+    format (spherical_bitrades/spherical_bitrades_n) or in the binary
+    format of spherical_trades_binary. The file is mapped with mmap and
+    the byte offset of each bitrade is kept in the sidecar file
+    filename + '.idx', which is built on first use. It is rebuilt if the
+    size or modification time of the corpus, or the checksum of its
+    first and last blocks, no longer match.
+
+    EXAMPLE:
+        sage: from spherical import *
+        sage: filename = dump_to_tmpfile(open("spherical_bitrades/spherical_bitrades_10").read())
+        sage: c = BitradeCorpus(filename)
+        sage: len(c)
+        8
+        sage: c.header(3)
+        (3, 4, 5, 10)
+        sage: T1, T2 = c[3]
+        sage: is_bitrade(T1, T2)
+        True
+
+    The same bitrade, as triples and as a Bitrade:
+        sage: nr_rows, nr_cols, nr_syms, T1, T2 = c.triples(3)
+        sage: T1[:6]
+        array('B', [0, 0, 0, 0, 1, 1])
+        sage: c.bitrade(3).T2.to_latin_square() == c[3][1]
+        True
+
+    Every bitrade in the corpus is spherical:
+        sage: c.nonspherical()
+        []
+
+    Some of the inputs (T1, T2) and (T2, T1) are isomorphic to earlier
+    ones (see Bitrade.canonical_form):
+        sage: sorted(c.duplicates())
+        [(0, True), (1, True), (2, True), (3, True), (4, True), (5, True), (7, True)]
+
+    Slices and shards are contiguous ranges of bitrades:
+        sage: len(c[2:5])
+        3
+        sage: [c.shard_range(i, 3) for i in range(3)]
+        [(0, 3), (3, 6), (6, 8)]
+        sage: len(list(c.iterate(*c.shard_range(2, 3))))
+        2
+
+    The index was saved, so next time it is just loaded:
+        sage: os.path.exists(filename + '.idx')
+        True
+        sage: BitradeCorpus(filename).index == c.index
+        True
+        sage: os.remove(filename); os.remove(filename + '.idx')
+
+    A corpus rewritten with the same size gets a new index:
+        sage: T1 = [0, 0, 0, 0, 1, 1, 1, 0, 1, 1, 1, 0]
+        sage: T2 = [0, 0, 1, 0, 1, 0, 1, 0, 0, 1, 1, 1]
+        sage: filename = dump_to_tmpfile(str(bytearray([2, 2, 2, 4] + T1 + T2)))
+        sage: BitradeCorpus(filename).triples(0)[3]
+        array('B', [0, 0, 0, 0, 1, 1, 1, 0, 1, 1, 1, 0])
+        sage: open(filename, 'wb').write(str(bytearray([2, 2, 2, 4] + T2 + T1)))
+        sage: BitradeCorpus(filename).triples(0)[3]
+        array('B', [0, 0, 1, 0, 1, 0, 1, 0, 0, 1, 1, 1])
+        sage: os.remove(filename); os.remove(filename + '.idx')
+    """
+
+    def __init__(self, filename, binary = None):
+        self.filename = filename
+
+        f = open(filename, 'rb')
+        st = os.fstat(f.fileno())
+        size = st.st_size
+        if size > 0: self.data = mmap.mmap(f.fileno(), size, access = mmap.ACCESS_READ)
+        else: self.data = ''
+        f.close()
+
+        self.mtime = st.st_mtime
+
+        # The text format always starts with a digit.
+        if binary is None: binary = size > 0 and not self.data[0].isdigit()
+        self.binary = binary
+
+        self.index = self.load_index()
+        if self.index is None: self.index = self.build_index()
+
+    def index_filename(self):
+        return self.filename + '.idx'
+
+    def checksum(self):
+        """
+        The CRC-32 of the first and last INDEX_CHECK_BLOCK bytes of the
+        corpus, which the index records to notice a corpus that has been
+        rewritten with the same size.
+        """
+
+        crc = zlib.crc32(self.data[:INDEX_CHECK_BLOCK])
+        crc = zlib.crc32(self.data[-INDEX_CHECK_BLOCK:], crc)
+
+        return crc & 0xffffffff
+
+    def load_index(self):
+        try:
+            f = open(self.index_filename(), 'rb')
+        except IOError:
+            return None
+
+        buf = f.read()
+        f.close()
+
+        if not buf.startswith(INDEX_MAGIC): return None
+
+        pos = len(INDEX_MAGIC)
+        if len(buf) < pos + INDEX_HEADER.size: return None
+
+        binary, size, mtime, crc, nr_bitrades = INDEX_HEADER.unpack(buf[pos:pos + INDEX_HEADER.size])
+        pos += INDEX_HEADER.size
+
+        if bool(binary) != self.binary or size != len(self.data): return None
+        if mtime != self.mtime or crc != self.checksum(): return None
+        if len(buf) != pos + nr_bitrades*INDEX_RECORD.size: return None
+
+        return [INDEX_RECORD.unpack(buf[i:i + INDEX_RECORD.size]) for i in range(pos, len(buf), INDEX_RECORD.size)]
+
+    def build_index(self):
+        index = list(scan_bitrade_offsets(self.data, self.binary))
+
+        buf = [INDEX_MAGIC, INDEX_HEADER.pack(int(self.binary), len(self.data), self.mtime, self.checksum(), len(index))]
+        buf += [INDEX_RECORD.pack(*x) for x in index]
+
+        # Keep going without the sidecar if we can't write it.
+        try:
+            f = open(self.index_filename(), 'wb')
+            f.write(''.join(buf))
+            f.close()
+        except IOError:
+            pass
+
+        return index
+
+    def __len__(self):
+        return len(self.index)
+
+    def header(self, k):
+        """
+        (nr_rows, nr_cols, nr_syms, nr_elements) for the k-th bitrade,
+        straight from the index.
+        """
+
+        return self.index[k][1:]
+
+    def triples(self, k):
+        """
+        The k-th bitrade as (nr_rows, nr_cols, nr_syms, T1, T2) where
+        T1 and T2 are flat byte arrays of triples, as in binary_bitrades.
+        """
+
+        offset, nr_rows, nr_cols, nr_syms, nr_elements = self.index[k]
+
+        if self.binary:
+            start = offset + 4
+            T1 = array('B', self.data[start:start + 3*nr_elements])
+            T2 = array('B', self.data[start + 3*nr_elements:start + 6*nr_elements])
+        else:
+            if k + 1 < len(self.index): end = self.index[k + 1][0]
+            else: end = len(self.data)
+
+            x = map(int, self.data[offset:end].split())
+            assert len(x) == 5 + 6*nr_elements
+
+            T1 = array('B', x[4:4 + 3*nr_elements])
+            T2 = array('B', x[5 + 3*nr_elements:])
+
+        return (nr_rows, nr_cols, nr_syms, T1, T2)
+
+    def bitrade(self, k):
+        """
+        The k-th bitrade as a Bitrade.
+        """
+
+        nr_rows, nr_cols, nr_syms, T1, T2 = self.triples(k)
+
+        return Bitrade(T1, T2)
+
+    def nonspherical(self, start = 0, stop = None):
+        """
+        The k in start, start + 1, ..., stop - 1 for which the k-th
+        bitrade does not have genus 0.
+        """
+
+        if stop is None: stop = len(self)
+
+        return [k for k in range(start, stop) if self.bitrade(k).genus() != 0]
+
+    def duplicates(self):
+        """
+        The set of (k, swapped) such that the k-th bitrade (T1, T2), or
+        (T2, T1) if swapped, has the same canonical form as an input
+        before it, in the order of spherical_iterator.
+        """
+
+        seen = set()
+        duplicates = set()
+
+        for k in range(len(self)):
+            B = self.bitrade(k)
+
+            for (swapped, X) in [(False, B), (True, B.swap())]:
+                form = X.canonical_form()
+
+                if form is None: continue
+                if form in seen: duplicates.add((k, swapped))
+                else: seen.add(form)
+
+        return duplicates
+
+    def __getitem__(self, k):
+        """
+        The k-th bitrade as a pair of LatinSquares (see
+        read_spherical_bitrade), or a list of them for a slice.
+        """
+
+        if isinstance(k, slice):
+            return list(self.iterate(*k.indices(len(self))[:2]))
+
+        nr_rows, nr_cols, nr_syms, T1, T2 = self.triples(k)
+        n = max(nr_rows, nr_cols, nr_syms)
+
+        return (triples_to_latin_square(n, T1), triples_to_latin_square(n, T2))
+
+    def iterate(self, start = 0, stop = None, latin_squares = True, bitrades = False):
+        """
+        Iterate over the bitrades start, start + 1, ..., stop - 1, as
+        Bitrades if bitrades = True and otherwise as pairs of
+        LatinSquares or (with latin_squares = False) triples.
+        """
+
+        if stop is None: stop = len(self)
+
+        for k in range(start, stop):
+            if bitrades: yield self.bitrade(k)
+            elif latin_squares: yield self[k]
+            else: yield self.triples(k)
+
+    def shard_range(self, i, nr_shards):
+        """
+        The range (start, stop) of the i-th of nr_shards contiguous
+        shards of roughly equal size.
+        """
+
+        assert 0 <= i < nr_shards
+
+        shard_size = (len(self) + nr_shards - 1)/nr_shards
+
+        return (min(i*shard_size, len(self)), min((i + 1)*shard_size, len(self)))
+
 
 if __name__ == "__main__":
     b = some_spherical_bitrades()
@@ -32,23 +32,35 @@ official policies, either expressed or implied, of Carlo Hamalainen.
 '''
 
 import copy
-
-import sage.all
+import heapq
 
 import sys
 
-try: import pyx
-except ImportError: pass # ugh
-
-from sage.combinat.matrices.latin import *
-from sage.misc.search import search
-from sage.rings.rational_field import QQ
-from sage.rings.arith import lcm
+# We use Sage's latin squares and rationals if we have them, and
+# otherwise the plain Python latin squares in latin.py with Fractions for
+# coordinates. The results (dissections, signatures) are the same either
+# way. pyx and sympy are only needed for drawing and for the symbolic
+# reflections, and are imported where they are used.
+try:
+    import sage.all
+    from sage.combinat.matrices.latin import *
+    from sage.rings.rational_field import QQ
+    from sage.rings.arith import lcm
+    from sage.modules.free_module_element import vector
+except ImportError:
+    from latin import *
+    QQ = None
 import math
 
-from spherical import *
+from array import array
+from fractions import Fraction
 
-import sympy
+from spherical import *
+from bbitrade import Bitrade, BitradeSquare, latin_squares_to_bitrade, CONJUGATES
+from sparse_solver import sparse_solve_dissection, BitradeSolver
+from half_edge_mesh import DIRECTIONS, direction, HalfEdgeMesh
+from exact_cover import ExactCover
+from modular_solver import modular_solve_dissection
 
 def centroid_of_triangle(pt1, pt2, pt3):
     """
@@ -127,6 +139,8 @@ def reflect1(x, y):
         (3/4, 0)
     """
 
+    import sympy
+
     # Shift everything left by 1/2
     x -= sympy.Rational(1, 2)
 
@@ -170,12 +184,14 @@ def reflect3(x, y):
     x, y = reflect1(x, y)
     return rotate_equilateral_inverse(x, y)
 
-def rotate_equilateral(x, y, theta = 2*sympy.pi/3):
+def rotate_equilateral(x, y, theta = None):
     """
-    Perform a rotation on (x, y) anticlockwise by angle theta.
+    Perform a rotation on (x, y) anticlockwise by angle theta (by
+    default 2*pi/3).
 
     EXAMPLES:
         sage: from triangle_dissections import *
+        sage: import sympy
         sage: rotate_equilateral(0, 0)
         (1, 0)
         sage: rotate_equilateral(1, 0)
@@ -201,6 +217,10 @@ def rotate_equilateral(x, y, theta = 2*sympy.pi/3):
         (1, 0)
     """
 
+    import sympy
+
+    if theta is None: theta = 2*sympy.pi/3
+
     # Centre of the equilateral triangle:
     pt_x = sympy.Rational(1,2)
     pt_y = sympy.sqrt(3)/6
@@ -224,8 +244,186 @@ def rotate_equilateral_inverse(x, y):
         sage: rotate_equilateral_inverse(0, 0)
         (1/2, 1/2*sqrt(3))
     """
+    import sympy
+
     return rotate_equilateral(x, y, theta = -2*sympy.pi/3)
 
+# The six symmetries of the outer triangle with corners (0, 0), (0, N),
+# (N, 0), acting on integer lattice coordinates (x, y). In barycentric
+# coordinates (N - x - y, x, y) each one is a permutation of the
+# coordinates: the identity, reflect1, reflect2, reflect3, the rotation and
+# its inverse.
+LATTICE_SYMMETRIES = [lambda x, y, N: (x, y),
+                      lambda x, y, N: (N - x - y, y),
+                      lambda x, y, N: (y, x),
+                      lambda x, y, N: (x, N - x - y),
+                      lambda x, y, N: (N - x - y, x),
+                      lambda x, y, N: (y, N - x - y),]
+
+def lattice_triangle_to_12list(t, N, fn):
+    """
+    The image of the triangle t (with integer coordinates in the
+    triangle of side N) under the symmetry fn, as a 12-tuple. Each vertex
+    (x, y) is written in the equilateral triangle as
+    (x + y/2, sqrt(3)*y/2), which we store as the 4-tuple
+    (x + y/2, 0, 0, y/2). All entries are scaled by 2N so that they
+    are integers.
+
+    EXAMPLES:
+        sage: from triangle_dissections import *
+        sage: lattice_triangle_to_12list(((0, 0), (0, 1), (1, 0)), 1, LATTICE_SYMMETRIES[0])
+        (0, 0, 0, 0, 1, 0, 0, 1, 2, 0, 0, 0)
+        sage: lattice_triangle_to_12list(((0, 0), (0, 1), (1, 0)), 1, LATTICE_SYMMETRIES[1])
+        (0, 0, 0, 0, 1, 0, 0, 1, 2, 0, 0, 0)
+    """
+
+    vertices = []
+
+    for (x, y) in t:
+        x, y = fn(x, y, N)
+        vertices.append((2*x + y, 0, 0, y))
+
+    vertices.sort()
+
+    return vertices[0] + vertices[1] + vertices[2]
+
+def lattice_image_sweep(vertices, incident, triangle_vertices, N, fn):
+    """
+    Generate the image under the symmetry fn of the triangles with the
+    given vertices, as 12-tuples (see lattice_triangle_to_12list) in
+    increasing order. The triangle j has the vertices with indices
+    triangle_vertices[3*j : 3*j + 3] and incident[v] lists the
+    triangles with the vertex v.
+
+    The 12-tuples are ordered by their least vertex first, so we map
+    each vertex once and then pop the vertices off a heap in the order
+    of their images. When a vertex comes off the heap we make the
+    12-tuples of the triangles whose least vertex it is. Nothing is
+    built for the triangles after the ones that the caller asks for.
+
+    EXAMPLES:
+        sage: from triangle_dissections import *
+        sage: vertices = [(0, 0), (0, 1), (1, 0)]
+        sage: list(lattice_image_sweep(vertices, [[0], [0], [0]], [0, 1, 2], 1, LATTICE_SYMMETRIES[2]))
+        [(0, 0, 0, 0, 1, 0, 0, 1, 2, 0, 0, 0)]
+    """
+
+    images = []
+    for (x, y) in vertices:
+        x, y = fn(x, y, N)
+        images.append((2*x + y, 0, 0, y))
+
+    heap = [(images[v], v) for v in range(len(vertices))]
+    heapq.heapify(heap)
+
+    while len(heap) > 0:
+        least_vertex, v = heapq.heappop(heap)
+
+        group = []
+        for j in incident[v]:
+            t = sorted([images[u] for u in triangle_vertices[3*j:3*j + 3]])
+            if t[0] == least_vertex: group.append(t[0] + t[1] + t[2])
+
+        group.sort()
+        for t in group: yield t
+
+def lattice_least_image(triangles, N):
+    """
+    Find the lexicographically least image of the triangles under
+    LATTICE_SYMMETRIES, as a flat list of the sorted 12-tuples. We also
+    return the number of images equal to the least one, which is the
+    order of the automorphism group of the dissection.
+
+    Each image is generated lazily, in increasing order, by
+    lattice_image_sweep. We take the triangles of the images in step
+    and drop an image as soon as its triangle is larger than the best
+    one at that position, so an image that is dropped early only pays
+    for mapping the vertices and for the triangles before it was
+    dropped. If several images survive to the end then they are
+    identical.
+
+    EXAMPLES:
+        sage: from triangle_dissections import *
+        sage: u = [((0, 0), (0, 1), (1, 0)), ((0, 1), (0, 2), (1, 1)), ((0, 1), (1, 0), (1, 1)), ((1, 0), (1, 1), (2, 0))]
+        sage: least, nr_least = lattice_least_image(u, 2)
+        sage: least[:12]
+        [0, 0, 0, 0, 1, 0, 0, 1, 2, 0, 0, 0]
+
+    This dissection is symmetric so all six images are the same:
+        sage: nr_least
+        6
+
+    The least image is the sorted list of the 12-tuples of the image
+    under one of the symmetries:
+        sage: v = [((0, 0), (0, 1), (1, 0)), ((0, 1), (0, 3), (2, 1)), ((1, 0), (1, 1), (3, 0)), ((0, 1), (1, 0), (1, 1)), ((1, 1), (1, 2), (2, 1)), ((1, 1), (2, 0), (2, 1)), ((0, 3), (2, 1), (3, 0))]
+        sage: images = [sorted([lattice_triangle_to_12list(t, 3, fn) for t in v]) for fn in LATTICE_SYMMETRIES]
+        sage: least, nr_least = lattice_least_image(v, 3)
+        sage: least == [x for t in min(images) for x in t], nr_least == images.count(min(images))
+        (True, True)
+    """
+
+    # The distinct vertices, the triangles at each vertex, and the
+    # vertices of each triangle.
+    vertex_index = {}
+    vertices = []
+    incident = []
+    triangle_vertices = []
+
+    for (j, t) in enumerate(triangles):
+        for p in t:
+            v = vertex_index.get(p)
+            if v is None:
+                v = vertex_index[p] = len(vertices)
+                vertices.append(p)
+                incident.append([])
+
+            incident[v].append(j)
+            triangle_vertices.append(v)
+
+    images = [lattice_image_sweep(vertices, incident, triangle_vertices, N, fn) for fn in LATTICE_SYMMETRIES]
+
+    least = []
+
+    for _ in range(len(triangles)):
+        heads = [image.next() for image in images]
+        best = min(heads)
+
+        if len(images) > 1:
+            images = [image for (image, head) in zip(images, heads) if head == best]
+
+        least.extend(best)
+
+    return least, len(images)
+
+def conjugate_point(p, pt, unit = 1):
+    """
+    The image of the point pt of a dissection under the symmetry of the
+    triangle that goes with the conjugation p of the bitrade (see
+    Bitrade.conjugate).
+
+    A point (x, y) lies on the row line y, the column line x and the
+    symbol line x + y, and (y, x, unit - x - y) are its distances from
+    the bottom, left and diagonal sides of the outer triangle, which are
+    the lines of the identity triple. Conjugating the bitrade permutes
+    the roles of rows, columns and symbols, and the solution of the
+    conjugate system is these distances permuted in the same way. So the
+    dissection of the conjugate bitrade is the image of the dissection
+    under this map, which is one of LATTICE_SYMMETRIES.
+
+    EXAMPLES:
+        sage: from triangle_dissections import *
+        sage: conjugate_point((1, 0, 2), (1, 3), 4)
+        (3, 1)
+        sage: conjugate_point((0, 2, 1), (1, 3), 4)
+        (0, 3)
+        sage: sorted([conjugate_point(p, (1, 3), 4) for p in CONJUGATES]) == sorted([fn(1, 3, 4) for fn in LATTICE_SYMMETRIES])
+        True
+    """
+
+    (x, y) = pt
+    f = (y, x, unit - x - y)
+
+    return (f[p[1]], f[p[0]])
 
 def cross(*args): 
     """
@@ -423,61 +621,91 @@ def disjoint_mate_dlxcpp_rows_and_map(P, allow_subtrade):
     # We will have missed some columns. My old C++ code would cover the
     # empty columns before finding a solution, but now it doesn't. So we
     # have to add 'dummy' rows to fill things out.
-    used_columns = flatten(dlx_rows)
+    used_columns = set(flatten(dlx_rows))
     for i in range(0, max_column_nr+1):
         if not i in used_columns:
             dlx_rows.append([i])
 
     return dlx_rows, cmap
 
+def latin_mates(P, nr_to_find = None, allow_subtrade = False):
+    """
+    Generate the disjoint mates of P (or, if allow_subtrade is True,
+    mates that may share entries with P), at most nr_to_find of them
+    if nr_to_find is not None. Each mate is an array of the entries
+    r, c, e in turn.
+
+    EXAMPLES:
+        sage: from triangle_dissections import *
+        sage: B = back_circulant(4)
+        sage: len(list(latin_mates(B, allow_subtrade = True)))
+        576
+        sage: Q = latin_mates(B, allow_subtrade = True).next()
+        sage: len(Q)
+        48
+    """
+
+    dlx_rows, cmap = disjoint_mate_dlxcpp_rows_and_map(P, allow_subtrade)
+
+    # The dummy rows of dlx_rows only cover columns that no other row
+    # covers, which ExactCover does not require.
+    dlx_rows = [row for row in dlx_rows if len(row) > 1]
+
+    for x in ExactCover(dlx_rows).solutions(nr_to_find):
+        Q = array('i')
+
+        for y in x:
+            Q.extend(cmap[tuple(dlx_rows[y])])
+
+        yield Q
+
+def count_latin_mates(P, nr_to_find = None, allow_subtrade = False):
+    """
+    The number of mates that latin_mates(P, nr_to_find, allow_subtrade)
+    would generate.
+
+    EXAMPLES:
+        sage: from triangle_dissections import *
+        sage: B = back_circulant(4)
+        sage: count_latin_mates(B, allow_subtrade = True)
+        576
+        sage: count_latin_mates(B, nr_to_find = 10, allow_subtrade = True)
+        10
+    """
+
+    dlx_rows, cmap = disjoint_mate_dlxcpp_rows_and_map(P, allow_subtrade)
+    dlx_rows = [row for row in dlx_rows if len(row) > 1]
+
+    return ExactCover(dlx_rows).count(nr_to_find)
+
 def dlxcpp_find_mates(P, nr_to_find = None, allow_subtrade = False):
     """
+    The mates of P from latin_mates(), as latin squares.
+
     WARNING: if allow_subtrade is True then we may return a partial
     latin square that is *not* disjoint to P. In that case, use
     bitrade(P, Q) to get an actual bitrade.
 
     EXAMPLES:
         sage: from sage.combinat.matrices.latin import *
+        sage: from triangle_dissections import *
         sage: B = back_circulant(4)
         sage: g = dlxcpp_find_mates(B, allow_subtrade = True)
         sage: B1 = g.next()
         sage: B0, B1 = bitrade(B, B1)
         sage: assert is_bitrade(B0, B1)
-        sage: print B0, "\n,\n", B1
-        [-1  1  2 -1]
-        [-1  2 -1  0]
-        [-1 -1 -1 -1]
-        [-1  0  1  2] 
-        ,
-        [-1  2  1 -1]
-        [-1  0 -1  2]
-        [-1 -1 -1 -1]
-        [-1  1  2  0]
     """
 
     assert P.nrows() == P.ncols()
 
-    n = P.nrows()
-
-    dlx_rows, cmap = disjoint_mate_dlxcpp_rows_and_map(P, allow_subtrade)
-
-    nr_found = 0
-
-    for x in DLXCPP(dlx_rows):
-        nr_found += 1
+    for x in latin_mates(P, nr_to_find, allow_subtrade):
+        Q = LatinSquare(P.nrows())
 
-        Q = copy.deepcopy(P)
-
-        for y in x:
-            if len(dlx_rows[y]) == 1: continue # dummy row
-            (r, c, e) = cmap[tuple(dlx_rows[y])]
-            Q[r, c] = e
+        for i in range(0, len(x), 3):
+            Q[x[i], x[i+1]] = x[i+2]
 
         yield Q
 
-        if nr_to_find is not None and nr_found >= nr_to_find: return
-
-
 def line_type(pt1, pt2):
     """
     A line passing through points pt1 and pt2 is either horizontal,
@@ -541,8 +769,9 @@ def colinear(u, v, w):
     # Horizontal line:
     if v[1] - u[1] == 0 and w[1] - v[1] == 0: return True
 
-    # 0 < slope < infty
-    return (v[1] - u[1])/(v[0] - u[0]) == (w[1] - v[1])/(w[0] - v[0])
+    # 0 < slope < infty; compare the slopes without dividing so that this
+    # also works for integer coordinates.
+    return (v[1] - u[1])*(w[0] - v[0]) == (w[1] - v[1])*(v[0] - u[0])
 
 def colinear_and_ordered(u, v, w):
     """
@@ -623,8 +852,16 @@ def triangle_size(pt1, pt2, pt3):
 
     return triangle_size(pt2, pt3, pt1)
 
+# The attributes made by TriangleDissection.build_geometry(), which in
+# compact mode is only called when one of them is needed.
+GEOMETRY_ATTRIBUTES = ['triangles', 'triangle_sizes', 'original_solution_r',
+    'original_solution_c', 'original_solution_s', 'reduced_solution_r',
+    'reduced_solution_c', 'reduced_solution_s', 'T2_degenerate_entries',
+    'corners', 'points', 'six_way_points', 'adjacency_points',
+    'adjacency_index', 'adjacency', 'mesh']
+
 class TriangleDissection:
-    def __init__(self, T1, T2, id_row = None, id_col = None, only_separated_solutions = False):
+    def __init__(self, T1, T2 = None, id_row = None, id_col = None, only_separated_solutions = False, solver = 'sparse', compact = False, solution = None):
         """
         EXAMPLES:
 
@@ -728,6 +965,46 @@ class TriangleDissection:
             sage: assert d.original_solution_c[d.a2] == 0
             sage: assert d.original_solution_s[d.a3] == 1
 
+        The system Eq(T, a) is solved with the sparse exact solver by
+        default; solver = 'echelon' uses the echelon form of the dense
+        matrix from trade_dissection_matrix() instead, and solver = 'crt'
+        the multi-modular solver (see find_solution()):
+            sage: e = TriangleDissection(T1, T2, id_row = 0, id_col = 0, only_separated_solutions = False, solver = 'echelon')
+            sage: assert e.triangles == d.triangles
+            sage: e = TriangleDissection(T1, T2, id_row = 0, id_col = 0, only_separated_solutions = False, solver = 'crt')
+            sage: assert e.triangles == d.triangles
+
+        With compact = True everything is scaled by n once, so the
+        vertices have integer coordinates on the triangular lattice and
+        the outer triangle has corners (0, 0), (0, n), (n, 0). At first
+        only the arrays of build_compact_arrays() are made, which is all
+        that the counting code needs:
+            sage: c = TriangleDissection(T1, T2, id_row = 0, id_col = 0, only_separated_solutions = False, compact = True)
+            sage: c.n, c.unit
+            (4, 4)
+            sage: c.__dict__.has_key('triangles'), c.__dict__.has_key('mesh')
+            (False, False)
+            sage: c.vertex_x
+            array('i', [0, 0, 0, 0, 1, 1, 1, 2, 2, 2, 4])
+            sage: c.vertex_y
+            array('i', [0, 1, 2, 4, 0, 1, 2, 0, 1, 2, 0])
+            sage: c.triangle_vertices[:3]
+            array('i', [0, 1, 4])
+            sage: assert c.canonical_signature() == d.canonical_signature()
+
+        The rest of the geometry is built, on the integer coordinates, the
+        first time it is used, so the geometric methods work as usual:
+            sage: sorted(c.triangles.keys())[:3]
+            [((0, 0), (0, 1), (1, 0)), ((0, 1), (0, 2), (1, 1)), ((0, 1), (1, 0), (1, 1))]
+            sage: sorted(c.points[(2, 2)])
+            [((0, 2), (0, 4), (2, 2)), ((1, 2), (2, 1), (2, 2)), ((2, 0), (2, 2), (4, 0))]
+            sage: sorted(c.triangle_sizes.keys()) == sorted(d.triangle_sizes.keys())
+            True
+            sage: c.is_perfect_dissection() == d.is_perfect_dissection()
+            True
+            sage: len(c.core().triangles) == len(d.core().triangles)
+            True
+
         If the solution to Eq(T, a) is not separated (fixme) then we can get
         the reduced bitrade via the geometric data (the actual dissection):
 
@@ -756,10 +1033,32 @@ class TriangleDissection:
             sage: u.T2_degenerate_entries
             {(0, 1, 2): True, (2, 2, 2): True, (2, 1, 1): True}
             sage: for (r, c, s) in u.T2_degenerate_entries.keys(): assert u.T2[r, c] == s
+
+        If we already have the solution of Eq(T, a) from find_solution()
+        we can pass it in and it is not solved again:
+            sage: solution = find_solution(U1, 0, 0, only_separated_solutions = False)
+            sage: TriangleDissection(U1, U2, solution = solution).triangles == TriangleDissection(U1, U2, 0, 0).triangles
+            True
+
+        Instead of T1 and T2 we can give a Bitrade (see bbitrade.py):
+            sage: B = latin_squares_to_bitrade(T1, T2)
+            sage: b = TriangleDissection(B, id_row = 0, id_col = 0, only_separated_solutions = False)
+            sage: b.triangles == d.triangles
+            True
+            sage: b.T2
+            [ 1  2  0 -1 -1]
+            [ 0 -1  4  3 -1]
+            [ 3  1  2  4 -1]
+            [-1 -1 -1 -1 -1]
+            [-1 -1 -1 -1 -1]
         """
 
-        self.row_max, self.col_max, self.sym_max, id_row, \
-        id_col, self.M = find_solution(T1, id_row, id_col, only_separated_solutions)
+        if isinstance(T1, Bitrade): T1, T2 = T1.T1, T1.T2
+
+        if solution is None:
+            solution = find_solution(T1, id_row, id_col, only_separated_solutions, solver)
+
+        self.row_max, self.col_max, self.sym_max, id_row, id_col, self.M = solution
 
         self.T1 = T1
         self.T2 = T2
@@ -769,7 +1068,38 @@ class TriangleDissection:
         self.a3 = T1[id_row, id_col]
 
         # we have an embedding into a triangle of side n.
-        self.n = int(lcm([self.M[i].denom() for i in range(len(self.M))]))
+        self.n = int(lcm([denominator(self.M[i]) for i in range(len(self.M))]))
+
+        # In compact mode the geometry is scaled by n so that every vertex
+        # has integer coordinates. The outer triangle has side self.unit.
+        self.compact = compact
+        if compact: self.unit = self.n
+        else: self.unit = 1
+
+        # In compact mode we only build the arrays that canonical_signature()
+        # needs; the rest of the geometry is built from the solution the
+        # first time it is used (see __getattr__).
+        if compact: self.build_compact_arrays()
+        else: self.build_geometry()
+
+    def __getattr__(self, name):
+        """
+        In compact mode, build the geometry (on integer coordinates) when
+        one of GEOMETRY_ATTRIBUTES is first used.
+        """
+
+        if name in GEOMETRY_ATTRIBUTES and self.__dict__.get('compact') and not self.__dict__.has_key('triangles'):
+            self.build_geometry()
+            return getattr(self, name)
+
+        raise AttributeError, name
+
+    def build_geometry(self):
+        """
+        Build the triangles of the dissection and the dictionaries and
+        adjacency structures that the geometric methods use. In compact
+        mode the coordinates are the integers n*x, n*y.
+        """
 
         self.triangles = {}
         self.triangle_sizes = {}
@@ -791,42 +1121,41 @@ class TriangleDissection:
 
         self.T2_degenerate_entries = {}
 
-        for r in range(self.row_max):
-            for c in range(self.col_max):
-                s = T2[r, c]
-                if s < 0: continue
+        for (r, c, s) in trade_triples(self.T2):
+            w1 = self.M[r]
+            w2 = self.M[c + self.row_max]
+            w3 = self.M[s + self.row_max + self.col_max]
 
-                w1 = self.M[r]
-                w2 = self.M[c + self.row_max]
-                w3 = self.M[s + self.row_max + self.col_max]
+            self.original_solution_r[r] = w1
+            self.original_solution_c[c] = w2
+            self.original_solution_s[s] = w3
 
-                self.original_solution_r[r] = w1
-                self.original_solution_c[c] = w2
-                self.original_solution_s[s] = w3
+            if self.compact:
+                w1, w2, w3 = int(self.n*w1), int(self.n*w2), int(self.n*w3)
 
-                # The triangle corresponding to (r,c,s) in T2 has
-                # vertices pt1, pt2, pt3:
-                pt1 = (w2, w1)
-                pt2 = (w2, w3 - w2)
-                pt3 = (w3 - w1, w1)
+            # The triangle corresponding to (r,c,s) in T2 has
+            # vertices pt1, pt2, pt3:
+            pt1 = (w2, w1)
+            pt2 = (w2, w3 - w2)
+            pt3 = (w3 - w1, w1)
 
-                if triangle_size(pt1, pt2, pt3) > 0:
-                    self.reduced_solution_r.append(w1)
-                    self.reduced_solution_c.append(w2)
-                    self.reduced_solution_s.append(w3)
+            if triangle_size(pt1, pt2, pt3) > 0:
+                self.reduced_solution_r.append(w1)
+                self.reduced_solution_c.append(w2)
+                self.reduced_solution_s.append(w3)
 
-                    assert not self.triangles.has_key(tuple(sorted([pt1, pt2, pt3])))
+                assert not self.triangles.has_key(tuple(sorted([pt1, pt2, pt3])))
 
-                    self.triangles[tuple(sorted([pt1, pt2, pt3]))] = True
+                self.triangles[tuple(sorted([pt1, pt2, pt3]))] = True
 
-                    self.triangles[tuple(sorted([pt1, pt2, pt3]))] = True
-                    self.triangle_sizes[self.n*triangle_size(pt1, pt2, pt3)] = True
-                else:
-                    self.T2_degenerate_entries[(r, c, s)] = True
+                self.triangles[tuple(sorted([pt1, pt2, pt3]))] = True
+                self.triangle_sizes[(self.n/self.unit)*triangle_size(pt1, pt2, pt3)] = True
+            else:
+                self.T2_degenerate_entries[(r, c, s)] = True
 
         assert not self.triangle_sizes.has_key(0)
 
-        self.corners = [(0,0), (0,1), (1,0)]
+        self.corners = [(0,0), (0,self.unit), (self.unit,0)]
 
         self.points = {}
         for t in self.triangles.keys():
@@ -844,6 +1173,58 @@ class TriangleDissection:
             if len(self.points[p]) == 6:
                 self.six_way_points[p] = True
 
+        self.build_adjacency()
+        self.mesh = HalfEdgeMesh(sorted(self.triangles.keys()))
+
+    def build_compact_arrays(self):
+        """
+        Compact mode: store the non-degenerate triangles of the dissection
+        as integer lattice coordinates in arrays. Vertex i is
+        (vertex_x[i], vertex_y[i]) and triangle j has the vertices with
+        indices triangle_vertices[3*j : 3*j + 3]. This is all that
+        canonical_signature() and nr_triangles() need, so the counting
+        code never builds the dictionaries, the adjacency or the mesh.
+        """
+
+        triangles = []
+
+        for (r, c, s) in trade_triples(self.T2):
+            w1 = int(self.n*self.M[r])
+            w2 = int(self.n*self.M[c + self.row_max])
+            w3 = int(self.n*self.M[s + self.row_max + self.col_max])
+
+            pt1 = (w2, w1)
+            pt2 = (w2, w3 - w2)
+            pt3 = (w3 - w1, w1)
+
+            if triangle_size(pt1, pt2, pt3) > 0:
+                triangles.append(tuple(sorted([pt1, pt2, pt3])))
+
+        triangles.sort()
+        vertices = sorted(set([p for t in triangles for p in t]))
+        vertex_index = dict((p, i) for (i, p) in enumerate(vertices))
+
+        self.vertex_x = array('i', [p[0] for p in vertices])
+        self.vertex_y = array('i', [p[1] for p in vertices])
+        self.triangle_vertices = array('i', [vertex_index[p] for t in triangles for p in t])
+
+    def nr_triangles(self):
+        """
+        The number of triangles in the dissection, in either mode.
+
+        EXAMPLES:
+            sage: from triangle_dissections import *
+            sage: T1 = LatinSquare(matrix(ZZ, [[0, 1, 2, -1, -1], [3, -1, 0, 4, -1], [1, 2, 4, 3, -1], [-1, -1, -1, -1, -1], [-1, -1, -1, -1, -1]]))
+            sage: T2 = LatinSquare(matrix(ZZ, [[1, 2, 0, -1, -1], [0, -1, 4, 3, -1], [3, 1, 2, 4, -1], [-1, -1, -1, -1, -1], [-1, -1, -1, -1, -1]]))
+            sage: TriangleDissection(T1, T2, 0, 0).nr_triangles()
+            10
+            sage: TriangleDissection(T1, T2, 0, 0, compact = True).nr_triangles()
+            10
+        """
+
+        if self.compact: return len(self.triangle_vertices)/3
+        else: return len(self.triangles)
+
     def lines_of_trade(self):
         """
         Return a 3-tuple consisting of dictionaries mapping a line to an
@@ -924,24 +1305,8 @@ class TriangleDissection:
             (0, 1/2)
         """
 
-        # distances are within a unit triangle so this is guaranteed
-        # to be larger than any inter-vertex distance.
-        min_distance = 10
-        min_q = None
-
-        for (pt1, pt2, pt3) in self.points[pt]:
-            for q in [pt1, pt2, pt3]:
-                if q == pt: continue
-
-                if q[0] != pt[0]: continue
-
-                if q[1] >= pt[1]: continue
-
-                if distance(pt, q) < min_distance:
-                    min_distance = distance(pt, q)
-                    min_q = q
-
-        return min_q
+        # The only neighbours directly below pt are in direction (0, -1).
+        return self.neighbour(pt, 4)
 
     def walk_down_right(self, pt):
         """
@@ -957,24 +1322,9 @@ class TriangleDissection:
             (1/2, 1/2)
         """
 
-        # distances are within a unit triangle so this is guaranteed
-        # to be larger than any inter-vertex distance.
-        min_distance = 10
-        min_q = None
-
-        for (pt1, pt2, pt3) in self.points[pt]:
-            for q in [pt1, pt2, pt3]:
-                if q == pt: continue
-
-                if q[0] <= pt[0]: continue
-
-                if q[1] >= pt[1]: continue
-
-                if distance(pt, q) < min_distance:
-                    min_distance = distance(pt, q)
-                    min_q = q
-
-        return min_q
+        # The only neighbours below and to the right of pt are in
+        # direction (1, -1).
+        return self.neighbour(pt, 5)
 
     def relabel_triangle_column(self, pt1, pt2, pt3, new_label):
         """
@@ -1043,13 +1393,22 @@ class TriangleDissection:
             if self.triangles[(pt1, pt2, pt3)][i][1] == rcs:
                 return self.triangles[(pt1, pt2, pt3)][i][0]
 
-    def generate_bitrade_via_geometric_data(self):
+    def generate_bitrade_via_geometric_data(self, check_with_dlx = False):
         """
         Given just the geometric data of a triangle dissection (points,
         lines, triangles) form the bitrade (X1, X2) by labelling lines
         and separating any vertices of degree 6. The resulting bitrade
         is stored in self.X1, self.X2.
 
+        The triangles give the entries of X2. Each vertex other than the
+        three corners of the dissection is where a horizontal, vertical
+        and diagonal line meet, and gives an entry of X1 (a vertex of
+        degree 6 gives two entries, one for the lines above it and one
+        for the separated lines below it). The remaining entry of X1
+        comes from the three sides of the dissection. If check_with_dlx
+        is True then we also check that X1 is a disjoint mate of X2
+        found by dlxcpp_find_mates.
+
         EXAMPLES:
 
             sage: U1 = LatinSquare(matrix(ZZ, [(0, 1, 2), (1, -1, 0), (-1, 2, 1)]))
@@ -1123,36 +1482,45 @@ class TriangleDissection:
         self.original_max_triangle_sym_label = len(diagonal_lines)
 
         for six in six_points:
-            pt = six
+            # Every triangle with a vertical side below six gets a new
+            # column label. We follow the vertical line down, one
+            # segment of the mesh at a time, until the border or the
+            # next vertex of degree 6.
+            v = self.mesh.vertex_index[six]
             while True:
-                # For each triangle around this point:
-                for (pt1, pt2, pt3) in self.points[pt]:
-                    if has_side_below(pt1, pt2, pt3, six):
-                        lab = self.label_of_triangle(pt1, pt2, pt3, 'c')
+                w = self.mesh.step(v, 4)
+                if w < 0: break
+
+                for f in self.mesh.segment_faces(v, 4):
+                    (pt1, pt2, pt3) = self.mesh.faces[f]
+                    lab = self.label_of_triangle(pt1, pt2, pt3, 'c')
+
+                    if lab != self.max_triangle_col_label:
+                        self.separated_columns[lab] = self.max_triangle_col_label
 
-                        if lab != self.max_triangle_col_label:
-                            self.separated_columns[lab] = self.max_triangle_col_label
+                    self.relabel_triangle_column(pt1, pt2, pt3, self.max_triangle_col_label)
 
-                        self.relabel_triangle_column(pt1, pt2, pt3, self.max_triangle_col_label)
-                pt = self.walk_down(pt)
-                if pt is None: break
-                if self.six_way_points.has_key(pt): break
+                if self.six_way_points.has_key(self.mesh.vertices[w]): break
+                v = w
 
-            pt = six
+            # Likewise for the diagonal sides below and to the right of
+            # six, which get a new symbol label.
+            v = self.mesh.vertex_index[six]
             while True:
-                # For each triangle around this point:
-                for (pt1, pt2, pt3) in self.points[pt]:
-                    if has_side_below_right(pt1, pt2, pt3, six):
-                        lab = self.label_of_triangle(pt1, pt2, pt3, 's')
+                w = self.mesh.step(v, 5)
+                if w < 0: break
 
-                        if lab != self.max_triangle_sym_label:
-                            self.separated_symbols[lab] = self.max_triangle_sym_label
+                for f in self.mesh.segment_faces(v, 5):
+                    (pt1, pt2, pt3) = self.mesh.faces[f]
+                    lab = self.label_of_triangle(pt1, pt2, pt3, 's')
 
-                        self.relabel_triangle_symbol(pt1, pt2, pt3, self.max_triangle_sym_label)
+                    if lab != self.max_triangle_sym_label:
+                        self.separated_symbols[lab] = self.max_triangle_sym_label
 
-                pt = self.walk_down_right(pt)
-                if pt is None: break
-                if self.six_way_points.has_key(pt): break
+                    self.relabel_triangle_symbol(pt1, pt2, pt3, self.max_triangle_sym_label)
+
+                if self.six_way_points.has_key(self.mesh.vertices[w]): break
+                v = w
 
             self.max_triangle_col_label += 1
             self.max_triangle_sym_label += 1
@@ -1172,11 +1540,47 @@ class TriangleDissection:
             self.X2[r, c] = s
 
         assert self.X2.is_partial_latin_square()
-        g = dlxcpp_find_mates(self.X2, allow_subtrade = False)
-        self.X1 = g.next()
+
+        self.X1 = LatinSquare(self.X2.nrows())
+
+        # The row, column and symbol labels of each face of the mesh.
+        face_labels = [dict((w, x) for (x, w) in self.triangles[t]) for t in self.mesh.faces]
+
+        # The label of the line that leaves the vertex v in direction d.
+        def line_label(v, d):
+            return face_labels[self.mesh.segment_faces(v, d)[0]]["rcs"[d % 3]]
+
+        corners = [self.mesh.vertex_index[p] for p in [(0, 0), (0, self.unit), (self.unit, 0)]]
+        six_way = [self.mesh.vertex_index[p] for p in self.six_way_points.keys()]
+
+        for v in range(len(self.mesh.vertices)):
+            if v in corners: continue
+
+            labels = [None]*6
+            for d in range(6):
+                if self.mesh.step(v, d) >= 0: labels[d] = line_label(v, d)
+
+            if v in six_way:
+                r = labels[0]
+                self.X1[r, labels[1]] = labels[2]
+                self.X1[r, labels[4]] = labels[5]
+            else:
+                r = labels[0] if labels[0] is not None else labels[3]
+                c = labels[1] if labels[1] is not None else labels[4]
+                s = labels[2] if labels[2] is not None else labels[5]
+                self.X1[r, c] = s
+
+        (pt1, pt2, pt3) = self.points[(0, 0)][0]
+        r = self.label_of_triangle(pt1, pt2, pt3, "r")
+        c = self.label_of_triangle(pt1, pt2, pt3, "c")
+        (pt1, pt2, pt3) = self.points[(self.unit, 0)][0]
+        self.X1[r, c] = self.label_of_triangle(pt1, pt2, pt3, "s")
+
+        if check_with_dlx:
+            assert self.X1 in dlxcpp_find_mates(self.X2, allow_subtrade = False)
 
         assert is_bitrade(self.X1, self.X2)
-        assert genus(self.X1, self.X2) == 0
+        assert latin_squares_to_bitrade(self.X1, self.X2).genus() == 0
 
 
     def previous_vertex(self, v):
@@ -1195,23 +1599,13 @@ class TriangleDissection:
         """
 
         assert len(self.points[self.corners[v]]) == 1
-        vertices = list(self.points[self.corners[v]][0])
-        vertices.remove(self.corners[v])
-
-        # Perhaps this triangle is right next to the previous
-        # corner point:
-        if vertices[0] == self.corners[v-1]:
-            return self.corners[v-1]
-        if vertices[1] == self.corners[v-1]:
-            return self.corners[v-1]
-
-        # Otherwise we must find the vertices[i] that is colinear
-        # with the previous corner point.
-        for i in [0, 1]:
-            if colinear(self.corners[v-1], vertices[i], self.corners[v]):
-                return vertices[i]
-        
-        raise ValueError, "unable to find previous vertex"
+
+        # The corners of the dissection run clockwise, so the previous
+        # vertex follows self.corners[v] anticlockwise around its triangle.
+        f = self.mesh.face_index[self.points[self.corners[v]][0]]
+        corners = self.mesh.face_corners[f]
+
+        return corners[(corners.index(self.corners[v]) + 1) % 3]
 
     def next_vertex(self, v):
         """
@@ -1229,12 +1623,11 @@ class TriangleDissection:
         """
 
         assert len(self.points[self.corners[v]]) == 1
-        vertices = list(self.points[self.corners[v]][0])
-        vertices.remove(self.corners[v])
-        vertices.remove(self.previous_vertex(v))
-        assert len(vertices) == 1
 
-        return vertices[0]
+        f = self.mesh.face_index[self.points[self.corners[v]][0]]
+        corners = self.mesh.face_corners[f]
+
+        return corners[(corners.index(self.corners[v]) + 2) % 3]
 
     def adjacent_triangle(self, pt1, pt2, pt3, r, s):
         """
@@ -1269,80 +1662,102 @@ class TriangleDissection:
         assert r in [pt1, pt2, pt3]
         assert s in [pt1, pt2, pt3]
 
-        for (q1, q2, q3) in self.points[r]:
-            if (q1, q2, q3) == (pt1, pt2, pt3): continue
+        g = self.mesh.adjacent_face(self.mesh.face_index[(pt1, pt2, pt3)], r, s)
 
-            assert r in [q1, q2, q3]
-            if s not in [q1, q2, q3]: continue
+        if g is None:
+            raise ValueError, "no adjacent triangle with same size"
 
-            points = [q1, q2, q3]
-            points.remove(r)
-            points.remove(s)
+        (q1, q2, q3) = self.mesh.faces[g]
 
-            return q1, q2, q3, points[0]
+        points = [q1, q2, q3]
+        points.remove(r)
+        points.remove(s)
 
-        raise ValueError, "no adjacent triangle with same size"
+        return q1, q2, q3, points[0]
 
 
-    def neighbours(self, v):
+    def build_adjacency(self):
         """
-        Find the (unsorted) neighbours of the point v.
+        For each vertex v and each of the six DIRECTIONS d, find the
+        nearest vertex that is joined to v by an edge in direction d.
+        The vertices are self.adjacency_points (with indices
+        self.adjacency_index) and self.adjacency[6*i + d] is the index of
+        the neighbour of the i-th vertex in direction d, or -1 if there
+        is none.
 
         EXAMPLE:
-
             sage: from triangle_dissections import *
             sage: U1 = LatinSquare(matrix(ZZ, [(0, 1, 2), (1, -1, 0), (-1, 2, 1)]))
             sage: U2 = LatinSquare(matrix(ZZ, [(1, 2, 0), (0, -1, 1), (-1, 1, 2)]))
             sage: u = TriangleDissection(U1, U2, id_row = 0, id_col = 0, only_separated_solutions = False)
-            sage: u.neighbours(u.points.keys()[0])
-            [(0, 1/2), (1/2, 1/2)]
+            sage: u.adjacency_points
+            [(0, 0), (0, 1/2), (0, 1), (1/2, 0), (1/2, 1/2), (1, 0)]
+            sage: u.adjacency[6*1 : 6*2]
+            array('i', [4, 2, -1, -1, 0, 3])
         """
 
-        assert self.points.has_key(v)
+        self.adjacency_points = sorted(self.points.keys())
+        self.adjacency_index = dict((p, i) for (i, p) in enumerate(self.adjacency_points))
 
-        adjacent_points = []
+        self.adjacency = array('i', [-1]*(6*len(self.adjacency_points)))
+        nearest = [None]*len(self.adjacency)
 
-        for t in self.points[v]:
-            t = list(t)
-            t.remove(v)
+        for t in self.triangles.iterkeys():
+            for u in t:
+                for v in t:
+                    if u == v: continue
 
-            assert len(t) == 2
+                    d = direction(u, v)
+                    assert d is not None
 
-            if len(adjacent_points) == 0:
-                adjacent_points = t
-            else:
-                # Make sure that we don't add a colinear point
+                    i = 6*self.adjacency_index[u] + d
+                    length = abs(v[0] - u[0]) + abs(v[1] - u[1])
+
+                    if nearest[i] is None or length < nearest[i]:
+                        nearest[i] = length
+                        self.adjacency[i] = self.adjacency_index[v]
+
+    def neighbour(self, v, d):
+        """
+        The neighbour of the vertex v in direction d (an index into
+        DIRECTIONS), or None.
+
+        EXAMPLE:
+            sage: from triangle_dissections import *
+            sage: U1 = LatinSquare(matrix(ZZ, [(0, 1, 2), (1, -1, 0), (-1, 2, 1)]))
+            sage: U2 = LatinSquare(matrix(ZZ, [(1, 2, 0), (0, -1, 1), (-1, 1, 2)]))
+            sage: u = TriangleDissection(U1, U2, id_row = 0, id_col = 0, only_separated_solutions = False)
+            sage: u.neighbour((0, 1), 5), u.neighbour((0, 1), 0)
+            ((1/2, 1/2), None)
+        """
 
-                to_remove = []
+        # The adjacency is rebuilt after triangles have been removed.
+        if self.adjacency is None: self.build_adjacency()
 
-                # These two blocks of code are the same except
-                # for t[0] and t[1].
-                for u in adjacent_points:
-                    if t[0] == u: continue
+        j = self.adjacency[6*self.adjacency_index[v] + d]
 
-                    if colinear_and_ordered(v, t[0], u):
-                        to_remove.append(u)
-                    if colinear_and_ordered(v, u, t[0]):
-                        to_remove.append(t[0])
-                for u in adjacent_points:
-                    if t[1] == u: continue
+        if j < 0: return None
+        else: return self.adjacency_points[j]
 
-                    if colinear_and_ordered(v, t[1], u):
-                        to_remove.append(u)
-                    if colinear_and_ordered(v, u, t[1]):
-                        to_remove.append(t[1])
-                        #print v, t[1], "removing", t[0]
+    def neighbours(self, v):
+        """
+        Find the neighbours of the point v, in the order of DIRECTIONS.
 
-                adjacent_points += [t[0], t[1]]
+        EXAMPLE:
 
-                #print adjacent_points, to_remove
+            sage: from triangle_dissections import *
+            sage: U1 = LatinSquare(matrix(ZZ, [(0, 1, 2), (1, -1, 0), (-1, 2, 1)]))
+            sage: U2 = LatinSquare(matrix(ZZ, [(1, 2, 0), (0, -1, 1), (-1, 1, 2)]))
+            sage: u = TriangleDissection(U1, U2, id_row = 0, id_col = 0, only_separated_solutions = False)
+            sage: u.neighbours((0, 0))
+            [(1/2, 0), (0, 1/2)]
+        """
 
-                for x in to_remove:
-                    adjacent_points.remove(x)
+        assert self.points.has_key(v)
 
-        adjacent_points = uniq(adjacent_points)
+        adjacent_points = [self.neighbour(v, d) for d in range(6)]
 
-        return adjacent_points
+        return [q for q in adjacent_points if q is not None]
 
     def has_dividing_line(self):
         """
@@ -1353,8 +1768,7 @@ class TriangleDissection:
             sage: W1 = LatinSquare(matrix(ZZ, [(0, 1, 2, 3), (1, -1, -1, 0), (-1, 2, 3, 1), (-1, -1, -1, -1)]))
             sage: W2 = LatinSquare(matrix(ZZ, [(1, 2, 3, 0), (0, -1, -1, 1), (-1, 1, 2, 3), (-1, -1, -1, -1)]))
             sage: w = TriangleDissection(W1, W2, id_row = 2, id_col = 3, only_separated_solutions = False)
-            sage: w.core()
-            sage: w.has_dividing_line()
+            sage: w.core().has_dividing_line()
             True
         """
 
@@ -1364,37 +1778,15 @@ class TriangleDissection:
             pt1 = self.corners[z]
             pt2 = self.corners[(z+3) % 6]
 
-            line = [pt1]
-
-            current_point = pt1
-
-            # Try to build a line from pt1 to pt2 
-            while line[-1] != pt2:
-                made_extension = False
-
-                for new_pt in self.neighbours(line[-1]):
-                    assert new_pt != line[-1]
+            d = direction(pt1, pt2)
+            if d is None: continue
 
-                    # Reached the end?
-                    if new_pt == pt2 and colinear_and_ordered(pt1, line[-1], pt2):
-                        line.append(new_pt)
-                        break
+            # Try to follow the edges from pt1 to pt2
+            pt = pt1
+            while pt is not None and pt != pt2:
+                pt = self.neighbour(pt, d)
 
-                    # Don't go backwards
-                    if len(line) > 1 and line[-2] == new_pt: continue
-
-                    # This point has to be colinear with the endpoints
-                    if not colinear_and_ordered(pt1, new_pt, pt2): continue
-
-                    # So here we know that the new point is a new interior point,
-                    # is colinear, and in the right direction.
-                    made_extension = True
-                    line.append(new_pt)
-                    break
-
-                if not made_extension: break
-
-            if line[-1] == pt2: return True
+            if pt == pt2: return True
 
         return False
 
@@ -1413,7 +1805,11 @@ class TriangleDissection:
             2
         """
 
-        return len(self.neighbours(v))
+        if self.adjacency is None: self.build_adjacency()
+
+        i = 6*self.adjacency_index[v]
+
+        return 6 - list(self.adjacency[i:i+6]).count(-1)
 
     def can_remove_triangle(self, v):
         """
@@ -1477,9 +1873,18 @@ class TriangleDissection:
 
         del self.triangles[triangle_to_remove]
 
+        self.adjacency = None
+        self.mesh.remove_face(self.mesh.face_index[triangle_to_remove])
+
     def core(self):
         """
-        Try to remove all outer triangles of the dissection.
+        Remove all outer triangles of the dissection, repeatedly taking
+        away the triangle at the first corner (in the order of
+        self.corners) where it is the only triangle, as remove_triangle
+        does. If every triangle can be removed in this way then one
+        triangle is left. The dissection is not changed; instead we
+        return a copy of it with the triangles, points and corners of
+        the core.
 
         EXAMPLE:
             sage: from triangle_dissections import *
@@ -1488,22 +1893,109 @@ class TriangleDissection:
             sage: u = TriangleDissection(U1, U2, id_row = 0, id_col = 0, only_separated_solutions = False)
             sage: u.points
             {(0, 1): [((0, 1/2), (0, 1), (1/2, 1/2))], (0, 0): [((0, 0), (0, 1/2), (1/2, 0))], (1/2, 1/2): [((0, 1/2), (0, 1), (1/2, 1/2)), ((1/2, 0), (1/2, 1/2), (1, 0)), ((0, 1/2), (1/2, 0), (1/2, 1/2))], (1/2, 0): [((0, 0), (0, 1/2), (1/2, 0)), ((1/2, 0), (1/2, 1/2), (1, 0)), ((0, 1/2), (1/2, 0), (1/2, 1/2))], (0, 1/2): [((0, 0), (0, 1/2), (1/2, 0)), ((0, 1/2), (0, 1), (1/2, 1/2)), ((0, 1/2), (1/2, 0), (1/2, 1/2))], (1, 0): [((1/2, 0), (1/2, 1/2), (1, 0))]}
-            sage: u.core()
-            sage: u.points
-            {(1/2, 1/2): [((1/2, 0), (1/2, 1/2), (1, 0))], (1/2, 0): [((1/2, 0), (1/2, 1/2), (1, 0))], (1, 0): [((1/2, 0), (1/2, 1/2), (1, 0))]}
+            sage: c = u.core()
+            sage: sorted(c.points.items())
+            [((1/2, 0), [((1/2, 0), (1/2, 1/2), (1, 0))]), ((1/2, 1/2), [((1/2, 0), (1/2, 1/2), (1, 0))]), ((1, 0), [((1/2, 0), (1/2, 1/2), (1, 0))])]
+            sage: len(c.triangles), len(u.triangles)
+            (1, 4)
         """
 
-        while True:
-            if len(self.triangles) == 1: return
+        mesh = self.mesh
+
+        alive = bytearray(not mesh.is_removed(f) for f in range(len(mesh.faces)))
+        nr_alive = sum(alive)
+
+        nr_triangles = array('i', [0]*len(mesh.vertices))
+        for f in range(len(mesh.faces)):
+            if not alive[f]: continue
+            for v in mesh.corner_index[3*f:3*f + 3]: nr_triangles[v] += 1
+
+        # The corners run clockwise around the border of the remaining
+        # triangles. We keep them in a doubly linked list so that a
+        # corner can be replaced in constant time.
+        corners = [mesh.vertex_index[p] for p in self.corners]
+
+        next_corner = {}
+        previous_corner = {}
+        for i in range(len(corners)):
+            next_corner[corners[i]] = corners[(i+1) % len(corners)]
+            previous_corner[corners[(i+1) % len(corners)]] = corners[i]
+
+        # As in remove_triangle we always take the first corner of the
+        # list with one triangle. Removing the triangle at c only changes
+        # the corners next to c, and the corners before c had more than
+        # one triangle, so the next scan can start just before c (or at
+        # the first corner, if that is next to c).
+        head = corners[0]
+        start = head
+
+        while nr_alive > 1:
+            c = start
+            while nr_triangles[c] != 1 and next_corner[c] != head: c = next_corner[c]
+            if nr_triangles[c] != 1: break
+
+            f = [f for f in mesh.vertex_faces[c] if alive[f]][0]
+
+            # As in previous_vertex and next_vertex.
+            i = list(mesh.corner_index[3*f:3*f + 3]).index(c)
+            pv = mesh.corner_index[3*f + (i + 1) % 3]
+            nv = mesh.corner_index[3*f + (i + 2) % 3]
+
+            # Replace c by pv, nv on the border.
+            p = previous_corner.pop(c)
+            n = next_corner.pop(c)
+            before_c = p
+
+            if pv != p:
+                next_corner[p] = pv
+                previous_corner[pv] = p
+                p = pv
+            if nv != n:
+                previous_corner[n] = nv
+                next_corner[nv] = n
+                n = nv
+            next_corner[p] = n
+            previous_corner[n] = p
+
+            # remove_triangle puts pv where c was, so pv becomes the
+            # first corner if c was.
+            if c == head:
+                head = pv
+                start = pv
+            elif nv == head:
+                start = head
+            else:
+                start = before_c
 
-            i = 0
-            while i < len(self.corners):
-                if self.can_remove_triangle(i): break
-                i += 1
+            alive[f] = 0
+            nr_alive -= 1
+            for v in mesh.corner_index[3*f:3*f + 3]: nr_triangles[v] -= 1
 
-            if i == len(self.corners): return
+        core = copy.copy(self)
+
+        core.triangles = {}
+        core.points = {}
+        for f in range(len(mesh.faces)):
+            if not alive[f]: continue
+
+            t = mesh.faces[f]
+            core.triangles[t] = self.triangles[t]
+            for q in t:
+                try:
+                    core.points[q].append(t)
+                except KeyError:
+                    core.points[q] = [t]
 
-            self.remove_triangle(i)
+        v = head
+        core.corners = []
+        while len(core.corners) < len(next_corner):
+            core.corners.append(mesh.vertices[v])
+            v = next_corner[v]
+
+        core.adjacency = None
+        core.mesh = HalfEdgeMesh(sorted(core.triangles.keys()))
+
+        return core
 
     def write_PDF(self, filename, draw_border = False, draw_labels = False, mark_unit_length = False, mark_points = [], draw_sizes = False):
         """
@@ -1520,6 +2012,8 @@ class TriangleDissection:
             sage: os.remove(file2 + ".pdf")
         """
 
+        import pyx
+
         canv = pyx.canvas.canvas()
 
         if False:
@@ -1535,7 +2029,7 @@ class TriangleDissection:
                     self.corners[-i-1][1]), 
                     [pyx.color.rgb.black])
 
-        for t in self.triangles.keys():
+        for t in map(self._unit_triangle, self.triangles.keys()):
             canv.stroke(pyx.path.line(t[0][0], t[0][1], t[1][0], t[1][1]), 
                 [pyx.style.linewidth.THin])
             canv.stroke(pyx.path.line(t[1][0], t[1][1], t[2][0], t[2][1]), 
@@ -1548,6 +2042,12 @@ class TriangleDissection:
 
         horizontal_lines, vertical_lines, diagonal_lines = self.lines_of_trade()
 
+        if self.compact:
+            u = float(self.unit)
+            horizontal_lines = dict((k/u, v) for (k, v) in horizontal_lines.items())
+            vertical_lines = dict((k/u, v) for (k, v) in vertical_lines.items())
+            diagonal_lines = dict((k/u, v) for (k, v) in diagonal_lines.items())
+
         delta1 = 0.1
         delta2 = 0.2
 
@@ -1637,10 +2137,10 @@ class TriangleDissection:
         if draw_sizes:
             for t in self.triangles.iterkeys():
                 # fixme writing triangle size in interior.
-                cent = centroid_of_triangle(t[0], t[1], t[2])
+                cent = centroid_of_triangle(*self._unit_triangle(t))
                 x, y = to_equilateral.apply_pt(scale_factor*cent[0], scale_factor*cent[1])
 
-                tsize = self.n * horizontal_length(t[0], t[1], t[2])
+                tsize = (self.n/self.unit) * horizontal_length(t[0], t[1], t[2])
 
                 large_canvas.text(x, y, str(tsize), [pyx.text.vshift.middlezero, pyx.text.halign.center, pyx.text.size.tiny])
 
@@ -1648,7 +2148,18 @@ class TriangleDissection:
         large_canvas.writePDFfile(filename)
         #large_canvas.writeEPSfile(filename + r".eps")
 
-    def canonical_signature(self):
+    def _unit_triangle(self, t):
+        """
+        The triangle t with coordinates in the unit triangle, for
+        drawing. In compact mode we divide by self.unit.
+        """
+
+        if not self.compact: return t
+
+        u = float(self.unit)
+        return tuple([(x/u, y/u) for (x, y) in t])
+
+    def canonical_signature(self, aut_group_size = False):
         """
         To determine the canonical signature of a triangle dissection
         we take the set of points (as an equilateral triangle) and then find
@@ -1662,97 +2173,39 @@ class TriangleDissection:
             sage: T2 = LatinSquare(Matrix(ZZ, [(1, 2, 0, -1, -1, -1), (0, -1, 5, -1, 3, -1), (3, -1, -1, 1, -1, -1), (-1, 1, -1, 4, -1, -1), (-1, 4, 2, -1, 5, -1), (-1, -1, -1, 3, 4, -1)]))
             sage: assert is_bitrade(T1, T2)
             sage: t53 = TriangleDissection(T1, T2, 5, 3, only_separated_solutions = False)
-            sage: t53.canonical_signature()
-            ((0, 0),
-             (11/78, 11*3**(1/2)/78),
-             (19/78, 19*3**(1/2)/78),
-             (11/39, 0),
-             (9/26, 11*3**(1/2)/78),
-             (5/13, 7*3**(1/2)/39),
-             (31/78, 3*3**(1/2)/26),
-             (11/26, 7*3**(1/2)/78),
-             (11/26, 11*3**(1/2)/78),
-             (35/78, 3*3**(1/2)/26),
-             (35/78, 19*3**(1/2)/78),
-             (1/2, 3**(1/2)/2),
-             (20/39, 0),
-             (20/39, 7*3**(1/2)/39),
-             (47/78, 7*3**(1/2)/78),
-             (59/78, 19*3**(1/2)/78),
-             (1, 0))
+            sage: sig = t53.canonical_signature()
+
+        Each of the 15 triangles contributes three vertices (x, 0, 0, y)
+        where (x, y*sqrt(3)) is the vertex in the equilateral triangle:
+            sage: len(sig)
+            180
+            sage: ' '.join(map(str, sig[:24]))
+            '0 0 0 0 11/78 0 0 11/78 11/39 0 0 0 11/78 0 0 11/78 19/78 0 0 19/78 9/26 0 0 11/78'
+
+        The symmetries are applied as integer maps on the lattice
+        coordinates (see LATTICE_SYMMETRIES) so no symbolic arithmetic is
+        needed.
+
+        With aut_group_size = True we also return the order of the
+        automorphism group, which is the number of images equal to the
+        least one:
+            sage: sig2, aut = t53.canonical_signature(aut_group_size = True)
+            sage: sig2 == sig, aut
+            (True, 1)
         """
 
-        def has_sqrt3_term(x):
-            """
-            Does x contain a factor of sqrt(3)?
-            """
-
-            return '**' in str(x)
-            return not x.is_Rational and (x/sympy.sqrt(3)).is_Rational
-
-        def vertex_to_list(v):
-            assert len(v) == 2
-            x, y = v
-
-            if has_sqrt3_term(x):
-                x = [0, x/(sympy.sqrt(3))]
-            else:
-                x = [x, 0]
-
-            if has_sqrt3_term(y):
-                y = [0, y/(sympy.sqrt(3))]
-            else:
-                y = [y, 0]
-
-            return x + y
-
-        def image_to_sorted_lists(image):
-            new_image = []
+        # Integer coordinates in the triangle of side n.
+        if self.compact:
+            X, Y, V = self.vertex_x, self.vertex_y, self.triangle_vertices
+            triangles = [[(X[i], Y[i]) for i in V[j:j+3]] for j in range(0, len(V), 3)]
+        else:
+            triangles = [[(int(self.n*x), int(self.n*y)) for (x, y) in t] for t in self.triangles.iterkeys()]
 
-            for (pt1, pt2, pt3) in image:
-                this_triangle = [vertex_to_list(pt1), vertex_to_list(pt2), vertex_to_list(pt3),]
-                #print 'this_triangle:             ', this_triangle
-                this_triangle.sort()
-                #print 'this_triangle (after sort):', this_triangle
-                new_image.append(sum(this_triangle, []))
+        least, nr_least = lattice_least_image(triangles, self.n)
+        sig = tuple([Fraction(x, 2*self.n) for x in least])
 
-            new_image.sort()
-
-            return sum(new_image, [])
-
-        images = []
-
-        # Equilateral triangle:
-        # images.append([(y/2 + x, sympy.sqrt(3)*y/2) for (x, y) in [(sympy.Rational(str(x)), sympy.Rational(str(y))) for (x,y) in self.points.iterkeys()]])
-
-        images.append([])
-
-        for t in self.triangles.iterkeys():
-            new_triangle = []
-
-            for (x, y) in t: # 3 points
-                x = sympy.Rational(str(x))
-                y = sympy.Rational(str(y))
-                x, y = (y/2 + x, sympy.sqrt(3)*y/2)
-                new_triangle.append((x, y))
-
-            images[0].append(new_triangle)
-
-        assert len(images[0]) == len(self.triangles)
-
-        for fn in [reflect1, reflect2, reflect3, rotate_equilateral, rotate_equilateral_inverse]:
-            images.append([])
-
-            for t in images[0]:
-                images[-1].append([fn(x, y) for (x, y) in t])
-
-        assert len(images) == 6
-        for im in images: assert len(im) == len(images[0])
-
-        images = [image_to_sorted_lists(im) for im in images]
-        images.sort()
-
-        return tuple(images[0])
+        if aut_group_size: return sig, nr_least
+        else: return sig
 
 
     def is_perfect_dissection(self):
@@ -1799,7 +2252,7 @@ class TriangleDissection:
         triangle_sizes = {}
 
         for (pt1, pt2, pt3) in self.triangles.iterkeys():
-            this_size = self.n*horizontal_length(pt1, pt2, pt3)
+            this_size = (self.n/self.unit)*horizontal_length(pt1, pt2, pt3)
 
             if not up_triangle(pt1, pt2, pt3):
                 this_size = -this_size
@@ -1830,8 +2283,40 @@ def is_separated_solution(row_max, col_max, sym_max, M):
 
     return True
 
-def find_solution(T1, id_row, id_col, only_separated_solutions):
+def solution_vector(M):
     """
+    The solution M (a list of Fractions) from one of the solvers, as a
+    vector over QQ if we have Sage and as a tuple of Fractions if not.
+
+    EXAMPLE:
+        sage: from triangle_dissections import *
+        sage: solution_vector([Fraction(1, 2), Fraction(0)])
+        (1/2, 0)
+    """
+
+    if QQ is None: return tuple(M)
+
+    return vector(QQ, [QQ(x.numerator)/x.denominator for x in M])
+
+def denominator(x):
+    """
+    The denominator of a Sage rational or a Fraction.
+    """
+
+    if isinstance(x, Fraction): return x.denominator
+
+    return x.denominator()
+
+def find_solution(T1, id_row, id_col, only_separated_solutions, solver = 'sparse'):
+    """
+    Solve Eq(T, a) where a = (id_row, id_col, T1[id_row, id_col]). The
+    solver is one of 'sparse' (see sparse_solver.py), 'crt' (the
+    multi-modular solver in modular_solver.py) or 'echelon', which uses
+    the echelon form of the dense matrix from trade_dissection_matrix().
+    All of them give the same solution vector.
+    The solver may also be a per-bitrade solver for T1 (see
+    bitrade_solver()) in which case we use its solve() method.
+
     EXAMPLES:
 
         sage: from triangle_dissections import *
@@ -1841,6 +2326,12 @@ def find_solution(T1, id_row, id_col, only_separated_solutions):
 
         sage: find_solution(T1, 5, 3, only_separated_solutions = True)
         (6, 5, 6, 5, 3, (17/39, 4/13, 20/39, 28/39, 19/39, 0, 8/39, 11/39, 1/3, 0, 20/39, 25/39, 28/39, 10/13, 20/39, 1, 32/39))
+        sage: find_solution(T1, 5, 3, only_separated_solutions = True, solver = 'echelon')
+        (6, 5, 6, 5, 3, (17/39, 4/13, 20/39, 28/39, 19/39, 0, 8/39, 11/39, 1/3, 0, 20/39, 25/39, 28/39, 10/13, 20/39, 1, 32/39))
+        sage: find_solution(T1, 5, 3, only_separated_solutions = True, solver = 'crt')
+        (6, 5, 6, 5, 3, (17/39, 4/13, 20/39, 28/39, 19/39, 0, 8/39, 11/39, 1/3, 0, 20/39, 25/39, 28/39, 10/13, 20/39, 1, 32/39))
+        sage: find_solution(T1, 5, 3, only_separated_solutions = True, solver = bitrade_solver(T1, 'incremental'))
+        (6, 5, 6, 5, 3, (17/39, 4/13, 20/39, 28/39, 19/39, 0, 8/39, 11/39, 1/3, 0, 20/39, 25/39, 28/39, 10/13, 20/39, 1, 32/39))
     """
 
     assert id_row is not None
@@ -1848,14 +2339,111 @@ def find_solution(T1, id_row, id_col, only_separated_solutions):
 
     assert T1[id_row, id_col] >= 0
 
-    row_max, col_max, sym_max, M = trade_dissection_matrix(T1, id_row, id_col)
-    M = M.echelon_form().column(-1)
+    if solver in ['sparse', 'crt']:
+        if solver == 'sparse': solve = sparse_solve_dissection
+        else: solve = modular_solve_dissection
+
+        row_max, col_max, sym_max = T1.actual_row_col_sym_sizes()
+        M = solve(trade_triples(T1), row_max, col_max, sym_max, (id_row, id_col, T1[id_row, id_col]))
+        M = solution_vector(M)
+    elif solver == 'echelon':
+        if QQ is None: raise ValueError, "the echelon solver needs Sage"
+
+        row_max, col_max, sym_max, M = trade_dissection_matrix(T1, id_row, id_col)
+        M = M.echelon_form().column(-1)
+    elif hasattr(solver, 'solve'):
+        row_max, col_max, sym_max = solver.row_max, solver.col_max, solver.sym_max
+        M = solver.solve((id_row, id_col, T1[id_row, id_col]))
+        M = solution_vector(M)
+    else:
+        raise ValueError, "unknown solver " + str(solver)
 
     if only_separated_solutions and (not is_separated_solution(row_max, col_max, sym_max, M)):
         raise ValueError, "no separated solution at " + str(id_row) + ", " + str(id_col)
     else:
         return row_max, col_max, sym_max, id_row, id_col, M
 
+def nr_solution_triangles(T2, solution):
+    """
+    The number of triangles of positive size in the dissection for a
+    solution of Eq(T, a), as returned by find_solution(), without
+    building the dissection. The entry (r, c, s) of T2 gives a triangle
+    of side |w_s - w_r - w_c|, which is 0 when the solution degenerates
+    at that entry (see T2_degenerate_entries in TriangleDissection).
+    A solution with fewer than |T1| triangles gives a dissection that
+    also comes from a smaller bitrade.
+
+    EXAMPLES:
+        sage: from triangle_dissections import *
+        sage: U1 = LatinSquare(matrix(ZZ, [(0, 1, 2), (1, -1, 0), (-1, 2, 1)]))
+        sage: U2 = LatinSquare(matrix(ZZ, [(1, 2, 0), (0, -1, 1), (-1, 1, 2)]))
+        sage: solution = find_solution(U1, 0, 0, only_separated_solutions = False)
+        sage: nr_solution_triangles(U2, solution)
+        4
+        sage: len(TriangleDissection(U1, U2, 0, 0, solution = solution).triangles)
+        4
+    """
+
+    row_max, col_max, sym_max, id_row, id_col, M = solution
+
+    nr_triangles = 0
+    for (r, c, s) in trade_triples(T2):
+        if M[s + row_max + col_max] - M[r] - M[c + row_max] != 0: nr_triangles += 1
+
+    return nr_triangles
+
+def bitrade_solver(T1, solver):
+    """
+    The counting drivers solve Eq(T, a) for every triple a of T1. This
+    returns the solver to pass to TriangleDissection for each of these
+    systems: for solver = 'incremental' we factor the system for T1 once
+    (see BitradeSolver in sparse_solver.py), for solver = 'batch' we
+    solve all of the systems at once in float64 and certify the results
+    exactly (see BatchSolver in batch_solver.py, which needs numpy).
+    Otherwise the solver is returned unchanged.
+
+    EXAMPLES:
+        sage: from triangle_dissections import *
+        sage: T1 = LatinSquare(matrix(ZZ, [(0, 1, 2), (1, -1, 0), (-1, 2, 1)]))
+        sage: bitrade_solver(T1, 'sparse')
+        'sparse'
+        sage: s = bitrade_solver(T1, 'incremental')
+        sage: (s.row_max, s.col_max, s.sym_max)
+        (3, 3, 3)
+        sage: s = bitrade_solver(T1, 'batch')
+        sage: s.nr_certified, s.nr_fallbacks
+        (7, 0)
+    """
+
+    if solver == 'incremental':
+        row_max, col_max, sym_max = T1.actual_row_col_sym_sizes()
+        return BitradeSolver(trade_triples(T1), row_max, col_max, sym_max)
+
+    if solver == 'batch':
+        from batch_solver import BatchSolver
+
+        row_max, col_max, sym_max = T1.actual_row_col_sym_sizes()
+        return BatchSolver(trade_triples(T1), row_max, col_max, sym_max)
+
+    return solver
+
+def trade_triples(T):
+    """
+    The entries (r, c, s) of the partial latin square T, in row-major
+    order. For the squares of a Bitrade these are read straight off
+    its cells.
+
+    EXAMPLES:
+        sage: from triangle_dissections import *
+        sage: T1 = LatinSquare(matrix(ZZ, [(0, 1, 2), (1, -1, 0), (-1, 2, 1)]))
+        sage: trade_triples(T1)
+        [(0, 0, 0), (0, 1, 1), (0, 2, 2), (1, 0, 1), (1, 2, 0), (2, 1, 2), (2, 2, 1)]
+    """
+
+    if isinstance(T, BitradeSquare): return T.triples()
+
+    return [(r, c, T[r, c]) for r in range(T.nrows()) for c in range(T.ncols()) if T[r, c] >= 0]
+
 def trade_dissection_matrix(T, id_row, id_col):
     """
     EXAMPLES:
@@ -1882,8 +2470,13 @@ def trade_dissection_matrix(T, id_row, id_col):
         [ 0  0  0  0  0  0  0  0  0  1  0  0  0  0  0  0  0  0]
         [ 0  0  0  0  0  0  0  0  0  0  0  0  0  0  0  1  0  1]
         [ 0  0  0  0  0  1  0  0  0  0  1  0  0  0 -1  0  0  0])
+
+    For a Bitrade we use its first square:
+        sage: trade_dissection_matrix(latin_squares_to_bitrade(T1, T2), 5, 3) == trade_dissection_matrix(T1, 5, 3)
+        True
     """
 
+    if isinstance(T, Bitrade): T = T.T1
 
     assert T[id_row, id_col] >= 0
 
@@ -1898,36 +2491,32 @@ def trade_dissection_matrix(T, id_row, id_col):
     # a column for the rhs.
     nr_columns = row_max+col_max+sym_max+1
 
-    for r in range(row_max):
-        for c in range(col_max):
-            s = T[r, c]
-            if s < 0: continue
-
-            if r == id_row and c == id_col and s == id_sym:
-                # here we have the equations
-                # id_row = id_col = 0, id_sym = 1.
-                new_row = nr_columns*[0]
-                new_row[id_row] = 1                
-                rows.append(new_row)
+    for (r, c, s) in trade_triples(T):
+        if r == id_row and c == id_col and s == id_sym:
+            # here we have the equations
+            # id_row = id_col = 0, id_sym = 1.
+            new_row = nr_columns*[0]
+            new_row[id_row] = 1                
+            rows.append(new_row)
 
-                new_row = nr_columns*[0]
-                new_row[id_col + row_max] = 1                
-                rows.append(new_row)
+            new_row = nr_columns*[0]
+            new_row[id_col + row_max] = 1                
+            rows.append(new_row)
 
-                new_row = nr_columns*[0]
-                new_row[id_sym + row_max + col_max] = 1                
-                new_row[-1] = 1                
-                rows.append(new_row)
+            new_row = nr_columns*[0]
+            new_row[id_sym + row_max + col_max] = 1                
+            new_row[-1] = 1                
+            rows.append(new_row)
 
-                continue
+            continue
 
-            new_row = nr_columns*[0]
+        new_row = nr_columns*[0]
 
-            new_row[r] = 1
-            new_row[c + row_max] = 1
-            new_row[s + row_max+col_max] = -1
+        new_row[r] = 1
+        new_row[c + row_max] = 1
+        new_row[s + row_max+col_max] = -1
 
-            rows.append(new_row)
+        rows.append(new_row)
 
     return row_max, col_max, sym_max, matrix(QQ, rows)
 
@@ -1940,6 +2529,8 @@ def mark(x, y):
         'path(moveto_pt(2.83465, 0), arc_pt(0, 0, 2.83465, 0.1, 359.9), closepath())'
     """
 
+    import pyx
+
     return pyx.path.circle(x, y, 0.1)
 
 if False and __name__ == "__main__":
@@ -31,13 +31,18 @@ are those of the authors and should not be interpreted as representing
 official policies, either expressed or implied, of Carlo Hamalainen.
 '''
 
-import sage.all
-from sage.all import Rational
+import json
+import multiprocessing
+import os
+import subprocess
+import time
 
-import sympy
+from itertools import imap, izip
 
+# Only the drawing code (enumerate_unique_dissections) needs Sage, sympy
+# and pyx, so it imports draw_dissections itself. Counting runs without
+# them.
 from triangle_dissections import *
-from draw_dissections import *
 
 
 def enumerator_print_info(prefix, current_size, unique_dissections):
@@ -45,11 +50,14 @@ def enumerator_print_info(prefix, current_size, unique_dissections):
         t.write_PDF(prefix + "dissection" + str(current_size) + "_i" + str(i_uniq) + "_r" + str(r)
                      + "_c" + str(c) + ".pdf", draw_labels = False)
 
-def enumerate_unique_dissections(prefix = "output/", max_size = None, dissection_filter = (lambda x: True)):
+def enumerate_unique_dissections(prefix = "output/", max_size = None, dissection_filter = (lambda x: True), solver = 'incremental'):
+    from draw_dissections import canonical_signature
+
+    # Bitrades isomorphic to earlier ones give the same dissections.
     if max_size is not None:
-        g = spherical_iterator(max_size = max_size)
+        g = unique_bitrades(spherical_iterator(max_size = max_size, bitrades = True))
     else:
-        g = spherical_iterator()
+        g = unique_bitrades(spherical_iterator(bitrades = True))
 
     current_size = -1
     unique_dissections = {}
@@ -58,22 +66,24 @@ def enumerate_unique_dissections(prefix = "output/", max_size = None, dissection
 
     while True:
         try:
-            T1, T2 = g.next()
+            B = g.next()
             i += 1
         except StopIteration:
             break
 
+        T1, T2 = B.T1, B.T2
+
         if current_size < 0: current_size = T1.nr_filled_cells()
 
         if T1.nr_filled_cells() != current_size:
             current_size = T1.nr_filled_cells()
             print "looking at size", current_size
 
-        for r, c in cross(range(T1.nrows()), range(T1.ncols())):
-            if T1[r, c] < 0: continue
+        T1_solver = bitrade_solver(T1, solver)
 
+        for (r, c, s) in trade_triples(T1):
             try:
-                t = TriangleDissection(T1, T2, r, c, only_separated_solutions = False)
+                t = TriangleDissection(T1, T2, r, c, only_separated_solutions = False, solver = T1_solver)
             except ValueError:
                 continue # there was no (separated?) solution
 
@@ -95,53 +105,384 @@ def enumerate_unique_dissections(prefix = "output/", max_size = None, dissection
         print "    ", s, len(unique_dissections[s])
         enumerator_print_info(prefix, s, unique_dissections[s])
 
-def disk_count_dissections(min_size, max_size, only_sep):
-    g = spherical_iterator(min_size, max_size)
+def bitrade_signatures(T1, T2, only_sep, solver = 'batch', orbits = False, check_orbits = False, keep_degenerate = False):
+    """
+    The dissections of the bitrade (T1, T2), one for each identity cell
+    of T1 that has a (separated, if only_sep) solution. Returns a list
+    of (size, signature, aut) where size is the number of triangles,
+    signature is the canonical signature as a line of text and aut is
+    the order of the automorphism group.
+
+    A solution where some of the triangles degenerate gives a dissection
+    with fewer than |T1| triangles, which a smaller bitrade also gives
+    (as in td.cpp). We count the triangles straight from the solution
+    (see nr_solution_triangles) and leave these out without building
+    the dissection, unless keep_degenerate = True.
+
+    Identity cells in the same orbit of the autotopism group of the
+    bitrade give the same signature, so with orbits = True we only use
+    the first cell of each orbit (see Bitrade.cell_orbits). With
+    check_orbits = True we also solve the other cells and check that
+    they give the same signature as the first cell of their orbit.
+
+    EXAMPLES:
+        sage: from unique_dissections import *
+        sage: T1, T2 = spherical_iterator(4, 4).next()
+        sage: [(size, aut) for (size, sig, aut) in bitrade_signatures(T1, T2, True)]
+        [(4, 6), (4, 6), (4, 6), (4, 6)]
+
+    T1 and T2 may also be the squares of a Bitrade:
+        sage: B = spherical_iterator(4, 4, bitrades = True).next()
+        sage: bitrade_signatures(B.T1, B.T2, True) == bitrade_signatures(T1, T2, True)
+        True
+
+    Nonseparated solutions of a bitrade can degenerate:
+        sage: C = BitradeCorpus('spherical_bitrades/spherical_bitrades_7').bitrade(0)
+        sage: sorted(set([size for (size, sig, aut) in bitrade_signatures(C.T1, C.T2, False, keep_degenerate = True)]))
+        [4, 7]
+        sage: sorted(set([size for (size, sig, aut) in bitrade_signatures(C.T1, C.T2, False)]))
+        [7]
+
+    The intercalate has one orbit of cells:
+        sage: bitrade_signatures(B.T1, B.T2, True, orbits = True, check_orbits = True)[0] == bitrade_signatures(T1, T2, True)[0]
+        True
+        sage: len(bitrade_signatures(B.T1, B.T2, True, orbits = True))
+        1
+    """
+
+    signatures = []
+
+    T1_solver = bitrade_solver(T1, solver)
+    nr_cells = T1.nr_filled_cells()
+
+    # The cells of the Bitrade are in the same order as trade_triples(T1).
+    if orbits:
+        if isinstance(T1, BitradeSquare): B = T1.bitrade
+        else: B = latin_squares_to_bitrade(T1, T2)
+
+        cell_orbits = B.cell_orbits()
+    else:
+        cell_orbits = range(nr_cells)
 
-    i = -1
+    # The signature (or None) of the first cell of each orbit.
+    orbit_signatures = {}
 
-    current_perfect_dissection_size = -1
-    perfect_dissections = {}
+    for (k, (r, c, s)) in enumerate(trade_triples(T1)):
+        if cell_orbits[k] != k and not check_orbits: continue
 
-    signature_files = {}
+        try:
+            solution = find_solution(T1, r, c, only_sep, T1_solver)
+        except ValueError:
+            solution = None # there was no (separated?) solution
+
+        if solution is None or (not keep_degenerate and nr_solution_triangles(T2, solution) != nr_cells):
+            signature = None
+        else:
+            t = TriangleDissection(T1, T2, r, c, solution = solution, compact = True)
+            sig, aut = t.canonical_signature(aut_group_size = True)
+            signature = (t.nr_triangles(), ' '.join(map(str, sig)), aut)
+
+        if cell_orbits[k] != k:
+            assert signature == orbit_signatures[cell_orbits[k]]
+            continue
+
+        orbit_signatures[k] = signature
+        if signature is not None: signatures.append(signature)
+
+    return signatures
+
+def check_swapped_signatures(B, signatures, only_sep, solver = 'batch', orbits = False, keep_degenerate = False):
+    """
+    When (T2, T1) is isomorphic to a conjugate of the bitrade B = (T1,
+    T2) (see Bitrade.swap_isomorphism) the signatures of (T2, T1) are
+    those of (T1, T2). Check this by solving (T2, T1), where signatures
+    is what bitrade_signatures gave for (T1, T2), and check that each
+    dissection of (T2, T1) is the image of the corresponding dissection
+    of (T1, T2) under conjugate_point.
+
+    EXAMPLES:
+        sage: from unique_dissections import *
+        sage: B = BitradeCorpus('spherical_bitrades/spherical_bitrades_8').bitrade(1)
+        sage: B.swap_isomorphism() is not None
+        True
+        sage: check_swapped_signatures(B, bitrade_signatures(B.T1, B.T2, False), False)
+    """
+
+    p, phi = B.swap_isomorphism()
+
+    assert sorted(signatures) == sorted(bitrade_signatures(B.T2, B.T1, only_sep, solver, orbits, keep_degenerate = keep_degenerate))
+
+    T1_triples = B.T1.triples()
+    T2_triples = B.T2.triples()
+
+    for k in range(len(B)):
+        (r, c, s) = T1_triples[k]
+        try:
+            t = TriangleDissection(B.T1, B.T2, r, c, only_separated_solutions = only_sep)
+        except ValueError:
+            t = None
 
-    while True:
+        (r, c, s) = T2_triples[phi[k]]
         try:
-            T1, T2 = g.next()
-            i += 1
-        except StopIteration:
-            break
+            u = TriangleDissection(B.T2, B.T1, r, c, only_separated_solutions = only_sep)
+        except ValueError:
+            u = None
 
-        for r, c in cross(range(T1.nrows()), range(T1.ncols())):
-            if T1[r, c] < 0: continue
+        assert (t is None) == (u is None)
+        if t is None: continue
+
+        image = [tuple(sorted([conjugate_point(p, pt, t.unit) for pt in x])) for x in t.triangles]
+        assert sorted(image) == sorted(u.triangles.keys())
 
-            t = None
+def spherical_tasks(min_size, max_size, nr_workers, bitrades_done = {}, max_task_size = 64):
+    """
+    Split the spherical bitrades of sizes min_size to max_size into
+    contiguous ranges (size, filename, start, stop), in the same order
+    as spherical_iterator, with a few ranges per worker for each size
+    and at most max_task_size bitrades in a range. The first
+    bitrades_done[size] bitrades of each size are skipped.
+
+    EXAMPLES:
+        sage: from unique_dissections import *
+        sage: spherical_tasks(4, 8, 2)
+        [(4, 'spherical_bitrades/spherical_bitrades_4', 0, 1), (6, 'spherical_bitrades/spherical_bitrades_6', 0, 1), (7, 'spherical_bitrades/spherical_bitrades_7', 0, 1), (8, 'spherical_bitrades/spherical_bitrades_8', 0, 1), (8, 'spherical_bitrades/spherical_bitrades_8', 1, 2)]
+        sage: spherical_tasks(4, 8, 2, bitrades_done = {4: 1, 6: 1, 7: 1, 8: 1})
+        [(8, 'spherical_bitrades/spherical_bitrades_8', 1, 2)]
+    """
+
+    tasks = []
+
+    for size in range(min_size, max_size + 1):
+        if size == 5: continue # no bitrades of size 5
+
+        filename = "spherical_bitrades/spherical_bitrades_" + str(size)
+        if not os.path.exists(filename): break
+
+        # Build the index here so that the workers only have to load it.
+        corpus = BitradeCorpus(filename)
+
+        start = bitrades_done.get(size, 0)
+        nr_left = len(corpus) - start
+
+        nr_shards = max(4*nr_workers, (nr_left + max_task_size - 1)/max_task_size)
+        shard_size = (nr_left + nr_shards - 1)/nr_shards
+
+        while start < len(corpus):
+            tasks.append((size, filename, start, min(start + shard_size, len(corpus))))
+            start += shard_size
+
+    return tasks
+
+# Corpora opened by this worker process, by file name.
+_worker_corpora = {}
+
+def _count_worker(task):
+    """
+    Worker for disk_count_dissections. Returns the signatures of the
+    bitrades in one range of a corpus, in the order spherical_iterator
+    would give them, skipping the inputs (k, swapped) in duplicates
+    (see BitradeCorpus.duplicates). With swap_symmetry the signatures of
+    (T2, T1) are taken from those of (T1, T2) if the two are isomorphic
+    up to conjugation (see check_swapped_signatures).
+    """
+
+    (size, filename, start, stop), only_sep, solver, duplicates, orbits, check_orbits, swap_symmetry, check_swap, keep_degenerate = task
+
+    if not _worker_corpora.has_key(filename):
+        _worker_corpora[filename] = BitradeCorpus(filename)
+
+    duplicates = set(duplicates)
+    signatures = []
+
+    for k in range(start, stop):
+        B = _worker_corpora[filename].bitrade(k)
+
+        if (k, False) not in duplicates:
+            T1_signatures = bitrade_signatures(B.T1, B.T2, only_sep, solver, orbits, check_orbits, keep_degenerate)
+            signatures += T1_signatures
+
+            if (k, True) not in duplicates and swap_symmetry and B.swap_isomorphism() is not None:
+                if check_swap: check_swapped_signatures(B, T1_signatures, only_sep, solver, orbits, keep_degenerate)
+                signatures += T1_signatures
+                continue
+
+        if (k, True) not in duplicates:
+            signatures += bitrade_signatures(B.T2, B.T1, only_sep, solver, orbits, check_orbits, keep_degenerate)
+
+    return signatures
+
+def write_atomically(filename, contents):
+    """
+    Replace the file with the given contents, so that a crash leaves
+    either the old or the new file.
+
+    EXAMPLES:
+        sage: from unique_dissections import *
+        sage: import tempfile
+        sage: filename = tempfile.mktemp()
+        sage: write_atomically(filename, 'boo')
+        sage: open(filename).read()
+        'boo'
+        sage: os.remove(filename)
+    """
+
+    f = open(filename + '.tmp', 'w')
+    f.write(contents)
+    f.flush()
+    os.fsync(f.fileno())
+    f.close()
+
+    os.rename(filename + '.tmp', filename)
+
+def count_aut_groups_file(sig_filename):
+    """
+    The number of distinct lines of a signatures file written with
+    aut_groups = True (see disk_count_dissections) whose automorphism
+    group has order 1, 2, 3, 6, as a dictionary. The lines are made
+    unique by an external 'sort -u', like aut_groups.sh in
+    dissections-cpp, so only the counts are held in memory.
+
+    EXAMPLES:
+        sage: from unique_dissections import *
+        sage: import tempfile
+        sage: filename = tempfile.mktemp()
+        sage: open(filename, 'w').write('6 0 1\\n2 0 2\\n6 0 1\\n1 0 3\\n')
+        sage: count_aut_groups_file(filename)
+        {1: 1, 2: 1, 3: 0, 6: 1}
+        sage: os.remove(filename)
+    """
+
+    env = dict(os.environ)
+    env['LC_ALL'] = 'C'
+
+    p = subprocess.Popen(['sort', '-u', sig_filename], stdout = subprocess.PIPE, env = env)
+
+    counts = {1:0, 2:0, 3:0, 6:0}
+    for line in p.stdout:
+        counts[int(line.split(' ', 1)[0])] += 1
+
+    p.stdout.close()
+    if p.wait() != 0: raise ValueError, "sort failed on " + sig_filename
+
+    return counts
+
+def disk_count_dissections(min_size, max_size, only_sep, solver = 'batch', aut_groups = False, nr_workers = 1, resume = False, checkpoint_interval = 300, dedupe = True, orbits = True, check_orbits = False, swap_symmetry = True, check_swap = False, keep_degenerate = False):
+    """
+    Write the signatures of all (separated, if only_sep) dissections
+    from the spherical bitrades of sizes min_size to max_size to the
+    files signatures_only_sep=..._n, where n is the number of triangles.
+
+    With aut_groups = True each line is prefixed with the order of the
+    automorphism group of its dissection, as with 'td --aut-groups', and
+    at the end the counts of the distinct signatures of each size with
+    groups of order 1, 2, 3, 6 are written to aut_groups_only_sep=...
+    (see count_aut_groups_file). Nothing is kept in memory for this.
+
+    With nr_workers > 1 the bitrades are split into contiguous ranges
+    which are solved and canonicalised by a pool of worker processes.
+    The results are written in the order of the ranges, so the output
+    is the same as for a single process.
+
+    Every checkpoint_interval seconds we write the number of bitrades
+    done for each size, and the length of each signatures file, to
+    checkpoint_only_sep=... . The bitrade sizes that are finished are
+    listed in manifest_only_sep=... . With resume = True we carry on
+    from the last checkpoint: the signature files are cut back to their
+    checkpointed lengths and the finished sizes are skipped.
+
+    With dedupe = True we skip each input (T1, T2) that is isomorphic,
+    up to relabelling and conjugation, to one before it (see
+    Bitrade.canonical_form). These give the same signatures, so the
+    signature files have fewer repeated lines but the same distinct
+    signatures and automorphism group counts.
+
+    Similarly with orbits = True we solve one identity cell in each
+    orbit of the autotopism group of each bitrade (see
+    bitrade_signatures); check_orbits = True checks that the other cells
+    give the same signatures.
+
+    swap_symmetry and check_swap only apply with dedupe = False, since
+    otherwise a (T2, T1) that is isomorphic to a conjugate of (T1, T2)
+    is already skipped as a duplicate and there is nothing to save. With
+    dedupe = False and swap_symmetry = True we don't solve such a
+    (T2, T1), whose dissections are images of those of (T1, T2);
+    check_swap = True solves it anyway and compares (see
+    check_swapped_signatures).
+
+    Solutions with degenerate triangles give dissections that smaller
+    bitrades also give, so they are skipped before canonicalisation
+    unless keep_degenerate = True, in which case they are written under
+    their smaller number of triangles as before. The distinct
+    signatures of each size are the same either way.
+    """
+
+    checkpoint_filename = "checkpoint_only_sep=" + str(only_sep)
+    manifest_filename = "manifest_only_sep=" + str(only_sep)
 
-            try:
-                t = TriangleDissection(T1, T2, r, c, only_separated_solutions = only_sep)
-            except ValueError:
-                continue # there was no (separated?) solution
+    signature_files = {}
 
-            this_size = len(t.triangles)
+    # Number of bitrades of each size that have been processed.
+    bitrades_done = {}
 
-            if False: # fixme pull this back in later
-                if not lowerbound and t.is_perfect_dissection():
-                    if this_size != current_perfect_dissection_size:
-                        for (p, i_p, r_p, c_p) in perfect_dissections.itervalues():
-                            p.write_PDF("perfect_dissection_size" + str(current_perfect_dissection_size)
-                                + "_" + str(i_p) + "_r" + str(r_p) + "_c" + str(c_p)
-                                + ".pdf", draw_labels = False, draw_sizes = True)
+    # Bitrade sizes that have been finished, with the number of bitrades.
+    finished_sizes = {}
 
-                        perfect_dissections = {}
-                        current_perfect_dissection_size = this_size
+    if resume and os.path.exists(checkpoint_filename):
+        checkpoint = json.load(open(checkpoint_filename))
 
-                    perfect_dissections[t.canonical_signature()] = [t, i, r, c]
+        bitrades_done = dict([(int(k), v) for (k, v) in checkpoint['bitrades_done'].iteritems()])
+        finished_sizes = dict([(int(k), v) for (k, v) in checkpoint['finished_sizes'].iteritems()])
 
-            sig = t.canonical_signature()
-            sig = ' '.join(map(str, sig))
+        for (this_size, position) in checkpoint['positions'].iteritems():
+            this_size = int(this_size)
+            sig_filename = "signatures_only_sep=" + str(only_sep) + "_" + str(this_size)
 
+            # Drop anything written after the checkpoint.
+            f = open(sig_filename, 'r+')
+            f.truncate(position)
+            f.seek(position)
+            signature_files[this_size] = f
+
+    def save_checkpoint():
+        positions = {}
+        for (this_size, f) in signature_files.iteritems():
+            f.flush()
+            os.fsync(f.fileno())
+            positions[this_size] = f.tell()
+
+        write_atomically(checkpoint_filename, json.dumps({'bitrades_done': bitrades_done,
+                                                          'finished_sizes': finished_sizes,
+                                                          'positions': positions}))
+        write_atomically(manifest_filename, ''.join(["%d %d\n" % (size, finished_sizes[size]) for size in sorted(finished_sizes.keys())]))
+
+    tasks = spherical_tasks(min_size, max_size, nr_workers, bitrades_done)
+
+    if dedupe: swap_symmetry = check_swap = False
+
+    duplicates = {}
+    if dedupe:
+        for filename in set([filename for (size, filename, start, stop) in tasks]):
+            duplicates[filename] = BitradeCorpus(filename).duplicates()
+
+    worker_tasks = [((size, filename, start, stop), only_sep, solver,
+                     [(k, swapped) for (k, swapped) in duplicates.get(filename, []) if start <= k < stop],
+                     orbits, check_orbits, swap_symmetry, check_swap, keep_degenerate)
+                    for (size, filename, start, stop) in tasks]
+
+    if nr_workers > 1:
+        pool = multiprocessing.Pool(nr_workers)
+        results = pool.imap(_count_worker, worker_tasks)
+    else:
+        pool = None
+        results = imap(_count_worker, worker_tasks)
+
+    last_checkpoint = time.time()
+    corpus_sizes = {}
+
+    for ((size, filename, start, stop), signatures) in izip(tasks, results):
+        for (this_size, sig, aut) in signatures:
             sig_filename = "signatures_only_sep=" + str(only_sep) + "_" + str(this_size)
- 
+
             if not signature_files.has_key(this_size):
                 # Flush out any partial results
                 for f in signature_files.itervalues(): f.flush()
@@ -149,18 +490,39 @@ def disk_count_dissections(min_size, max_size, only_sep):
                 # Open a file for the new signatures
                 signature_files[this_size] = open(sig_filename, 'w')
 
+            if aut_groups: signature_files[this_size].write(str(aut) + ' ')
             signature_files[this_size].write(str(sig))
             signature_files[this_size].write('\n')
-            
-    for f in signature_files.itervalues(): f.close()
 
-    # FIXME debugging, don't save perfect dissections at the moment
-    return
+        bitrades_done[size] = stop
+
+        if not corpus_sizes.has_key(filename):
+            corpus_sizes[filename] = len(BitradeCorpus(filename))
+
+        if stop == corpus_sizes[filename]:
+            finished_sizes[size] = stop
+            save_checkpoint()
+            last_checkpoint = time.time()
+        elif time.time() - last_checkpoint > checkpoint_interval:
+            save_checkpoint()
+            last_checkpoint = time.time()
+
+    if pool is not None:
+        pool.close()
+        pool.join()
 
-    for (p, i_p, r_p, c_p) in perfect_dissections.itervalues():
-        p.write_PDF("perfect_dissection_size" + str(current_perfect_dissection_size)
-            + "_" + str(i_p) + "_r" + str(r_p) + "_c" + str(c_p)
-            + ".pdf", draw_labels = False, draw_sizes = True)
+    save_checkpoint()
+
+    for f in signature_files.itervalues(): f.close()
+
+    if aut_groups:
+        # Same format as aut_groups.sh in dissections-cpp.
+        f = open("aut_groups_only_sep=" + str(only_sep), 'w')
+        for this_size in sorted(signature_files.keys()):
+            counts = count_aut_groups_file("signatures_only_sep=" + str(only_sep) + "_" + str(this_size))
+            f.write(' '.join(map(str, [this_size, counts[1], counts[2], counts[3], counts[6]])))
+            f.write('\n')
+        f.close()
 
 def usage():
     print
@@ -177,6 +539,10 @@ def usage():
     print "a command like this:"
     print "$ sort signatures_12 | uniq | wc -l"
     print
+    print "With disk_count_dissections(..., aut_groups = True) each signature is"
+    print "prefixed with the order of its automorphism group and the counts of"
+    print "groups of order 1, 2, 3, 6 for each size are in the file 'aut_groups_x'."
+    print
     sys.exit(0)
 
 if __name__ == "__main__":